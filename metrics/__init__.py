@@ -0,0 +1,54 @@
+import json
+import azure.functions as func
+from common.clients import get_pool
+from common.archive import get_archive
+from common.cache import get_cache
+from common.gpt import USAGE
+from common.metrics import METRICS, render_prometheus
+from common.microbatch import get_microbatcher
+from common.neardup import get_neardup
+from common.pipeline import STATS
+from common.ratelimit import get_scheduler
+from common.resilience import breaker_stats, hedge_stats, latency_stats
+from common.sender_risk import get_sender_risk
+from common.watchlist import get_watchlist
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus text exposition of this worker process: stage latency summaries, request
+    outcomes, and pool / cache / scheduler / breaker / hedge / endpoint latency / archive /
+    near-duplicate / sender-risk / GPT / micro-batching counters. `?format=json` returns the
+    same data as JSON.
+    """
+    pool = get_pool()
+    s = pool.settings
+    if not s.get("metrics_enabled", True):
+        return func.HttpResponse(json.dumps({"error": "Metrics are disabled (TRIAGE_METRICS=false)"}),
+                                 mimetype="application/json", status_code=404)
+
+    cache = get_cache(s, lambda: get_pool().blob)
+    scheduler = get_scheduler(s)
+    neardup = get_neardup(s, lambda: get_pool().blob)
+    sender_risk = get_sender_risk(s, lambda: get_pool().blob)
+    microbatch = get_microbatcher(s)
+    watchlist = get_watchlist(s, lambda: get_pool().blob)
+    groups = {
+        "pool": pool.stats(),
+        "cache": cache.stats() if cache else {},
+        "ratelimit": scheduler.stats() if scheduler else {},
+        "breaker": breaker_stats(),
+        "hedge": hedge_stats(),
+        "latency": latency_stats(),
+        "archive": get_archive(s, lambda: get_pool().blob).stats(),
+        "neardup": neardup.stats() if neardup else {},
+        "sender_risk": sender_risk.stats() if sender_risk else {},
+        "gpt": USAGE,
+        "microbatch": microbatch.stats() if microbatch else {},
+        "watchlist": watchlist.stats() if watchlist else {},
+        "policy": STATS,
+    }
+    if req.params.get("format") == "json":
+        return func.HttpResponse(json.dumps({**METRICS.stats(), **groups}),
+                                 mimetype="application/json", status_code=200)
+    return func.HttpResponse(render_prometheus(groups), mimetype="text/plain; version=0.0.4", status_code=200)
@@ -0,0 +1,91 @@
+"""
+Maintain and query a local SQLite index over the triage archive.
+
+    python scripts/archive_index.py ingest                       # pull new archive entries (incremental)
+    python scripts/archive_index.py ingest --watch 60            # keep pulling every 60s
+    python scripts/archive_index.py query --sender inmate00042@facility.example --priority blocked --since 2024-06-01
+    python scripts/archive_index.py counts --by combined_priority --since 2024-06-01
+    python scripts/archive_index.py stats
+
+The index file defaults to triage_index.sqlite (--db). `ingest --dir PATH` reads a local copy of
+the container instead of Blob Storage.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--db", default="triage_index.sqlite")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    ing = sub.add_parser("ingest", help="pull new archive entries")
+    ing.add_argument("--dir", default=None, help="local copy of the container instead of Blob Storage")
+    ing.add_argument("--prefix", default=None, help="only list blobs under this prefix (Blob Storage)")
+    ing.add_argument("--watch", type=float, default=0.0, help="repeat every N seconds")
+
+    def filters(sp):
+        sp.add_argument("--since", help="ISO date/time (UTC), inclusive")
+        sp.add_argument("--until", help="ISO date/time (UTC), exclusive")
+        sp.add_argument("--sender")
+        sp.add_argument("--priority", dest="combined_priority")
+        sp.add_argument("--route", dest="routing_hint")
+        sp.add_argument("--sentiment")
+        sp.add_argument("--min-severity", type=int)
+        sp.add_argument("--blocked", type=int, choices=(0, 1))
+
+    q = sub.add_parser("query", help="list matching verdicts, newest first")
+    filters(q)
+    q.add_argument("--limit", type=int, default=100)
+
+    c = sub.add_parser("counts", help="counts grouped by a column (per day by default)")
+    filters(c)
+    c.add_argument("--by", default="combined_priority")
+    c.add_argument("--total", action="store_true", help="do not split by day")
+
+    sub.add_parser("stats", help="index size and watermarks")
+    args = p.parse_args()
+
+    from common.clients import load_settings
+    from common.index import ArchiveIndex, BlobSource, DirSource
+
+    index = ArchiveIndex(args.db)
+    if args.command == "ingest":
+        s = load_settings()
+        if args.dir:
+            source = DirSource(args.dir)
+        else:
+            from common.clients import get_pool
+            source = BlobSource(get_pool().blob, s, args.prefix)
+        while True:
+            started = time.monotonic()
+            stats = index.ingest(source, s)
+            print(json.dumps(dict(stats, elapsed_s=round(time.monotonic() - started, 2))), flush=True)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+        return
+
+    if args.command == "stats":
+        print(json.dumps(index.stats(), indent=2))
+        return
+
+    f = {k: getattr(args, k) for k in ("sender", "combined_priority", "routing_hint", "sentiment",
+                                       "min_severity", "blocked")}
+    started = time.perf_counter()
+    if args.command == "query":
+        rows = index.query(args.since, args.until, args.limit, **f)
+    else:
+        rows = index.counts(args.by, args.since, args.until, per_day=not args.total, **f)
+    for row in rows:
+        print(json.dumps(row))
+    print(f"# {len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
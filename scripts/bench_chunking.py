@@ -0,0 +1,134 @@
+"""
+Latency vs. body size for chunked analysis of long emails.
+
+    python scripts/bench_chunking.py --sizes 1000,5000,20000,100000 --repeat 5
+    python scripts/bench_chunking.py --no-chunking     # one call per service, for comparison
+
+Starts scripts/fake_services.py in-process, points the real SDK clients at it and triages
+synthetic bodies of each size (cache off). Prints p50/max latency, chunk counts and GPT
+prompt tokens per size, plus raw chunker throughput. The fake services do not enforce the
+real per-document limits, so --no-chunking only shows what chunking costs in latency.
+
+`merge_check` scores a long, friendly letter with one hostile paragraph through
+`merge_sentiment` (no service call): it must come out negative with the label equal to the
+argmax of the merged confidences, and a short hostile sign-off must not flip it. The script
+exits with status 1 if either fails.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+
+SENTENCES = [
+    "My VPN keeps disconnecting every few minutes.",
+    "Thanks for looking into the printer issue last week.",
+    "The shared drive is not mapping after the update.",
+    "Please reset my password, I cannot log in to the portal.",
+    "We have a deadline on Friday and the build server is down.",
+    "Forwarded message follows below, see the original thread.",
+    "I appreciate the quick response from the team.",
+]
+
+
+def make_body(size: int, rng: random.Random) -> str:
+    parts, n = [], 0
+    while n < size:
+        s = rng.choice(SENTENCES)
+        parts.append(s)
+        n += len(s) + 1
+        if rng.random() < 0.1:
+            parts.append("\n\n")
+    return " ".join(parts)[:size]
+
+
+def merge_check() -> dict:
+    from common.chunking import merge_sentiment
+    from common.models import SentimentResult
+
+    friendly = SentimentResult(sentiment="positive", confidence={"positive": 0.95, "neutral": 0.04, "negative": 0.01})
+    hostile = SentimentResult(sentiment="negative", confidence={"positive": 0.02, "neutral": 0.08, "negative": 0.9})
+    cases = {
+        "hostile_paragraph": (merge_sentiment([friendly] * 3 + [hostile], [5000] * 3 + [1500]), "negative"),
+        "hostile_sign_off": (merge_sentiment([friendly] * 2 + [hostile], [5000] * 2 + [120]), "positive"),
+    }
+    out = {}
+    for name, (merged, expected) in cases.items():
+        out[name] = {"sentiment": merged.sentiment, "confidence": merged.confidence,
+                     "ok": merged.sentiment == expected == max(merged.confidence, key=merged.confidence.get)}
+    return out
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--sizes", default="500,2000,5000,10000,20000,50000,100000")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--no-chunking", action="store_true")
+    args = p.parse_args()
+
+    server = fake_services.build_server("127.0.0.1", 0, fake_services.parse_args(["--port", "0"]))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": url, "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": url, "AZURE_CONTENT_SAFETY_KEY": "fake",
+        "AZURE_AI_LANGUAGE_ENDPOINT": url, "AZURE_AI_LANGUAGE_KEY": "fake",
+        "CACHE_ENABLED": "false",
+    })
+    if args.no_chunking:
+        big = str(10 ** 9)
+        os.environ.update({"CHUNK_SAFETY_CHARS": big, "CHUNK_SENTIMENT_CHARS": big, "GPT_EXCERPT_CHARS": "0"})
+
+    from common.clients import get_pool
+    from common.chunking import chunk_texts
+    from common.models import TriageInput
+    from common.pipeline import triage
+
+    pool = get_pool()
+    s = pool.settings
+    rng = random.Random(args.seed)
+    rows = []
+    for size in (int(x) for x in args.sizes.split(",")):
+        body = make_body(size, rng)
+        latencies, meta = [], {}
+        for i in range(args.repeat):
+            started = time.perf_counter()
+            out = triage(TriageInput(subject=f"bench {size} {i}", body=body), pool)
+            latencies.append((time.perf_counter() - started) * 1000)
+            meta = out.metadata
+        rows.append({
+            "chars": size,
+            "p50_ms": round(statistics.median(latencies), 1),
+            "max_ms": round(max(latencies), 1),
+            "chunks": meta.get("chunks", {"safety": 1, "sentiment": 1}),
+            "gpt_prompt_tokens": (meta.get("gpt_usage") or {}).get("prompt_tokens"),
+        })
+
+    text = make_body(5_000_000, rng)
+    started = time.perf_counter()
+    n = len(chunk_texts(text, s["chunk_safety_chars"] if not args.no_chunking else 10000, s["chunk_overlap_chars"]))
+    elapsed = time.perf_counter() - started
+
+    checks = merge_check()
+    print(json.dumps({
+        "chunking": not args.no_chunking,
+        "results": rows,
+        "chunker": {"chars": len(text), "chunks": n, "mb_per_s": round(len(text) / elapsed / 1e6, 1)},
+        "merge_check": checks,
+    }, indent=2))
+    server.shutdown()
+    if not all(c["ok"] for c in checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
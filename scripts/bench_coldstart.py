@@ -0,0 +1,135 @@
+"""
+Cold-start benchmark: time to import the triage function and to serve its first requests.
+
+    python scripts/bench_coldstart.py                      # 5 fresh interpreters against fake services
+    python scripts/bench_coldstart.py --runs 9 --warmup-on-load
+    python scripts/bench_coldstart.py --importtime 15      # slowest modules from python -X importtime
+
+Each run is a new Python process (nothing cached in memory), so it sees what a new Functions
+worker sees: `import triage` (the host does this on load), then the first request (clients
+built, connections opened) and a second one (everything warm). With --warmup-on-load the
+child sets WARMUP_ON_LOAD and waits --idle-s before the first request, the way a host that
+has just started would. Medians over --runs are reported. Fake services run in this process
+(any scripts/fake_services.py flag can be passed through); storage defaults to Azurite.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import threading
+from typing import Dict, Any, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+AZURITE = "UseDevelopmentStorage=true"
+
+PAYLOADS = [
+    {"subject": "Visitation", "body": "Can you confirm the visitation hours for next weekend? Thank you.",
+     "sender": "inmate00001@facility.example"},
+    {"subject": "Commissary", "body": "My commissary order was short two items and I was still charged.",
+     "sender": "inmate00002@facility.example"},
+]
+
+
+def child(args) -> None:
+    """
+    Runs inside the measured interpreter; prints one JSON line.
+    """
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import azure.functions as func
+    import triage as triage_function
+    imported = time.perf_counter()
+    if args.idle_s:
+        time.sleep(args.idle_s)
+
+    out: Dict[str, Any] = {"import_ms": round((imported - started) * 1000, 1)}
+    for i, payload in enumerate(PAYLOADS):
+        req = func.HttpRequest("POST", "/api/triage", body=json.dumps(payload).encode("utf-8"),
+                               headers={"Content-Type": "application/json"})
+        t = time.perf_counter()
+        resp = triage_function.main(req)
+        out[f"request{i + 1}_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        out[f"request{i + 1}_status"] = resp.status_code
+    print(json.dumps(out))
+    sys.stdout.flush()
+    os._exit(0)  # skip atexit flushes of the archive writer; they are not part of the start-up
+
+
+def importtime(top: int) -> List[Dict[str, Any]]:
+    """
+    Slowest modules (cumulative microseconds) when importing the triage function.
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import triage"], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append({"module": parts[2].strip(), "self_ms": round(int(parts[0].split(":")[1]) / 1000, 1),
+                     "cumulative_ms": round(int(parts[1]) / 1000, 1)})
+    return sorted(rows, key=lambda r: -r["cumulative_ms"])[:top]
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--warmup-on-load", action="store_true", help="set WARMUP_ON_LOAD in the child")
+    p.add_argument("--idle-s", type=float, default=None,
+                   help="pause between import and the first request (default 1.0 with --warmup-on-load, else 0)")
+    p.add_argument("--storage", default=AZURITE)
+    p.add_argument("--importtime", type=int, default=0, metavar="N", help="also list the N slowest imports")
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args, fake_argv = p.parse_known_args()
+    if args.idle_s is None:
+        args.idle_s = 1.0 if args.warmup_on_load else 0.0
+
+    if args.child:
+        child(args)
+        return
+
+    import fake_services
+    server = fake_services.build_server("127.0.0.1", 0, fake_services.parse_args(["--port", "0"] + fake_argv))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    env = dict(os.environ,
+               PYTHONPATH=os.path.join(ROOT, "src"),
+               AZURE_OPENAI_ENDPOINT=url, AZURE_OPENAI_API_KEY="fake",
+               AZURE_CONTENT_SAFETY_ENDPOINT=url, AZURE_CONTENT_SAFETY_KEY="fake",
+               AZURE_AI_LANGUAGE_ENDPOINT=url, AZURE_AI_LANGUAGE_KEY="fake",
+               CACHE_ENABLED="false", WARMUP_ON_LOAD="true" if args.warmup_on_load else "false")
+    env.setdefault("AZURE_STORAGE_CONNECTION_STRING", args.storage)
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--idle-s", str(args.idle_s)]
+
+    runs = []
+    for _ in range(args.runs):
+        t = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0 or not proc.stdout.strip():
+            sys.exit(proc.stderr)
+        run = json.loads(proc.stdout.strip().splitlines()[-1])
+        run["process_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        runs.append(run)
+    server.shutdown()
+
+    keys = ["import_ms", "request1_ms", "request2_ms", "process_ms"]
+    report: Dict[str, Any] = {
+        "config": {"runs": args.runs, "warmup_on_load": args.warmup_on_load, "idle_s": args.idle_s},
+        "median": {k: round(statistics.median(r[k] for r in runs), 1) for k in keys},
+        "status": sorted({(r["request1_status"], r["request2_status"]) for r in runs}),
+        "runs": runs,
+    }
+    if args.importtime:
+        report["slowest_imports"] = importtime(args.importtime)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+GPT requests, prompt tokens and latency with and without micro-batching.
+
+    python scripts/bench_microbatch.py
+    python scripts/bench_microbatch.py --rps 40 --requests 400 --window-ms 30 --max-items 8
+    python scripts/bench_microbatch.py --openai-rpm 1200 --malformed-rate 0.05
+
+Starts scripts/fake_services.py in-process and sends a seeded synthetic corpus through the
+GPT stage at a fixed arrival rate (open loop, like scripts/loadgen.py), once with one
+completion per message and once with MICROBATCH_ENABLED. The report gives, per run:
+completions sent, 429s, prompt / completion tokens, p50 / p95 / p99 latency from each
+message's scheduled arrival, and for the batched run the batch sizes and fallbacks.
+`--openai-ms-per-token` makes longer (batched) replies slower, as on the real service.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+from loadgen import synthetic_corpus  # noqa: E402
+
+
+def percentiles(values):
+    values = sorted(values) or [0.0]
+    pick = lambda q: round(values[min(int(q * len(values)), len(values) - 1)], 1)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def run(classify, inputs, rps: float):
+    """
+    Send `inputs` at `rps`; latency is measured from each message's scheduled arrival.
+    """
+    latencies, failed = [], 0
+    lock = threading.Lock()
+
+    def one(ti, scheduled):
+        nonlocal failed
+        try:
+            classify(ti)
+        except Exception:
+            with lock:
+                failed += 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - scheduled) * 1000.0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(256) as ex:
+        for i, ti in enumerate(inputs):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ex.submit(one, ti, scheduled)
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(latencies), ok=len(latencies), failed=failed, elapsed_s=round(elapsed, 2))
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--requests", type=int, default=300)
+    p.add_argument("--rps", type=float, default=30.0)
+    p.add_argument("--window-ms", type=float, default=20.0)
+    p.add_argument("--max-items", type=int, default=8)
+    p.add_argument("--openai-latency-ms", type=float, default=300.0)
+    p.add_argument("--openai-ms-per-token", type=float, default=1.0)
+    p.add_argument("--openai-rpm", type=float, default=0.0, help="fake deployment quota (0 = unlimited)")
+    p.add_argument("--malformed-rate", type=float, default=0.0, help="chat replies cut off mid-JSON")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    server = fake_services.build_server("127.0.0.1", 0, fake_services.parse_args([
+        "--port", "0", "--seed", str(args.seed), "--latency-dist", "lognormal", "--sigma", "0.3",
+        "--openai-latency-ms", str(args.openai_latency_ms), "--openai-ms-per-token", str(args.openai_ms_per_token),
+        "--openai-rpm", str(args.openai_rpm), "--malformed-rate", str(args.malformed_rate),
+    ]))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": url, "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": url, "AZURE_CONTENT_SAFETY_KEY": "fake",
+        "AZURE_AI_LANGUAGE_ENDPOINT": url, "AZURE_AI_LANGUAGE_KEY": "fake",
+        "TRIAGE_MAX_WORKERS": "64", "HEDGE_ENABLED": "false",
+    })
+
+    from common.clients import ClientPool, load_settings
+    from common.gpt import USAGE
+    from common.microbatch import classify_gpt_batched, get_microbatcher
+    from common.models import TriageInput
+
+    inputs = [TriageInput(**payload) for payload in synthetic_corpus(args.requests, args.seed)]
+    sim = server.RequestHandlerClass.sims["openai"]
+    report = {"settings": vars(args)}
+    for batched in (False, True):
+        s = dict(load_settings(), microbatch_enabled=batched, microbatch_window_ms=args.window_ms,
+                 microbatch_max_items=args.max_items)
+        pool = ClientPool(s)
+        route = pool.route("openai")
+        usage, server_before = dict(USAGE), dict(sim.counters)
+        result = run(lambda ti: classify_gpt_batched(route, s, ti), inputs, args.rps)
+        result.update({
+            "completions": USAGE["calls"] - usage["calls"],
+            "server_requests": sim.counters["requests"] - server_before["requests"],
+            "throttled_429": sim.counters["throttled"] - server_before["throttled"],
+            "prompt_tokens": USAGE["prompt_tokens"] - usage["prompt_tokens"],
+            "completion_tokens": USAGE["completion_tokens"] - usage["completion_tokens"],
+        })
+        if batched:
+            result["microbatch"] = get_microbatcher(s).stats()
+        report["batched" if batched else "single"] = result
+        pool.close()
+
+    single, batched = report["single"], report["batched"]
+    report["savings"] = {
+        "completions": round(1 - batched["completions"] / max(single["completions"], 1), 3),
+        "prompt_tokens": round(1 - batched["prompt_tokens"] / max(single["prompt_tokens"], 1), 3),
+        "total_tokens": round(1 - (batched["prompt_tokens"] + batched["completion_tokens"])
+                              / max(single["prompt_tokens"] + single["completion_tokens"], 1), 3),
+    }
+    print(json.dumps(report, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
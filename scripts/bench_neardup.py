@@ -0,0 +1,125 @@
+"""
+Near-duplicate index benchmark: lookup latency at scale and match quality on edited copies.
+
+    python scripts/bench_neardup.py                       # 2M entries
+    python scripts/bench_neardup.py --entries 5000000 --min-similarity 0.7
+
+The index is filled with random signatures (the cost of a lookup depends on bucket
+occupancy, not on where the signatures came from), then queried. Quality is measured on
+the synthetic corpus from loadgen.py: every message is indexed, then lightly edited copies
+(one word swapped, a line added or removed) are looked up. A match counts as wrong when
+the returned message is less similar (exact shingle Jaccard) than the one that was edited.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from common.neardup import NearDupIndex, fingerprint, shingles  # noqa: E402
+from loadgen import synthetic_corpus, FILLER  # noqa: E402
+
+
+def pct(values, q, digits=1):
+    values = sorted(values)
+    return round(values[min(int(q * len(values)), len(values) - 1)], digits) if values else 0.0
+
+
+def edit(body: str, rng: random.Random) -> str:
+    words = body.split()
+    kind = rng.choice(("swap", "append", "drop"))
+    if kind == "swap":
+        words[rng.randrange(len(words))] = rng.choice(["Saturday", "blue", "C-4", "tonight", "brother"])
+    elif kind == "append":
+        words += rng.choice(FILLER).split()
+    elif len(words) > 12:
+        del words[-rng.randint(2, 5):]
+    return " ".join(words)
+
+
+def jaccard(a: str, b: str, s) -> float:
+    x, y = set(shingles(a, s["neardup_shingle_words"])), set(shingles(b, s["neardup_shingle_words"]))
+    return len(x & y) / len(x | y) if x | y else 0.0
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--entries", type=int, default=2000000)
+    p.add_argument("--queries", type=int, default=20000)
+    p.add_argument("--corpus", type=int, default=2000)
+    p.add_argument("--min-similarity", type=float, default=0.8)
+    p.add_argument("--bands", type=int, default=8)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+    s = {"neardup_shingle_words": 3, "neardup_min_shingles": 8, "neardup_bands": args.bands, "neardup_rows": 4}
+    rng = random.Random(args.seed)
+
+    # ----- scale -----
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = NearDupIndex(capacity=args.entries, bands=args.bands, min_similarity=args.min_similarity)
+    t = time.perf_counter()
+    for i in range(args.entries):
+        index.add(([rng.getrandbits(64) for _ in range(args.bands)], rng.randbytes(32)), f"{i:064x}", f"id{i}")
+    add_us = (time.perf_counter() - t) / args.entries * 1e6
+    rss_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0) / 1024
+    lookups = []
+    for _ in range(args.queries):
+        fp = ([rng.getrandbits(64) for _ in range(args.bands)], rng.randbytes(32))
+        t = time.perf_counter()
+        index.lookup(fp)
+        lookups.append((time.perf_counter() - t) * 1e6)
+
+    # ----- quality -----
+    corpus = [x["body"] for x in synthetic_corpus(args.corpus, args.seed)]
+    quality = NearDupIndex(capacity=len(corpus), bands=args.bands, min_similarity=args.min_similarity)
+    fingerprint_us = []
+    fps = []
+    for i, body in enumerate(corpus):
+        t = time.perf_counter()
+        fp = fingerprint(body, s)
+        fingerprint_us.append((time.perf_counter() - t) * 1e6)
+        fps.append(fp)
+        if fp is not None:
+            quality.add(fp, f"{i:064x}", str(i))
+    found = wrong = missed = 0
+    found_j, missed_j = [], []
+    for i, body in enumerate(corpus):
+        if fps[i] is None:
+            continue
+        copy = edit(body, rng)
+        fp = fingerprint(copy, s)
+        match = quality.lookup(fp) if fp is not None else None
+        j = jaccard(body, copy, s)
+        if match is None:
+            missed += 1
+            missed_j.append(j)
+        elif corpus[int(match["id"])] == body or jaccard(corpus[int(match["id"])], copy, s) >= j:
+            found += 1
+            found_j.append(j)
+        else:
+            wrong += 1
+
+    report = {
+        "config": vars(args),
+        "scale": {
+            "entries": args.entries, "add_us": round(add_us, 1), "memory_mb": round(rss_mb, 1),
+            "lookup_us": {"p50": pct(lookups, 0.5), "p99": pct(lookups, 0.99), "max": round(max(lookups), 1)},
+            "compared_per_lookup": round(index.counters["compared"] / args.queries, 2),
+        },
+        "quality": {
+            "indexed": sum(fp is not None for fp in fps),
+            "edited_found": found, "edited_missed": missed, "matched_less_similar": wrong,
+            "jaccard_found_p50": pct(found_j, 0.5, 3), "jaccard_missed_p50": pct(missed_j, 0.5, 3),
+            "fingerprint_us": {"p50": pct(fingerprint_us, 0.5), "p99": pct(fingerprint_us, 0.99)},
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
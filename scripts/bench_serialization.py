@@ -0,0 +1,130 @@
+"""
+Serialization microbenchmark: CPU per result and archived bytes, before and after the
+single-pass encoder.
+
+    python scripts/bench_serialization.py
+    python scripts/bench_serialization.py --messages 5000 --include-body --batch 500
+
+"before" repeats what the request path used to do with every result: `model_dump_json()` for
+the response, `json.loads` of it for the archive queue, `json.dumps` once to size the flush and
+once more to write the shard (plus an indent=2 dump per message in ARCHIVE_MODE=blob). "after"
+is `encode_result()` (one `model_dump` and one encode, orjson when installed) followed by the
+archive writer's `archive_bytes()`. Stored size is reported per result for each archive
+encoding; gzip is applied per flushed batch of `--batch` results, as the writer does. Read-back
+speed is what `read_archive_blob` achieves on one batch.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from common import serialization  # noqa: E402
+from common.archive import read_archive_blob  # noqa: E402
+from common.models import TriageInput, SafetyResult, SafetyCategory, SentimentResult, GPTClassification  # noqa: E402
+from common.pipeline import build_output  # noqa: E402
+from common.serialization import encode_result, archive_bytes  # noqa: E402
+from loadgen import synthetic_corpus  # noqa: E402
+
+
+def outputs(n: int, include_body: bool, seed: int):
+    rng = random.Random(seed)
+    s = {"archive_include_body": include_body}
+    out = []
+    for payload in synthetic_corpus(n, seed):
+        ti = TriageInput(**payload)
+        pos = rng.random()
+        safety = SafetyResult(blocked=False, categories=[
+            SafetyCategory(category=c, severity=rng.choice((0, 0, 0, 2))) for c in ("Hate", "SelfHarm", "Sexual", "Violence")])
+        sentiment = SentimentResult(sentiment="positive" if pos > 0.5 else "negative",
+                                    confidence={"positive": round(pos, 4), "neutral": 0.01, "negative": round(1 - pos, 4)})
+        gpt = GPTClassification(priority=rng.choice(("low", "medium", "high")), reason="Simulated classification.",
+                                suggested_actions=["Review within 24 hours", "Log in case management"])
+        out.append(build_output(ti, safety, sentiment, gpt, {
+            "safety_policy": "staged", "gpt_skipped": False, "gpt_discarded": False, "cache": "miss", "sentiment_source": "language",
+            "timings_ms": {"safety": 41.2, "sentiment": 38.7, "gpt": 612.4, "policy": 0.1}}, s))
+    return out
+
+
+def cpu_per_msg(fn, items, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.process_time()
+        for item in items:
+            fn(item)
+        best = min(best, time.process_time() - t)
+    return round(best / len(items) * 1e6, 2)
+
+
+def before(out, blob_mode: bool = False) -> None:
+    body = out.model_dump_json()
+    record = json.loads(body)
+    len(json.dumps(record, separators=(",", ":")))
+    (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+    if blob_mode:
+        json.dumps(record, indent=2).encode("utf-8")
+
+
+def after(out, fmt: str = "ndjson") -> None:
+    archive_bytes(encode_result(out), fmt)
+
+
+def stored(encoded, fmt: str, gz: bool, batch: int) -> float:
+    total = 0
+    for i in range(0, len(encoded), batch):
+        data = b"".join(archive_bytes(e, fmt) for e in encoded[i:i + batch])
+        total += len(gzip.compress(data) if gz else data)
+    return round(total / len(encoded), 1)
+
+
+def read_back(encoded, fmt: str, batch: int):
+    name = "shard." + fmt
+    data = b"".join(archive_bytes(e, fmt) for e in encoded[:batch])
+    t = time.perf_counter()
+    n = sum(1 for _ in read_archive_blob(name, data))
+    return round(n / (time.perf_counter() - t), 1)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--messages", type=int, default=2000)
+    p.add_argument("--batch", type=int, default=200, help="results per flushed block (for gzip)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--include-body", action="store_true", help="archive metadata.body too")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    outs = outputs(args.messages, args.include_body, args.seed)
+    encoded = [encode_result(o) for o in outs]
+    report = {
+        "messages": args.messages,
+        "encoder": "orjson" if serialization.orjson is not None else "json",
+        "cpu_us_per_result": {
+            "before_shards": cpu_per_msg(before, outs, args.repeat),
+            "before_blob": cpu_per_msg(lambda o: before(o, True), outs, args.repeat),
+            "after_ndjson": cpu_per_msg(after, outs, args.repeat),
+        },
+        "bytes_per_result": {
+            "blob_pretty_json": round(sum(len(json.dumps(e.data, indent=2).encode("utf-8")) for e in encoded)
+                                      / len(encoded), 1),
+            "blob_compact_json": round(sum(len(e.json) for e in encoded) / len(encoded), 1),
+            "ndjson": stored(encoded, "ndjson", False, args.batch),
+            "ndjson_gz": stored(encoded, "ndjson", True, args.batch),
+        },
+        "read_records_per_s": {"ndjson": read_back(encoded, "ndjson", args.batch)},
+    }
+    if serialization.has_msgpack():
+        report["cpu_us_per_result"]["after_msgpack"] = cpu_per_msg(lambda o: after(o, "msgpack"), outs, args.repeat)
+        report["bytes_per_result"]["msgpack"] = stored(encoded, "msgpack", False, args.batch)
+        report["bytes_per_result"]["msgpack_gz"] = stored(encoded, "msgpack", True, args.batch)
+        report["read_records_per_s"]["msgpack"] = read_back(encoded, "msgpack", args.batch)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
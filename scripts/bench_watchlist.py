@@ -0,0 +1,127 @@
+"""
+Watchlist prefilter benchmark: compile time, scan throughput (MB/s) and recall on obfuscated terms.
+
+    python scripts/bench_watchlist.py                     # 5000 terms, 20000 messages
+    python scripts/bench_watchlist.py --terms 20000 --hit-rate 0.05
+
+The watchlist is made of seeded pseudo-words and two-word phrases. Messages come from the
+synthetic corpus in loadgen.py; `--hit-rate` of them get a term inserted with the kind of
+obfuscation seen in practice (leetspeak, spacing, punctuation, repeated letters, case).
+COUNTER_EXAMPLES are clean phrases one repeated letter short of a term ("Wed" for "weed")
+and are scanned against a watchlist of those terms. The report gives MB/s of original text for normalization alone, the full scan on clean and on
+all mail, the automaton alone on normalized text, and a per-term `in` baseline; plus how
+many inserted terms were found and how many clean messages and counter-examples matched anything.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from common.watchlist import Watchlist, fold, squash  # noqa: E402
+from loadgen import synthetic_corpus  # noqa: E402
+
+SYLLABLES = ["ka", "zo", "rim", "tal", "vex", "nor", "quo", "shi", "bru", "dax", "lem", "fyr", "gon", "pel", "wix", "jun"]
+OBFUSCATE = {"a": "4", "e": "3", "i": "1", "o": "0", "s": "$", "t": "7"}
+# Clean text one repeated letter away from a term; none of it may match
+COUNTER_EXAMPLES = {"weed": ["See you Wed at 3", "We'd like a visit"], "speed": ["I sped up the paperwork"],
+                    "pills": ["My pils", "pil lsat"], "llama": ["all lama"], "rim month": ["rim onth"]}
+
+
+def make_terms(n: int, rng: random.Random):
+    terms = set()
+    while len(terms) < n:
+        word = lambda: "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))  # noqa: E731
+        terms.add(word() if rng.random() < 0.7 else f"{word()} {word()}")
+    return sorted(terms)
+
+
+def obfuscate(term: str, rng: random.Random) -> str:
+    kind = rng.choice(("leet", "spaced", "dotted", "repeat", "upper", "plain"))
+    if kind == "leet":
+        return "".join(OBFUSCATE.get(c, c) if rng.random() < 0.5 else c for c in term)
+    if kind == "spaced":
+        return " ".join(term.replace(" ", ""))
+    if kind == "dotted":
+        return ".".join(term.split(" ")) if " " in term else "-".join(term)
+    if kind == "repeat":
+        i = rng.randrange(len(term))
+        return term[:i] + term[i] * 3 + term[i + 1:] if term[i] != " " else term
+    if kind == "upper":
+        return term.upper()
+    return term
+
+
+def throughput(fn, texts, nbytes: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - t)
+    return round(nbytes / best / 1e6, 2)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--terms", type=int, default=5000)
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--hit-rate", type=float, default=0.1)
+    p.add_argument("--baseline-messages", type=int, default=500, help="messages for the per-term `in` baseline")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+    rng = random.Random(args.seed)
+
+    terms = make_terms(args.terms, rng)
+    t = time.perf_counter()
+    watchlist = Watchlist({"bench": {"action": "escalate", "terms": terms}})
+    compile_ms = (time.perf_counter() - t) * 1000
+
+    clean, hits, inserted = [], [], []
+    for msg in synthetic_corpus(args.messages, args.seed):
+        body = msg["body"]
+        if rng.random() < args.hit_rate:
+            term = rng.choice(terms)
+            words = body.split(" ")
+            words.insert(rng.randrange(len(words) + 1), obfuscate(term, rng))
+            hits.append(" ".join(words))
+            inserted.append(term)
+        else:
+            clean.append(body)
+    everything = clean + hits
+    size = lambda texts: sum(len(x.encode("utf-8")) for x in texts)  # noqa: E731
+    clean_bytes, all_bytes = size(clean), size(everything)
+    squashed = [squash(fold(x)) for x in everything]
+    normalized = [squash(fold(x)) for x in terms]
+    baseline = squashed[:args.baseline_messages]
+
+    found = sum(any(watchlist.entries[tid][0] == term for _, _, tid in watchlist.scan_text(text))
+                for text, term in zip(hits, inserted))
+    false_hits = sum(bool(watchlist.scan_text(text)) for text in clean)
+    counter = Watchlist({"counter": {"action": "block", "terms": list(COUNTER_EXAMPLES)}})
+    counter_hits = [text for texts in COUNTER_EXAMPLES.values() for text in texts if counter.scan_text(text)]
+
+    report = {
+        "config": vars(args),
+        "compile": {"ms": round(compile_ms, 1), **watchlist.counts},
+        "corpus": {"messages": len(everything), "with_term": len(hits), "mb": round(all_bytes / 1e6, 2)},
+        "mb_per_s": {
+            "normalize": throughput(lambda x: squash(fold(x)), everything, all_bytes),
+            "scan_clean": throughput(watchlist.scan_text, clean, clean_bytes),
+            "scan_all": throughput(watchlist.scan_text, everything, all_bytes),
+            "automaton_only": throughput(lambda x: list(watchlist.automaton.iter(x)), squashed, all_bytes),
+            "per_term_in_baseline": throughput(lambda x: [n for n in normalized if n in x], baseline,
+                                               size(everything[:args.baseline_messages]), repeat=1),
+        },
+        "quality": {"inserted_found": found, "inserted_missed": len(hits) - found, "clean_matched": false_hits,
+                    "counter_examples_matched": counter_hits},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
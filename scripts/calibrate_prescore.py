@@ -0,0 +1,152 @@
+"""
+Calibrate the on-box pre-scorer against archived Language and Content Safety results.
+
+    python scripts/calibrate_prescore.py --dir ./archive-copy --out prescore.npz
+    python scripts/calibrate_prescore.py --prefix archive/2024/06/ --out prescore.npz
+    python scripts/calibrate_prescore.py --dir ./archive-copy --model prescore.npz     # evaluate only
+
+Learns from results archived with ARCHIVE_INCLUDE_BODY=true whose sentiment came from the
+Language service (records scored by the pre-scorer itself are skipped). Records are split into
+train and holdout by a hash of their id. On the holdout, the built-in lexicon and the fitted
+model are compared: agreement with the Language label, and for each confidence threshold the
+share of mail that would skip the remote call, the agreement among those, how many of them
+Language called negative and how many Content Safety flagged. Throughput is measured for single
+messages and for batches. Point PRESCORE_MODEL_PATH at --out and pick PRESCORE_SKIP_CONFIDENCE
+from the table.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+from typing import Dict, Any, Iterator, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from common.archive import read_archive_blob  # noqa: E402
+from common.prescore import Prescorer, LABELS, RISK_SEVERITY  # noqa: E402
+
+
+def dir_records(root: str, prefix: str = None) -> Iterator[Dict[str, Any]]:
+    from common.replay import iter_dir_names
+    for name in iter_dir_names(root):
+        if prefix and not name.startswith(prefix):
+            continue
+        with open(os.path.join(root, name), "rb") as f:
+            yield from read_archive_blob(name, f.read())
+
+
+def blob_records(prefix: str = None) -> Iterator[Dict[str, Any]]:
+    from common.archive import iter_archive_records
+    from common.clients import get_pool
+    pool = get_pool()
+    for _, record in iter_archive_records(pool.blob, pool.settings, prefix):
+        yield record
+
+
+def examples(records: Iterator[Dict[str, Any]], limit: int):
+    """
+    `(id, body, language_label, risky)` for every usable record.
+    """
+    n = 0
+    for r in records:
+        meta = r.get("metadata") or {}
+        body = meta.get("body")
+        if not body or meta.get("sentiment_source", "language") != "language":
+            continue
+        label = ((r.get("sentiment") or {}).get("sentiment") or "").lower()
+        label = label if label in LABELS else "neutral"
+        cats = (r.get("safety") or {}).get("categories") or []
+        risky = any((c.get("severity") or 0) >= RISK_SEVERITY for c in cats)
+        yield str(meta.get("id", n)), body, label, risky
+        n += 1
+        if limit and n >= limit:
+            return
+
+
+def throughput(scorer: Prescorer, texts: List[str]) -> Dict[str, float]:
+    out = {}
+    single = texts[:200]
+    t = time.perf_counter()
+    for text in single:
+        scorer.score([text])
+    out["single_msgs_per_s"] = round(len(single) / (time.perf_counter() - t), 1)
+    batch = (texts * (1000 // max(len(texts), 1) + 1))[:1000]
+    t = time.perf_counter()
+    scorer.score(batch)
+    out["batch1000_msgs_per_s"] = round(len(batch) / (time.perf_counter() - t), 1)
+    return out
+
+
+def evaluate(scorer: Prescorer, texts: List[str], labels: List[str], risky: List[bool],
+             thresholds: List[float], max_risk: float) -> Dict[str, Any]:
+    scores = scorer.score(texts)
+    n = max(len(texts), 1)
+    report: Dict[str, Any] = {
+        "records": len(texts),
+        "agreement": round(sum(p.sentiment.sentiment == l for p, l in zip(scores, labels)) / n, 4),
+        "risky_kept_remote": round(sum(p.risk > max_risk for p, r in zip(scores, risky) if r)
+                                   / max(sum(risky), 1), 4),
+        "thresholds": [],
+    }
+    for th in thresholds:
+        skipped = [(p, l, r) for p, l, r in zip(scores, labels, risky)
+                   if p.sentiment.sentiment != "negative" and p.confidence >= th and p.risk <= max_risk]
+        k = max(len(skipped), 1)
+        report["thresholds"].append({
+            "confidence": th,
+            "skip_share": round(len(skipped) / n, 4),
+            "agreement_when_skipped": round(sum(p.sentiment.sentiment == l for p, l, _ in skipped) / k, 4),
+            "negative_when_skipped": round(sum(l == "negative" for _, l, _ in skipped) / k, 4),
+            "risky_when_skipped": round(sum(r for _, _, r in skipped) / k, 4),
+        })
+    report["throughput"] = throughput(scorer, texts)
+    return report
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--dir", default=None, help="a local copy of the archive instead of Blob Storage")
+    p.add_argument("--prefix", default=None, help="only blobs whose name starts with this")
+    p.add_argument("--out", default=None, help="write the fitted model here (.npz)")
+    p.add_argument("--model", default=None, help="evaluate this model instead of fitting one")
+    p.add_argument("--holdout", type=float, default=0.2)
+    p.add_argument("--limit", type=int, default=0, help="max records (0 = all)")
+    p.add_argument("--epochs", type=int, default=8)
+    p.add_argument("--bits", type=int, default=18)
+    p.add_argument("--thresholds", default="0.8,0.85,0.9,0.95,0.98")
+    p.add_argument("--max-risk", type=float, default=0.2)
+    args = p.parse_args()
+
+    records = dir_records(args.dir, args.prefix) if args.dir else blob_records(args.prefix)
+    train, test = [], []
+    for rid, body, label, risky in examples(records, args.limit):
+        # Stable split: a record stays on the same side across runs
+        (test if zlib.crc32(rid.encode("utf-8")) % 1000 < args.holdout * 1000 else train).append((body, label, risky))
+    if not test:
+        sys.exit("No usable records: archive with ARCHIVE_INCLUDE_BODY=true first")
+    thresholds = [float(x) for x in args.thresholds.split(",")]
+    texts, labels, risky = (list(x) for x in zip(*test))
+
+    report: Dict[str, Any] = {"train": len(train), "holdout": len(test),
+                              "lexicon": evaluate(Prescorer.from_lexicon(args.bits), texts, labels, risky,
+                                                  thresholds, args.max_risk)}
+    if args.model:
+        report["model"] = evaluate(Prescorer.load(args.model), texts, labels, risky, thresholds, args.max_risk)
+    elif train:
+        scorer = Prescorer.from_lexicon(args.bits)
+        t = time.perf_counter()
+        scorer.fit(*zip(*train), epochs=args.epochs)
+        report["fit_s"] = round(time.perf_counter() - t, 2)
+        report["model"] = evaluate(scorer, texts, labels, risky, thresholds, args.max_risk)
+        scorer.info = {"train": len(train), "holdout": len(test), "agreement": report["model"]["agreement"],
+                       "fitted_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        if args.out:
+            scorer.save(args.out)
+            report["saved"] = args.out
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
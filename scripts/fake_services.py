@@ -0,0 +1,358 @@
+"""
+Local stand-in for Azure AI Content Safety, Azure AI Language (sentiment) and Azure OpenAI.
+
+Point the function (or the harness scripts) at it instead of the real services:
+
+    python scripts/fake_services.py --port 7072 --openai-rpm 120
+    AZURE_CONTENT_SAFETY_ENDPOINT=http://127.0.0.1:7072/
+    AZURE_AI_LANGUAGE_ENDPOINT=http://127.0.0.1:7072/
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:7072/
+    (any non-empty keys)
+
+Each service can be given a latency distribution (fixed, uniform jitter or lognormal), a
+requests-per-minute quota, injected 500 / 429 rates and injected stalls (a share of requests
+held for --stall-ms extra, like a hung backend). Chat completions can take extra time per
+completion token and be cut off mid-JSON (--malformed-rate). Over quota it answers 429 with
+Retry-After / retry-after-ms like the real services. Responses are deterministic for a
+given text, and latency and injected failures are drawn from a generator seeded with
+--seed and the request body, so runs with the same corpus are reproducible. Chat
+completions with `stream: true` come back as server-sent chunks, most of the latency
+falling after the first one.
+"""
+import re
+import json
+import math
+import hashlib
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+
+SERVICES = ("content_safety", "language", "openai")
+
+# Share of a streamed completion's latency spent before the first token arrives
+FIRST_TOKEN_SHARE = 0.25
+
+# Keyword -> (category, severity) used to fake Content Safety verdicts
+SAFETY_TERMS = {
+    "regret": ("Violence", 4), "kill": ("Violence", 6), "weapon": ("Violence", 4),
+    "shank": ("Violence", 5), "hurt": ("Violence", 2), "signal": ("Violence", 2),
+    "stop the pain": ("SelfHarm", 4), "can't do this anymore": ("SelfHarm", 3),
+    "hate": ("Hate", 2), "color": ("Hate", 2),
+}
+NEGATIVE = ("not", "never", "cannot", "can't", "angry", "regret", "hopeless", "pain", "urgent", "broken", "down")
+POSITIVE = ("thank", "thanks", "appreciate", "great", "good", "happy", "love", "please")
+
+
+class ServiceSim:
+    """
+    Quota and latency model for one fake service.
+    """
+
+    def __init__(self, name: str, latency_ms: float, jitter_ms: float, rpm: float, error_rate: float,
+                 dist: str = "uniform", sigma: float = 0.5, throttle_rate: float = 0.0, retry_after_s: float = 1.0,
+                 stall_rate: float = 0.0, stall_ms: float = 0.0, ms_per_token: float = 0.0,
+                 malformed_rate: float = 0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.dist = dist
+        self.sigma = sigma
+        self.throttle_rate = throttle_rate
+        self.retry_after_s = retry_after_s
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.ms_per_token = ms_per_token
+        self.malformed_rate = malformed_rate
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "throttled": 0, "errors": 0, "stalls": 0, "malformed": 0}
+
+    def admit(self) -> Optional[float]:
+        """
+        Fixed one-second windows of rpm/60 requests. Returns the retry delay when over quota.
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            if not self.rpm:
+                return None
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            if self.window_count > max(self.rpm / 60.0, 1.0):
+                self.counters["throttled"] += 1
+                return max(1.0 - (now - self.window_start), 0.05)
+            return None
+
+    def delay(self, rng: random.Random) -> float:
+        """
+        Service time in seconds. `lognormal` treats latency_ms as the median, with a long right tail.
+        """
+        if self.dist == "fixed":
+            ms = self.latency_ms
+        elif self.dist == "lognormal":
+            ms = rng.lognormvariate(math.log(max(self.latency_ms, 0.001)), self.sigma)
+        else:
+            ms = self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)
+        # Drawn only when stalls are on, so other runs keep their sequence
+        if self.stall_rate and rng.random() < self.stall_rate:
+            self.counters["stalls"] += 1
+            ms += self.stall_ms
+        return max(ms, 0.0) / 1000.0
+
+
+def fake_safety(text: str) -> List[Dict[str, Any]]:
+    low = text.lower()
+    sev = {"Hate": 0, "SelfHarm": 0, "Sexual": 0, "Violence": 0}
+    for term, (cat, s) in SAFETY_TERMS.items():
+        if term in low:
+            sev[cat] = max(sev[cat], s)
+    return [{"category": c, "severity": v} for c, v in sev.items()]
+
+
+def fake_sentiment(text: str) -> Tuple[str, Dict[str, float]]:
+    words = re.findall(r"[a-z']+", text.lower())
+    neg = sum(w in NEGATIVE for w in words)
+    pos = sum(w in POSITIVE for w in words)
+    total = neg + pos + 2
+    scores = {"positive": round(pos / total, 2), "negative": round(neg / total, 2)}
+    scores["neutral"] = round(max(1.0 - scores["positive"] - scores["negative"], 0.0), 2)
+    label = max(scores, key=scores.get)
+    return label, scores
+
+
+def fake_priority(text: str) -> str:
+    return "high" if any(w in text for w in ("urgent", "asap", "regret", "hopeless")) else \
+        "low" if any(w in text for w in ("price list", "thank", "schedule")) else "medium"
+
+
+def fake_chat(messages: List[Dict[str, Any]], structured: bool) -> str:
+    text = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "user").lower()
+    # A micro-batched request: one entry per `### Message <id>` section
+    sections = re.split(r"^### message (\d+)$", text, flags=re.M)
+    if structured and len(sections) > 1:
+        return json.dumps({"results": [
+            {"id": int(i), "priority": fake_priority(body), "reason": "Simulated classification.",
+             "suggested_actions": ["Review the message", "Reply to sender"]}
+            for i, body in zip(sections[1::2], sections[2::2])
+        ]})
+    priority = fake_priority(text)
+    if structured:
+        return json.dumps({"priority": priority, "reason": "Simulated classification.",
+                           "suggested_actions": ["Review the message", "Reply to sender"]})
+    return f"Priority: {priority}\nReason: simulated classification\n- Review the message\n- Reply to sender"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    sims: Dict[str, ServiceSim] = {}
+    seed = 0
+    seen: Dict[str, int] = {}
+    seen_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):  # keep the console quiet under load
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:  # the client gave up on a slow answer (timeout, losing hedge)
+            pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _service(self) -> Optional[str]:
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/text:analyze"):
+            return "content_safety"
+        if path.startswith("/language/") or path.startswith("/text/analytics/"):
+            return "language"
+        if path.startswith("/openai/"):
+            return "openai"
+        return None
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            self._send(200, {name: sim.counters for name, sim in self.sims.items()})
+        else:
+            self._send(404, {"error": {"code": "NotFound", "message": self.path}})
+
+    def _rng(self, service: str, raw: bytes) -> random.Random:
+        """
+        Generator keyed on the seed, the service, the request body and how often that body was
+        seen, so timings do not depend on thread interleaving and retries draw fresh values.
+        """
+        digest = hashlib.sha1(raw).hexdigest()
+        with self.seen_lock:
+            n = self.seen[service + digest] = self.seen.get(service + digest, 0) + 1
+        return random.Random(f"{self.seed}:{service}:{digest}:{n}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        req = json.loads(raw or b"{}")
+        service = self._service()
+        if service is None:
+            self._send(404, {"error": {"code": "NotFound", "message": self.path}})
+            return
+        sim = self.sims[service]
+
+        rng = self._rng(service, raw)
+        retry = sim.admit()
+        if retry is None and rng.random() < sim.throttle_rate:
+            sim.counters["throttled"] += 1
+            retry = sim.retry_after_s
+        if retry is not None:
+            self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                       {"Retry-After": str(max(int(retry + 0.999), 1)), "retry-after-ms": str(int(retry * 1000))})
+            return
+        delay = sim.delay(rng)
+        fail = rng.random() < sim.error_rate
+        stream = service == "openai" and bool(req.get("stream")) and not fail
+        # A streamed completion spends most of its latency generating, after the first token
+        time.sleep(delay * FIRST_TOKEN_SHARE if stream else delay)
+        if fail:
+            sim.counters["errors"] += 1
+            self._send(500, {"error": {"code": "InternalServerError", "message": "Injected failure"}})
+            return
+
+        if service == "content_safety":
+            self._send(200, {"blocklistsMatch": [], "categoriesAnalysis": fake_safety(req.get("text", ""))})
+        elif service == "language":
+            docs = req.get("analysisInput", req).get("documents", [])
+            out = []
+            for d in docs:
+                label, scores = fake_sentiment(d.get("text", ""))
+                out.append({
+                    "id": d["id"], "sentiment": label, "confidenceScores": scores, "warnings": [],
+                    "sentences": [{"text": d.get("text", ""), "sentiment": label, "confidenceScores": scores,
+                                   "offset": 0, "length": len(d.get("text", ""))}],
+                })
+            results = {"documents": out, "errors": [], "modelVersion": "fake-2023-04-01"}
+            if "analysisInput" in req:
+                self._send(200, {"kind": "SentimentAnalysisResults", "results": results})
+            else:
+                self._send(200, results)
+        else:
+            content = fake_chat(req.get("messages", []), "response_format" in req)
+            if sim.malformed_rate and rng.random() < sim.malformed_rate:
+                sim.counters["malformed"] += 1
+                content = content[:len(content) // 2]
+            prompt = sum(len(str(m.get("content", ""))) for m in req.get("messages", [])) // 4 + 1
+            completion = len(content) // 4 + 1
+            usage = {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+            # Generation time grows with the reply (a batched reply takes longer than a single one)
+            generate = completion * sim.ms_per_token / 1000.0
+            if stream:
+                self._stream_chat(req, content, usage, delay * (1 - FIRST_TOKEN_SHARE) + generate)
+                return
+            time.sleep(generate)
+            self._send(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": req.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+    def _stream_chat(self, req: Dict[str, Any], content: str, usage: Dict[str, int], duration: float) -> None:
+        """
+        Server-sent `chat.completion.chunk` events, a few characters each, spread over `duration`.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices: List[Dict[str, Any]], **extra) -> None:
+            data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": req.get("model", "fake"), "choices": choices, **extra}
+            self._chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        pieces = re.findall(r".{1,12}", content, re.S) or [""]
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for piece in pieces:
+            time.sleep(duration / len(pieces))
+            event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (req.get("stream_options") or {}).get("include_usage"):
+            event([], usage=usage)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def build_server(host: str, port: int, args: argparse.Namespace) -> ThreadingHTTPServer:
+    def per_service(name: str, field: str, default):
+        value = getattr(args, f"{name}_{field}", None)
+        return default if value is None else value
+
+    sims = {
+        name: ServiceSim(
+            name, getattr(args, f"{name}_latency_ms"), args.jitter_ms, getattr(args, f"{name}_rpm"),
+            per_service(name, "error_rate", args.error_rate),
+            dist=args.latency_dist, sigma=args.sigma,
+            throttle_rate=per_service(name, "throttle_rate", args.throttle_rate),
+            retry_after_s=args.retry_after_s,
+            stall_rate=per_service(name, "stall_rate", args.stall_rate), stall_ms=args.stall_ms,
+            ms_per_token=args.openai_ms_per_token if name == "openai" else 0.0,
+            malformed_rate=args.malformed_rate if name == "openai" else 0.0,
+        )
+        for name in SERVICES
+    }
+    # A handler class per server, so several fake endpoints (primary, secondary) can share a process
+    handler = type("Handler", (Handler,), {"sims": sims, "seed": args.seed, "seen": {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=7072)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--jitter-ms", type=float, default=10.0)
+    p.add_argument("--latency-dist", choices=("uniform", "fixed", "lognormal"), default="uniform",
+                   help="uniform: latency +/- jitter; lognormal: latency is the median")
+    p.add_argument("--sigma", type=float, default=0.5, help="lognormal shape (larger = longer tail)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    p.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    p.add_argument("--retry-after-s", type=float, default=1.0, help="Retry-After for injected 429s")
+    p.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests held for --stall-ms extra")
+    p.add_argument("--stall-ms", type=float, default=5000.0)
+    p.add_argument("--openai-ms-per-token", type=float, default=0.0, help="extra latency per completion token")
+    p.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of chat replies cut off mid-JSON")
+    for name, latency in (("content_safety", 40.0), ("language", 60.0), ("openai", 400.0)):
+        flag = name.replace("_", "-")
+        p.add_argument(f"--{flag}-latency-ms", type=float, default=latency)
+        p.add_argument(f"--{flag}-rpm", type=float, default=0.0, help="requests per minute before 429 (0 = unlimited)")
+        p.add_argument(f"--{flag}-error-rate", type=float, default=None, help="overrides --error-rate")
+        p.add_argument(f"--{flag}-throttle-rate", type=float, default=None, help="overrides --throttle-rate")
+        p.add_argument(f"--{flag}-stall-rate", type=float, default=None, help="overrides --stall-rate")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = build_server(args.host, args.port, args)
+    print(f"Fake AI services listening on http://{args.host}:{args.port}/ (GET /stats for counters)")
+    server.serve_forever()
@@ -0,0 +1,158 @@
+"""
+Exercise hedged requests, attempt deadlines and circuit breakers against local fake endpoints.
+
+    python scripts/hedge_harness.py
+    python scripts/hedge_harness.py --requests 400 --stall-rate 0.05 --stall-ms 3000
+
+Starts two scripts/fake_services.py servers in-process: a primary that stalls a share of
+requests (and optionally fails some) and a clean secondary. Three scenarios:
+
+  tail      GPT classifications with hedging off, then on; p50 / p95 / p99 and hedge counters
+  degraded  the GPT primary fails every call and has no secondary: triage still answers, with
+            the documented degraded classification, and the breaker makes it fail fast
+  failover  the Content Safety primary fails every call: its breaker opens and safety is
+            answered by the secondary
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+
+
+def start(argv):
+    server = fake_services.build_server("127.0.0.1", 0, fake_services.parse_args(["--port", "0"] + argv))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: round(values[min(int(q * len(values)), len(values) - 1)], 1)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(values[-1], 1)}
+
+
+def run(fn, n: int, concurrency: int):
+    latencies, failed = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal failed
+        started = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            with lock:
+                failed += 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(one, range(n)))
+    return dict(percentiles(latencies or [0.0]), ok=len(latencies), failed=failed)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--requests", type=int, default=300)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--latency-ms", type=float, default=80.0, help="median latency of both endpoints")
+    p.add_argument("--stall-rate", type=float, default=0.03, help="primary requests held for --stall-ms")
+    p.add_argument("--stall-ms", type=float, default=2000.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="primary requests answered with 500")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    common = ["--seed", str(args.seed), "--latency-dist", "lognormal", "--sigma", "0.3",
+              "--openai-latency-ms", str(args.latency_ms), "--content-safety-latency-ms", "20",
+              "--language-latency-ms", "20"]
+    primary, primary_url = start(common + ["--openai-stall-rate", str(args.stall_rate), "--stall-ms", str(args.stall_ms),
+                                           "--error-rate", str(args.error_rate)])
+    secondary, secondary_url = start(common + ["--seed", str(args.seed + 1)])
+
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": primary_url, "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": primary_url, "AZURE_CONTENT_SAFETY_KEY": "fake",
+        "AZURE_AI_LANGUAGE_ENDPOINT": primary_url, "AZURE_AI_LANGUAGE_KEY": "fake",
+        "AZURE_OPENAI_SECONDARY_ENDPOINT": secondary_url, "AZURE_OPENAI_SECONDARY_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_SECONDARY_ENDPOINT": secondary_url, "AZURE_CONTENT_SAFETY_SECONDARY_KEY": "fake",
+        # Every request has to reach the fake services
+        "CACHE_ENABLED": "false", "ARCHIVE_ENABLED": "false", "SDK_MAX_RETRIES": "0",
+    })
+
+    from common import resilience
+    from common.clients import ClientPool, load_settings
+    from common.models import TriageInput
+    from common.gpt import classify_gpt
+    from common.pipeline import triage
+
+    base = load_settings()
+    ti = TriageInput(subject="Cannot access VPN", body="My VPN keeps disconnecting. Need help urgently.")
+    report = {"settings": vars(args), "tail": {}}
+
+    # tail: the same load with and without hedging to the secondary deployment
+    for hedge in (False, True):
+        pool = ClientPool(dict(base, hedge_enabled=hedge))
+        route = pool.route("openai")
+        label = "hedged" if hedge else "primary_only"
+        before = resilience.hedge_stats().get("openai", {})
+        report["tail"][label] = run(lambda i: classify_gpt(route, pool.settings, ti), args.requests, args.concurrency)
+        after = resilience.hedge_stats()["openai"]
+        report["tail"][label]["hedge"] = {k: v - before.get(k, 0) for k, v in after.items()}
+        pool.close()
+
+    # degraded: GPT is down and there is nowhere to fail over to
+    primary.RequestHandlerClass.sims["openai"].error_rate = 1.0
+    pool = ClientPool(dict(base, openai_endpoint_secondary=None))
+    results = []
+    started = time.perf_counter()
+    timings = []
+    for i in range(10):
+        t = time.perf_counter()
+        out = triage(TriageInput(subject=f"Invoice {i}", body="Please resend the invoice for last month."), pool)
+        timings.append(round((time.perf_counter() - t) * 1000.0, 1))
+        results.append(out)
+    report["degraded"] = {
+        "ok": len(results),
+        "gpt_priority": sorted({r.gpt.priority for r in results}),
+        "degraded": results[-1].metadata.get("degraded"),
+        "gpt_error": results[-1].metadata.get("gpt_error"),
+        "first_ms": timings[:3], "last_ms": timings[-3:],
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "breaker": resilience.breaker_stats().get("openai"),
+    }
+    pool.close()
+    primary.RequestHandlerClass.sims["openai"].error_rate = args.error_rate
+
+    # failover: Content Safety primary down, secondary healthy
+    primary.RequestHandlerClass.sims["content_safety"].error_rate = 1.0
+    pool = ClientPool(base)
+    results = [triage(TriageInput(subject=f"Access {i}", body="Locked out of my account again."), pool)
+               for i in range(10)]
+    report["failover"] = {
+        "ok": len(results),
+        "degraded": sorted({str(r.metadata.get("degraded")) for r in results}),
+        "hedge": resilience.hedge_stats().get("content_safety"),
+        "breaker": resilience.breaker_stats().get("content_safety"),
+        "secondary_breaker": resilience.breaker_stats().get("content_safety_secondary"),
+    }
+    pool.close()
+
+    report["latency"] = resilience.latency_stats()
+    report["server"] = {"primary": {k: v.counters for k, v in primary.RequestHandlerClass.sims.items()},
+                        "secondary": {k: v.counters for k, v in secondary.RequestHandlerClass.sims.items()}}
+    print(json.dumps(report, indent=2))
+    primary.shutdown()
+    secondary.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Open-loop load generator for /api/triage with a reproducible synthetic inmate-mail corpus.
+
+    python scripts/loadgen.py --rps 20 --duration 30                     # in-process against fake services
+    python scripts/loadgen.py --rps 20 --latency-dist lognormal --throttle-rate 0.02
+    python scripts/loadgen.py --mode http --url "http://localhost:7071/api/triage?code=local" --rps 5
+    python scripts/loadgen.py --save baseline.json
+    python scripts/loadgen.py --baseline baseline.json --tolerance 0.15   # exit 1 on regression
+
+In-process mode starts scripts/fake_services.py on a free port (any of its flags can be passed
+through, e.g. --openai-latency-ms 300 --openai-rpm 600), points the SDK clients at it and calls
+`triage.main` directly; storage defaults to Azurite (start it first). HTTP mode posts to a
+running Functions host, configured however you like.
+
+Requests are issued on a fixed schedule (request i at i / rps), and latency is measured from the
+scheduled time, so a slow server shows up as queueing instead of a lower request rate. The report
+has throughput, p50/p95/p99 latency, status counts and a per-stage breakdown from
+`metadata.timings_ms`. Corpus, fake latencies and injected failures are all seeded (--seed).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+
+AZURITE = "UseDevelopmentStorage=true"
+
+# ---------- Synthetic corpus ----------
+
+OPENINGS = ["Hello,", "Dear staff,", "To whom it may concern,", "Hi,", "Good morning,", ""]
+TOPICS = {
+    "commissary": [
+        "I need help understanding the commissary price list for this month.",
+        "My commissary order was short two items and I was still charged.",
+        "Can you tell me when the new commissary forms will be available?",
+    ],
+    "visitation": [
+        "Can you confirm the visitation hours for next weekend?",
+        "My mother was turned away at visitation even though she was on the approved list.",
+        "I would like to add my brother to my visitation list.",
+    ],
+    "legal": [
+        "I have a court date coming up and have not received my legal mail.",
+        "Please make sure my attorney gets the documents before the hearing on Friday.",
+        "The law library has been closed all week and my filing deadline is close.",
+    ],
+    "medical": [
+        "I have been waiting three weeks for a medical appointment.",
+        "My medication was not given to me this morning and I am in a lot of pain.",
+        "I need to see the dentist, my tooth is broken.",
+    ],
+    "family": [
+        "Thank you for passing on my letter to my daughter.",
+        "Please tell my family I am doing well and I love them.",
+        "I appreciate the chaplain helping me call home after the funeral.",
+    ],
+    "grievance": [
+        "I want to file a grievance about how I was treated during the search.",
+        "The officer on second shift keeps taking my mail and I am angry about it.",
+        "This is the third time I have asked and nobody answers, this is not right.",
+    ],
+    "risk": [
+        "If they move me again they will regret it.",
+        "I can't do this anymore, I just want to stop the pain.",
+        "Someone in my unit has a weapon and said he would hurt me.",
+    ],
+}
+# Most mail is routine; a small share should trip Content Safety
+TOPIC_WEIGHTS = {"commissary": 20, "visitation": 20, "legal": 15, "medical": 15, "family": 15, "grievance": 10, "risk": 5}
+FILLER = [
+    "I have been here for about two years now.",
+    "I am trying to stay out of trouble and do my programs.",
+    "Please write back when you can.",
+    "I already sent a request form last week.",
+    "My housing unit is B-2.",
+    "I know you are busy and I appreciate your time.",
+]
+CLOSINGS = ["Thank you.", "Sincerely,", "Respectfully,", "Please help.", ""]
+
+
+def synthetic_corpus(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    `n` TriageInput payloads built from templates with a seeded generator: the same (n, seed)
+    always gives the same corpus. Bodies vary from one line to a few paragraphs.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPIC_WEIGHTS)
+    weights = [TOPIC_WEIGHTS[t] for t in topics]
+    out = []
+    for i in range(n):
+        topic = rng.choices(topics, weights)[0]
+        parts = [rng.choice(OPENINGS), rng.choice(TOPICS[topic])]
+        for _ in range(int(rng.expovariate(1 / 3))):
+            parts.append(rng.choice(FILLER + TOPICS[topic]))
+        parts += [rng.choice(CLOSINGS), f"ID {100000 + i}"]
+        out.append({
+            "subject": f"{topic.capitalize()} request {i}",
+            "body": " ".join(p for p in parts if p),
+            "sender": f"inmate{rng.randint(1, max(n // 5, 1)):05d}@facility.example",
+            "importance": "High" if rng.random() < 0.1 else "Normal",
+        })
+    return out
+
+
+# ---------- Drivers ----------
+
+def inprocess_sender(args, fake_argv: List[str]):
+    server_args = fake_services.parse_args(["--port", "0", "--seed", str(args.seed)] + fake_argv)
+    server = fake_services.build_server("127.0.0.1", 0, server_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": url, "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": url, "AZURE_CONTENT_SAFETY_KEY": "fake",
+        "AZURE_AI_LANGUAGE_ENDPOINT": url, "AZURE_AI_LANGUAGE_KEY": "fake",
+    })
+    os.environ.setdefault("AZURE_STORAGE_CONNECTION_STRING", args.storage)
+    if not args.cache:
+        os.environ["CACHE_ENABLED"] = "false"
+
+    sys.path.insert(0, ROOT)
+    import azure.functions as func
+    import triage as triage_function
+
+    def send(payload: Dict[str, Any]):
+        req = func.HttpRequest("POST", "/api/triage", body=json.dumps(payload).encode("utf-8"),
+                               headers={"Content-Type": "application/json"})
+        resp = triage_function.main(req)
+        return resp.status_code, resp.get_body()
+
+    return send, server
+
+
+def http_sender(args):
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def send(payload: Dict[str, Any]):
+        r = session.post(args.url, json=payload, timeout=args.timeout)
+        return r.status_code, r.content
+
+    return send
+
+
+# ---------- Report ----------
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(int(q * len(values)), len(values) - 1)], 1)
+
+
+def summarize(samples: List[Dict[str, Any]], elapsed: float, args) -> Dict[str, Any]:
+    ok = [x for x in samples if x["status"] == 200]
+    latencies = [x["latency_ms"] for x in ok]
+    status: Dict[str, int] = {}
+    for x in samples:
+        status[str(x["status"])] = status.get(str(x["status"]), 0) + 1
+    stages: Dict[str, List[float]] = {}
+    for x in ok:
+        for stage, ms in (x.get("timings") or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "config": {"mode": args.mode, "rps": args.rps, "requests": len(samples), "seed": args.seed,
+                   "concurrency": args.concurrency},
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "elapsed_s": round(elapsed, 2),
+        "status": status,
+        "latency_ms": {"p50": pct(latencies, 0.5), "p95": pct(latencies, 0.95), "p99": pct(latencies, 0.99),
+                       "max": round(max(latencies), 1) if latencies else 0.0},
+        "service_ms": {"p50": pct([x["service_ms"] for x in ok], 0.5), "p95": pct([x["service_ms"] for x in ok], 0.95)},
+        "stages_ms": {stage: {"p50": pct(v, 0.5), "p95": pct(v, 0.95), "p99": pct(v, 0.99)}
+                      for stage, v in sorted(stages.items())},
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions beyond `tolerance` (a fraction) in latency percentiles or throughput.
+    """
+    problems = []
+    for q in ("p50", "p95", "p99"):
+        old, new = baseline["latency_ms"].get(q, 0), report["latency_ms"].get(q, 0)
+        if old and new > old * (1 + tolerance):
+            problems.append(f"latency {q}: {old} -> {new} ms")
+    old, new = baseline.get("throughput_rps", 0), report.get("throughput_rps", 0)
+    if old and new < old * (1 - tolerance):
+        problems.append(f"throughput: {old} -> {new} rps")
+    return problems
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    p.add_argument("--url", default="http://localhost:7071/api/triage?code=local")
+    p.add_argument("--rps", type=float, default=10.0)
+    p.add_argument("--duration", type=float, default=20.0, help="seconds (ignored if --requests is set)")
+    p.add_argument("--requests", type=int, default=None)
+    p.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    p.add_argument("--warmup", type=int, default=5, help="requests sent first and left out of the report")
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--storage", default=AZURITE, help="storage connection string for in-process mode")
+    p.add_argument("--cache", action="store_true", help="keep the verdict cache on")
+    p.add_argument("--save", help="write the report to this file")
+    p.add_argument("--baseline", help="compare against a saved report and exit 1 on regression")
+    p.add_argument("--tolerance", type=float, default=0.15)
+    args, fake_argv = p.parse_known_args()
+
+    n = args.requests or max(int(args.rps * args.duration), 1)
+    corpus = synthetic_corpus(n + args.warmup, args.seed)
+    server = None
+    if args.mode == "inprocess":
+        send, server = inprocess_sender(args, fake_argv)
+    else:
+        send = http_sender(args)
+
+    for payload in corpus[:args.warmup]:
+        send(payload)
+
+    samples: List[Optional[Dict[str, Any]]] = [None] * n
+
+    def one(i: int, scheduled: float) -> None:
+        begun = time.perf_counter()
+        try:
+            status, body = send(corpus[args.warmup + i])
+        except Exception as ex:
+            status, body = type(ex).__name__, b""
+        done = time.perf_counter()
+        timings = None
+        if status == 200:
+            try:
+                timings = json.loads(body).get("metadata", {}).get("timings_ms")
+            except ValueError:
+                pass
+        samples[i] = {"status": status, "latency_ms": (done - scheduled) * 1000,
+                      "service_ms": (done - begun) * 1000, "timings": timings}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as ex:
+        for i in range(n):
+            scheduled = started + i / args.rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ex.submit(one, i, scheduled)
+    elapsed = time.perf_counter() - started
+
+    report = summarize([x for x in samples if x is not None], elapsed, args)
+    if server is not None:
+        report["fake_services"] = {name: sim.counters for name, sim in server.RequestHandlerClass.sims.items()}
+        server.shutdown()
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for line in problems:
+            print("REGRESSION", line, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Drive the rate-limit scheduler against a local fake endpoint that throttles.
+
+    python scripts/ratelimit_harness.py --requests 200 --concurrency 32 --openai-rpm 600
+    python scripts/ratelimit_harness.py --no-scheduler      # SDK retries only, for comparison
+
+Starts scripts/fake_services.py in-process, points the real SDK clients at it and fires GPT
+classifications from a thread pool. Prints throughput, server-side 429s and scheduler lane stats.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--openai-rpm", type=float, default=600.0, help="fake server quota")
+    p.add_argument("--openai-latency-ms", type=float, default=100.0)
+    p.add_argument("--no-scheduler", action="store_true")
+    args = p.parse_args()
+
+    server_args = fake_services.parse_args([
+        "--port", "0", "--openai-rpm", str(args.openai_rpm),
+        "--openai-latency-ms", str(args.openai_latency_ms),
+    ])
+    server = fake_services.build_server("127.0.0.1", 0, server_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": url, "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": url, "AZURE_CONTENT_SAFETY_KEY": "fake",
+        "AZURE_AI_LANGUAGE_ENDPOINT": url, "AZURE_AI_LANGUAGE_KEY": "fake",
+        "RATELIMIT_ENABLED": "false" if args.no_scheduler else "true",
+    })
+
+    from common.clients import get_pool
+    from common.models import TriageInput
+    from common.gpt import classify_gpt
+    from common.ratelimit import get_scheduler
+
+    pool = get_pool()
+    s = pool.settings
+    ti = TriageInput(subject="Cannot access VPN", body="My VPN keeps disconnecting. Need help urgently.")
+    ok = failed = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal ok, failed
+        try:
+            classify_gpt(pool.openai, s, ti)
+            with lock:
+                ok += 1
+        except Exception:
+            with lock:
+                failed += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as ex:
+        list(ex.map(one, range(args.requests)))
+    elapsed = time.monotonic() - started
+
+    sched = get_scheduler(s)
+    print(json.dumps({
+        "scheduler": not args.no_scheduler,
+        "requests": args.requests,
+        "ok": ok,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(ok / elapsed, 2),
+        "quota_rps": round(args.openai_rpm / 60.0, 2),
+        "server": server.RequestHandlerClass.sims["openai"].counters,
+        "lanes": sched.stats() if sched else {},
+    }, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
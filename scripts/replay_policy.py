@@ -0,0 +1,67 @@
+"""
+Re-apply the routing policy to archived verdicts without calling the AI services.
+
+    python scripts/replay_policy.py                                   # archive container, current common.logic
+    python scripts/replay_policy.py --policy candidate_logic.py       # what-if with a candidate rules file
+    python scripts/replay_policy.py --prefix archive/2024/06/ --changed-out changed.ndjson
+    python scripts/replay_policy.py --dir ./archive-copy              # a local copy of the container
+
+Uses the stored safety / sentiment / GPT sections of every archived result (shards and legacy
+per-message blobs), re-thresholds the Content Safety severities and re-runs combine_priority
+and routing_hint. Prints old vs. new priority and route counts, the priority transitions and a
+sample of changed ids; every changed record goes to --changed-out. Records that were blocked and
+would now pass are counted as `needs_gpt` (their GPT call was skipped at the time).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--policy", help="Python file with evaluate_safety/apply_security_overrides/"
+                                    "combine_priority/routing_hint (default: common.logic)")
+    p.add_argument("--prefix", default=None, help="only blobs whose name starts with this")
+    p.add_argument("--dir", default=None, help="replay files under a local directory instead of Blob Storage")
+    p.add_argument("--changed-out", default=None, help="NDJSON file for every changed record")
+    p.add_argument("--report", default=None, help="also write the summary JSON here")
+    p.add_argument("--download-workers", type=int, default=16)
+    p.add_argument("--processes", type=int, default=None, help="default: one per CPU")
+    p.add_argument("--window", type=int, default=64, help="max blobs held in memory at once")
+    args = p.parse_args()
+
+    from common.replay import ReplayReport, replay, iter_blob_names, iter_dir_names, blob_fetcher, dir_fetcher
+
+    if args.dir:
+        names = (n for n in iter_dir_names(args.dir) if not args.prefix or n.startswith(args.prefix))
+        fetch = dir_fetcher(args.dir)
+    else:
+        from common.clients import get_pool
+        pool = get_pool()
+        names = iter_blob_names(pool.blob, pool.settings, args.prefix)
+        fetch = blob_fetcher(pool.blob, pool.settings)
+
+    policy_path = os.path.abspath(args.policy) if args.policy else None
+    changed_out = open(args.changed_out, "w", encoding="utf-8") if args.changed_out else None
+    started = time.monotonic()
+    try:
+        report = replay(names, fetch, ReplayReport(changed_out), policy_path,
+                        args.download_workers, args.processes, args.window)
+    finally:
+        if changed_out:
+            changed_out.close()
+
+    summary = dict(report.summary(), policy=args.policy or "common.logic",
+                   elapsed_s=round(time.monotonic() - started, 2))
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
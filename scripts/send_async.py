@@ -0,0 +1,20 @@
+import time, requests
+
+base = "http://localhost:7071/api"
+payload = {
+  "subject": "Cannot access VPN",
+  "body": "My VPN keeps disconnecting every 2 minutes since the update. Need help urgently.",
+  "sender": "alex@contoso.com",
+  "importance": "High"
+}
+r = requests.post(f"{base}/triage/async?code=local", json=payload, timeout=10)
+print(r.status_code, r.text)
+job = r.json()
+
+while True:
+    s = requests.get(f"{base}/triage/status/{job['job_id']}?code=local", timeout=10)
+    if s.status_code != 202:
+        print(s.status_code)
+        print(s.text)
+        break
+    time.sleep(float(s.headers.get("Retry-After", "2")))
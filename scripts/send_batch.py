@@ -0,0 +1,16 @@
+import json, sys, requests
+
+# Usage: python scripts/send_batch.py [N]  -> posts N sample emails as NDJSON to /api/triage/batch
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+samples = [
+  {"subject": "Question about commissary", "body": "Hello, I need help understanding the commissary price list for this month."},
+  {"subject": "Cannot access VPN", "body": "My VPN keeps disconnecting every 2 minutes since the update. Need help urgently.", "importance": "High"},
+  {"subject": "Visitation schedule", "body": "Can you confirm the visitation hours for next weekend? Thank you."},
+]
+ndjson = "\n".join(json.dumps(samples[i % len(samples)]) for i in range(n))
+r = requests.post("http://localhost:7071/api/triage/batch?code=local", data=ndjson.encode("utf-8"),
+                  headers={"Content-Type": "application/x-ndjson"}, timeout=600)
+print(r.status_code)
+for line in r.iter_lines():
+    item = json.loads(line)
+    print(item["index"], item.get("error") or item["result"]["combined_priority"])
@@ -0,0 +1,306 @@
+import os
+import gzip
+import time
+import queue
+import atexit
+import socket
+import logging
+import datetime
+import threading
+from typing import Dict, Any, Optional, Iterator, Tuple, List, Union
+
+from common.clients import ensure_container, write_json
+from common.serialization import Encoded, archive_bytes, has_msgpack, loads, unpack_records
+
+
+# Append blobs accept at most 4 MiB per block and 50,000 blocks per blob
+MAX_APPEND_BLOCK = 4 * 1024 * 1024
+MAX_APPEND_BLOCKS = 50000
+
+# Shard extensions per ARCHIVE_FORMAT (".gz" is added with ARCHIVE_GZIP)
+SHARD_EXTENSIONS = (".ndjson", ".ndjson.gz", ".msgpack", ".msgpack.gz")
+ARCHIVE_EXTENSIONS = (".json",) + SHARD_EXTENSIONS
+
+# Control items passed through the writer queue
+_FLUSH = object()
+_STOP = object()
+
+
+def instance_id() -> str:
+    """
+    Short id of this worker, used to keep shard names unique across scaled-out instances.
+    """
+    base = os.getenv("WEBSITE_INSTANCE_ID", "")[:12] or socket.gethostname()
+    return f"{base}-{os.getpid()}"
+
+
+def partition_prefix(prefix: str, when: datetime.datetime) -> str:
+    return f"{prefix}{when:%Y/%m/%d/%H}/"
+
+
+class ArchiveWriter:
+    """
+    Writes triage results off the request path.
+
+    `submit()` enqueues a record on a bounded queue; a background thread rolls records into
+    compact, hour-partitioned shards (append blobs of NDJSON, or of msgpack maps with
+    ARCHIVE_FORMAT=msgpack; optionally gzip: each flush is one gzip member, and concatenated
+    members are a valid gzip stream). Each record is encoded once, on the writer thread; an
+    `Encoded` result reuses the JSON bytes already sent to the client. When the queue is full
+    the `archive_backpressure` policy decides: block (then fall back to inline), drop, or inline.
+    """
+
+    def __init__(self, s: Dict[str, Any], blob_svc_factory):
+        self.s = s
+        self.container = s["blob_container"]
+        self.mode = s.get("archive_mode", "shards")
+        self.prefix = s.get("archive_prefix", "archive/")
+        self.gzip = s.get("archive_gzip", False)
+        self.format = s.get("archive_format", "ndjson")
+        if self.format == "msgpack" and not has_msgpack():
+            logging.warning("ARCHIVE_FORMAT=msgpack but the msgpack package is not installed; writing NDJSON")
+            self.format = "ndjson"
+        self.flush_interval = s.get("archive_flush_interval_s", 5.0)
+        self.flush_bytes = min(s.get("archive_flush_bytes", 1024 * 1024), MAX_APPEND_BLOCK)
+        self.shard_max_bytes = s.get("archive_shard_max_bytes", 64 * 1024 * 1024)
+        self.backpressure = s.get("archive_backpressure", "block")
+        self.block_timeout = s.get("archive_block_timeout_s", 2.0)
+        self._blob_svc_factory = blob_svc_factory
+        self._q: queue.Queue = queue.Queue(s.get("archive_queue_size", 10000))
+        self._instance = instance_id()
+        self._shard: Optional[Dict[str, Any]] = None
+        self._seq = 0
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self.counters = {
+            "submitted": 0, "written": 0, "dropped": 0, "inline": 0,
+            "flushes": 0, "shards": 0, "failed": 0, "bytes": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    # ----- request side -----
+
+    def submit(self, name: str, record: Union[Dict[str, Any], Encoded]) -> None:
+        """
+        Archive `record` (a dict, or an `Encoded` result); `name` is the per-message blob name
+        used in "blob"/"both" modes.
+        """
+        self.counters["submitted"] += 1
+        if self._closed:
+            self._write_inline(name, record)
+            return
+        try:
+            self._q.put_nowait((name, record))
+            self._idle.clear()
+            return
+        except queue.Full:
+            pass
+
+        if self.backpressure == "drop":
+            self.counters["dropped"] += 1
+            logging.warning("Archive queue full; dropped result %s", name)
+            return
+        if self.backpressure == "block":
+            try:
+                self._q.put((name, record), timeout=self.block_timeout)
+                self._idle.clear()
+                return
+            except queue.Full:
+                pass
+        self._write_inline(name, record)
+
+    def _write_inline(self, name: str, record: Union[Dict[str, Any], Encoded]) -> None:
+        self.counters["inline"] += 1
+        self._write_batch([self._encode(name, record)])
+
+    def _encode(self, name: str, record: Union[Dict[str, Any], Encoded]) -> Tuple[str, Any, bytes]:
+        """
+        `(name, record, shard bytes)`: the one serialization of a record, used for both the
+        flush size and the write.
+        """
+        return name, record, archive_bytes(record, self.format)
+
+    # ----- background side -----
+
+    def _run(self) -> None:
+        batch: List[Tuple[str, Any, bytes]] = []
+        size = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._q.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except queue.Empty:
+                item = None
+            force = item is _FLUSH or item is _STOP
+            if item is not None and not force:
+                try:
+                    entry = self._encode(*item)
+                except Exception as ex:
+                    self.counters["failed"] += 1
+                    logging.error("Archive record %s could not be encoded: %s", item[0], ex)
+                else:
+                    batch.append(entry)
+                    size += len(entry[2])
+            now = time.monotonic()
+            if batch and (force or size >= self.flush_bytes or now >= deadline):
+                self._write_batch(batch)
+                batch, size = [], 0
+            if now >= deadline:
+                deadline = now + self.flush_interval
+            if not batch and self._q.empty():
+                self._idle.set()
+            if item is _STOP:
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, Any, bytes]]) -> None:
+        with self._write_lock:
+            self._write_batch_locked(batch)
+
+    def _write_batch_locked(self, batch: List[Tuple[str, Any, bytes]]) -> None:
+        try:
+            blob_svc = self._blob_svc_factory()
+            ensure_container(blob_svc, self.container)
+            if self.mode in ("blob", "both"):
+                for name, record, data in batch:
+                    if isinstance(record, Encoded):
+                        record = record.json
+                    elif self.format == "ndjson":
+                        record = data[:-1]  # the JSON line without its newline
+                    write_json(blob_svc, self.container, name, record)
+            if self.mode in ("shards", "both"):
+                self._append(blob_svc, b"".join(data for _, _, data in batch))
+            self.counters["written"] += len(batch)
+            self.counters["flushes"] += 1
+        except Exception as ex:
+            self._shard = None  # start a fresh shard next time in case this one is unusable
+            self.counters["failed"] += len(batch)
+            logging.error("Archive write of %d results failed: %s", len(batch), ex)
+
+    def _append(self, blob_svc, data: bytes) -> None:
+        if self.gzip:
+            data = gzip.compress(data)
+        now = datetime.datetime.utcnow()
+        partition = partition_prefix(self.prefix, now)
+        shard = self._shard
+        if (shard is None or shard["partition"] != partition
+                or shard["bytes"] + len(data) > self.shard_max_bytes
+                or shard["blocks"] >= MAX_APPEND_BLOCKS):
+            self._seq += 1
+            ext = (".msgpack" if self.format == "msgpack" else ".ndjson") + (".gz" if self.gzip else "")
+            name = f"{partition}{self._instance}-{self._seq:05d}{ext}"
+            client = blob_svc.get_blob_client(self.container, name)
+            client.create_append_blob()
+            shard = self._shard = {"partition": partition, "client": client, "bytes": 0, "blocks": 0}
+            self.counters["shards"] += 1
+
+        for i in range(0, len(data), MAX_APPEND_BLOCK):
+            shard["client"].append_block(data[i:i + MAX_APPEND_BLOCK])
+            shard["blocks"] += 1
+        shard["bytes"] += len(data)
+        self.counters["bytes"] += len(data)
+
+    # ----- lifecycle -----
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """
+        Write everything submitted so far without waiting for the flush interval.
+        Returns False if it did not finish within `timeout`.
+        """
+        if self._closed:
+            return True
+        self._idle.clear()
+        self._q.put(_FLUSH)
+        return self._idle.wait(timeout)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """
+        Flush-on-shutdown: drain everything queued, then stop the writer thread.
+        Later submits are written inline.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._q.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, queue_depth=self._q.qsize())
+
+
+_writer: Optional[ArchiveWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_archive(s: Dict[str, Any], blob_svc_factory) -> ArchiveWriter:
+    """
+    Process-wide archive writer (started on first use, flushed at interpreter exit).
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ArchiveWriter(s, blob_svc_factory)
+                atexit.register(_writer.close)
+    return _writer
+
+
+# ---------- Reading ----------
+
+def read_archive_blob(name: str, data: bytes) -> Iterator[Dict[str, Any]]:
+    """
+    Decode one archive blob: a per-message `.json`, an NDJSON shard (`.ndjson` / `.ndjson.gz`)
+    or a msgpack shard (`.msgpack` / `.msgpack.gz`, needs the msgpack package).
+    """
+    if name.endswith(".gz"):
+        data = gzip.decompress(data)
+        name = name[:-3]
+    if name.endswith(".json"):
+        yield loads(data)
+        return
+    if name.endswith(".msgpack"):
+        yield from unpack_records(data)
+        return
+    for line in data.splitlines():
+        if line.strip():
+            yield loads(line)
+
+
+def internal_prefixes(s: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Blob name prefixes in the results container that do not hold results: the verdict cache,
+    job status, and the folders of the near-duplicate and sender-risk snapshots and the watchlist
+    (the blob itself when it is not in a folder).
+    """
+    snapshots = (
+        s.get("neardup_blob_name", "neardup/index.bin"),
+        s.get("sender_risk_blob_name", "sender_risk/state.json.gz"),
+        s.get("watchlist_blob_name", "watchlist/watchlist.json"),
+    )
+    return (s.get("cache_blob_prefix", "cache/"), s.get("jobs_prefix", "jobs/")) + tuple(
+        name.rpartition("/")[0] + "/" if "/" in name else name for name in snapshots)
+
+
+def is_archive_blob(name: str, s: Dict[str, Any]) -> bool:
+    """
+    True for result blobs; skips everything under `internal_prefixes`.
+    """
+    if name.startswith(internal_prefixes(s)):
+        return False
+    return name.endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_records(blob_svc, s: Dict[str, Any], name_starts_with: Optional[str] = None
+                         ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream `(blob_name, record)` for every archived result, in listing order.
+    """
+    container = blob_svc.get_container_client(s["blob_container"])
+    for props in container.list_blobs(name_starts_with=name_starts_with):
+        if not is_archive_blob(props.name, s):
+            continue
+        data = container.download_blob(props.name).readall()
+        for record in read_archive_blob(props.name, data):
+            yield props.name, record
@@ -0,0 +1,194 @@
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Iterable, Iterator, Optional, Union
+
+from pydantic import ValidationError
+
+from common.clients import ClientPool, get_pool
+from common.models import TriageInput, TriageOutput
+from common.pipeline import (
+    SENTIMENT_BATCH_SIZE, STATS, analyze_safety, analyze_sentiment_batch, classify_gpt_batched, gpt_input,
+    build_output, wait_stage, lookup_verdict, store_verdict, verdict_from_dict,
+    submit_after, gpt_waits_for_safety, settle_gpt, prescore_messages, settle_sentiment, sentiment_metadata, degraded_metadata,
+    scan_watchlist, watchlist_verdict, observe_sender,
+)
+
+
+def parse_batch(raw: bytes) -> List[Any]:
+    """
+    Accept either a JSON array of TriageInput records or NDJSON (one record per line).
+    Lines that fail to parse are kept as exceptions so they surface as per-item errors.
+    """
+    text = raw.decode("utf-8-sig").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON array")
+        return items
+
+    items: List[Any] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as ex:
+            items.append(ex)
+    return items
+
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_batch_executor(s: Dict[str, Any], lane: str) -> ThreadPoolExecutor:
+    """
+    Process-wide executor for one lane of batch work ("safety", "gpt" or "sentiment"), sized to
+    that lane's concurrency. Batches never take threads from the stage executor `/api/triage`
+    fans out on, and the pool size is the bound, so no thread sits waiting for a slot.
+    """
+    ex = _executors.get(lane)
+    if ex is None:
+        sizes = {"safety": s.get("batch_safety_concurrency", 8), "gpt": s.get("batch_gpt_concurrency", 8),
+                 "sentiment": max(s.get("batch_window", 100) // SENTIMENT_BATCH_SIZE, 1)}
+        with _executors_lock:
+            ex = _executors.get(lane)
+            if ex is None:
+                ex = _executors[lane] = ThreadPoolExecutor(max_workers=max(sizes[lane], 1),
+                                                           thread_name_prefix=f"triage-batch-{lane}")
+    return ex
+
+
+def _error(index: int, ex: Union[Exception, str]) -> Dict[str, Any]:
+    return {"index": index, "error": str(ex)}
+
+
+def triage_batch(items: Iterable[Any], pool: Optional[ClientPool] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Triage many messages and yield `{"index", "result"}` or `{"index", "error"}` in input order.
+
+    Messages are processed in groups of SENTIMENT_BATCH_SIZE so each group costs one Language
+    call; Content Safety and GPT run per message with bounded concurrency (GPT calls are
+    packed into shared completions with MICROBATCH_ENABLED). Watchlist `block` hits
+    (WATCHLIST_ENABLED) are quarantined without any remote call. At most
+    `batch_window` messages are in flight, so memory stays flat regardless of batch size.
+    The calls run on the batch executors (`get_batch_executor`), not the interactive stage pool.
+    """
+    pool = pool or get_pool()
+    s = pool.settings
+    cs, ta, oa = pool.route("content_safety"), pool.route("language"), pool.route("openai")
+    safety_ex, gpt_ex, sentiment_ex = (get_batch_executor(s, lane) for lane in ("safety", "gpt", "sentiment"))
+    max_groups = max(s.get("batch_window", 100) // SENTIMENT_BATCH_SIZE, 1)
+
+    def submit_group(group: List[Any], offset: int) -> Dict[str, Any]:
+        entries = []
+        for i, raw in enumerate(group):
+            if isinstance(raw, Exception):
+                entries.append({"index": offset + i, "error": raw})
+                continue
+            try:
+                ti = TriageInput(**raw)
+            except (TypeError, ValidationError) as err:
+                entries.append({"index": offset + i, "error": err})
+                continue
+            watchlist = scan_watchlist(ti, s)
+            if watchlist is not None and watchlist["action"] == "block":
+                STATS["watchlist_blocked"] += 1
+                entries.append({"index": offset + i, "input": ti, "watchlist": watchlist})
+                continue
+            key, cached, source = lookup_verdict(ti, s)
+            if cached is not None:
+                entries.append({"index": offset + i, "input": ti, "cached": cached, "cache_source": source,
+                                "watchlist": watchlist})
+                continue
+            chunks: Dict[str, Any] = {}
+            safety = safety_ex.submit(analyze_safety, cs, ti.body, s, chunks)
+            if gpt_waits_for_safety(ti, s):
+                gpt = submit_after(gpt_ex, safety, lambda r: not r.blocked,
+                                   lambda ti=ti, chunks=chunks: classify_gpt_batched(oa, s, gpt_input(ti, s, chunks.get("flagged"))))
+            else:
+                gpt = gpt_ex.submit(classify_gpt_batched, oa, s, gpt_input(ti, s))
+            entries.append({
+                "index": offset + i,
+                "input": ti,
+                "key": key,
+                "cache_source": source,
+                "safety": safety,
+                "gpt": gpt,
+                "watchlist": watchlist,
+            })
+        valid = [e for e in entries if "safety" in e]
+        # The whole group is pre-scored in one pass; confident ones leave the Language request
+        for e, (pre, skip) in zip(valid, prescore_messages([e["input"].body for e in valid], s)
+                                  or [(None, False)] * len(valid)):
+            e["prescore"], e["skip_sentiment"] = pre, skip
+            STATS["sentiment_prescored"] += skip
+        remote = [e for e in valid if not e["skip_sentiment"]]
+        sentiment = sentiment_ex.submit(analyze_sentiment_batch, ta, [e["input"].body for e in remote], s) if remote else None
+        return {"entries": entries, "remote": remote, "sentiment": sentiment}
+
+    def drain_group(g: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        # Work may queue behind earlier groups, so stage timeouts count from when we start waiting
+        sentiments: List[Any] = []
+        if g["sentiment"] is not None:
+            try:
+                sentiments = wait_stage("sentiment", g["sentiment"], s.get("timeout_sentiment", 15.0), time.monotonic())
+            except Exception as err:
+                sentiments = [err] * len(g["remote"])
+        by_index = {e["index"]: sentiments[k] for k, e in enumerate(g["remote"])}
+
+        for e in g["entries"]:
+            i = e["index"]
+            if "error" in e:
+                yield _error(i, e["error"])
+                continue
+            if "safety" not in e and "cached" not in e:
+                safety, sentiment, gpt = watchlist_verdict(e["input"], s, e["watchlist"])
+                meta = {"batch_index": i, "watchlist": e["watchlist"], "short_circuit": "watchlist"}
+                yield {"index": i, "result": build_output(
+                    e["input"], safety, sentiment, gpt, observe_sender(e["input"], safety, sentiment, s, meta), s)}
+                continue
+            if "cached" in e:
+                safety, sentiment, gpt = verdict_from_dict(e["cached"])
+                meta = {"batch_index": i, "cache_hit": True, "cache_source": e["cache_source"],
+                        "watchlist": e["watchlist"]}
+                yield {"index": i, "result": build_output(
+                    e["input"], safety, sentiment, gpt, observe_sender(e["input"], safety, sentiment, s, meta), s)}
+                continue
+            try:
+                sentiment, source = settle_sentiment(by_index.get(i), e["prescore"], s)
+                safety = wait_stage("safety", e["safety"], s.get("timeout_safety", 15.0), time.monotonic())
+                gpt, _, _, usage, gpt_error = settle_gpt(e["input"], s, safety, e["gpt"], time.monotonic())
+                meta = {"batch_index": i, "cache_hit": False, "cache_source": e["cache_source"], "gpt_usage": usage,
+                        "watchlist": e["watchlist"], **degraded_metadata(sentiment_metadata(e["prescore"], source), gpt_error)}
+                if "degraded" not in meta:
+                    store_verdict(e["key"], s, safety, sentiment, gpt)
+                out: TriageOutput = build_output(
+                    e["input"], safety, sentiment, gpt, observe_sender(e["input"], safety, sentiment, s, meta), s)
+                yield {"index": i, "result": out}
+            except Exception as err:
+                e["safety"].cancel()
+                e["gpt"].cancel()
+                yield _error(i, err)
+
+    in_flight: deque = deque()
+    group: List[Any] = []
+    offset = 0
+    for raw in items:
+        group.append(raw)
+        if len(group) == SENTIMENT_BATCH_SIZE:
+            in_flight.append(submit_group(group, offset))
+            offset += len(group)
+            group = []
+            if len(in_flight) >= max_groups:
+                yield from drain_group(in_flight.popleft())
+    if group:
+        in_flight.append(submit_group(group, offset))
+    while in_flight:
+        yield from drain_group(in_flight.popleft())
@@ -0,0 +1,176 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from common.clients import ensure_container
+from common.models import TriageInput
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used for hashing: Unicode NFC, trimmed, runs of whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def verdict_key(ti: TriageInput, s: Dict[str, Any], prompt_version: str, categories) -> str:
+    """
+    Content address of a verdict. Anything that can change a stage result is part of the key:
+    normalized subject/body, importance (it is in the GPT prompt), deployment, prompt version
+    and the Content Safety categories requested.
+    """
+    h = hashlib.sha256()
+    for part in (
+        normalize_text(ti.subject),
+        normalize_text(ti.body),
+        (ti.importance or "").lower(),
+        s.get("openai_deployment") or "",
+        prompt_version,
+        ",".join(sorted(str(c) for c in categories)),
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class VerdictCache:
+    """
+    Two-tier cache of stage results (safety/sentiment/gpt) keyed by `verdict_key`.
+
+    Tier 1 is an in-process LRU bounded by entry count and bytes, with a TTL.
+    Tier 2 is a JSON blob per key under `cache_blob_prefix` in the archive container,
+    so verdicts survive function restarts and are shared between instances.
+    """
+
+    def __init__(self, s: Dict[str, Any], blob_svc_factory=None):
+        self.max_entries = s.get("cache_max_entries", 10000)
+        self.max_bytes = s.get("cache_max_bytes", 64 * 1024 * 1024)
+        self.ttl = s.get("cache_ttl_s", 86400.0)
+        self.container = s.get("blob_container")
+        self.prefix = s.get("cache_blob_prefix", "cache/")
+        self._blob_svc_factory = blob_svc_factory if s.get("cache_blob_enabled", True) else None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self.counters = {
+            "hits_memory": 0, "hits_blob": 0, "misses": 0,
+            "evictions": 0, "expirations": 0, "blob_errors": 0,
+        }
+
+    def _blob_name(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}.json"
+
+    # ----- tier 1 -----
+
+    def _put_memory(self, key: str, value: Dict[str, Any], stored_at: float, size: int) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (stored_at, size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, size, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self._bytes -= size
+                self.counters["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    # ----- public API -----
+
+    @property
+    def blob_enabled(self) -> bool:
+        return self._blob_svc_factory is not None
+
+    def get(self, key: str, blob: bool = True) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Return `(value, source)` where source is "memory", "blob" or "miss".
+        With `blob` false only the memory tier is checked, and a memory miss is left for the
+        caller's own `get_blob` to count, so the blob round trip can run off the critical path.
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            self.counters["hits_memory"] += 1
+            return value, "memory"
+        if self._blob_svc_factory is None:
+            self.counters["misses"] += 1
+            return None, "miss"
+        if not blob:
+            return None, "miss"
+        value = self.get_blob(key)
+        return (value, "blob") if value is not None else (None, "miss")
+
+    def get_blob(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        The blob tier alone (one storage round trip); a hit is copied into the memory tier.
+        """
+        if self._blob_svc_factory is not None:
+            try:
+                blob = self._blob_svc_factory().get_blob_client(self.container, self._blob_name(key))
+                doc = json.loads(blob.download_blob().readall())
+                if time.time() - doc["stored_at"] <= self.ttl:
+                    raw = json.dumps(doc["value"], separators=(",", ":"))
+                    self._put_memory(key, doc["value"], doc["stored_at"], len(raw))
+                    self.counters["hits_blob"] += 1
+                    return doc["value"]
+            except Exception as ex:
+                # ResourceNotFoundError is the normal miss; anything else is worth counting
+                if type(ex).__name__ != "ResourceNotFoundError":
+                    self.counters["blob_errors"] += 1
+                    logging.warning("Verdict cache blob read failed: %s", ex)
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        stored_at = time.time()
+        raw = json.dumps(value, separators=(",", ":"))
+        self._put_memory(key, value, stored_at, len(raw))
+        if self._blob_svc_factory is not None:
+            try:
+                blob_svc = self._blob_svc_factory()
+                ensure_container(blob_svc, self.container)
+                blob = blob_svc.get_blob_client(self.container, self._blob_name(key))
+                payload = '{"stored_at":%r,"value":%s}' % (stored_at, raw)
+                blob.upload_blob(payload.encode("utf-8"), overwrite=True)
+            except Exception as ex:
+                self.counters["blob_errors"] += 1
+                logging.warning("Verdict cache blob write failed: %s", ex)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes)
+
+
+_cache: Optional[VerdictCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(s: Dict[str, Any], blob_svc_factory=None) -> Optional[VerdictCache]:
+    """
+    Process-wide verdict cache, or None when CACHE_ENABLED is off.
+    """
+    global _cache
+    if not s.get("cache_enabled", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VerdictCache(s, blob_svc_factory)
+    return _cache
@@ -0,0 +1,145 @@
+import re
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from common.models import SafetyResult, SafetyCategory, SentimentResult
+
+
+# Per-document limits of the services (characters)
+CONTENT_SAFETY_MAX_CHARS = 10000
+LANGUAGE_MAX_CHARS = 5120
+
+# A chunk at least this long whose negative confidence reaches the threshold makes the whole body negative
+NEGATIVE_CHUNK_MIN_CHARS = 500
+NEGATIVE_CHUNK_CONFIDENCE = 0.7
+
+# Sentence ends: terminal punctuation (optionally followed by quotes/brackets) then whitespace, or blank lines
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n\s*\n")
+
+
+def iter_sentences(text: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yield `(start, end)` spans of sentences in `text`, including trailing whitespace.
+    """
+    start = 0
+    for m in _SENTENCE_END.finditer(text):
+        yield start, m.end()
+        start = m.end()
+    if start < len(text):
+        yield start, len(text)
+
+
+def _split_long(start: int, end: int, text: str, max_chars: int) -> Iterator[Tuple[int, int]]:
+    """
+    Break a span longer than `max_chars` at the last whitespace before the limit (hard cut if none).
+    """
+    while end - start > max_chars:
+        cut = text.rfind(" ", start + max_chars // 2, start + max_chars)
+        cut = cut + 1 if cut > start else start + max_chars
+        yield start, cut
+        start = cut
+    if start < end:
+        yield start, end
+
+
+def iter_chunks(text: str, max_chars: int, overlap_chars: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Stream `(start, end)` spans that pack whole sentences up to `max_chars` each.
+    Consecutive chunks share up to `overlap_chars` of trailing sentences, so content split
+    across a boundary is still seen in one piece. Never yields an empty chunk.
+    """
+    if len(text) <= max_chars:
+        if text:
+            yield 0, len(text)
+        return
+
+    overlap_chars = min(overlap_chars, max_chars // 2)
+    chunk_start = None
+    chunk_end = 0
+    recent: List[Tuple[int, int]] = []  # sentences in the current chunk, for overlap
+    for s_start, s_end in iter_sentences(text):
+        for p_start, p_end in _split_long(s_start, s_end, text, max_chars):
+            if chunk_start is not None and p_end - chunk_start > max_chars:
+                yield chunk_start, chunk_end
+                # start the next chunk with the tail sentences that fit in the overlap
+                carry = chunk_end
+                for r_start, _ in reversed(recent):
+                    if chunk_end - r_start > overlap_chars or p_end - r_start > max_chars:
+                        break
+                    carry = r_start
+                chunk_start = carry if carry < chunk_end else p_start
+                recent = [r for r in recent if r[0] >= chunk_start]
+            if chunk_start is None:
+                chunk_start = p_start
+            chunk_end = p_end
+            recent.append((p_start, p_end))
+    if chunk_start is not None and chunk_end > chunk_start:
+        yield chunk_start, chunk_end
+
+
+def chunk_texts(text: str, max_chars: int, overlap_chars: int = 0) -> List[str]:
+    return [text[a:b] for a, b in iter_chunks(text, max_chars, overlap_chars)]
+
+
+# ---------- Aggregation ----------
+
+def merge_safety(results: Sequence[SafetyResult]) -> SafetyResult:
+    """
+    Max severity per category across chunks; blocked if any chunk is blocked.
+    """
+    worst: Dict[str, int] = {}
+    for r in results:
+        for c in r.categories:
+            worst[c.category] = max(worst.get(c.category, 0), c.severity or 0)
+    return SafetyResult(
+        blocked=any(r.blocked for r in results),
+        categories=[SafetyCategory(category=k, severity=v) for k, v in worst.items()],
+    )
+
+
+def merge_sentiment(results: Sequence[SentimentResult], lengths: Sequence[int]) -> SentimentResult:
+    """
+    Confidence-weighted average: each chunk counts by its length times its top confidence,
+    so long, clear-cut passages dominate short or ambivalent ones. The label is the argmax.
+    The exception is a chunk of NEGATIVE_CHUNK_MIN_CHARS or more scored negative with at least
+    NEGATIVE_CHUNK_CONFIDENCE: a single hostile paragraph in a long, friendly letter must still
+    reach the negative escalation in `combine_priority`, so the most negative such chunk's scores
+    are returned instead, and the label is still their argmax.
+    """
+    totals = {"positive": 0.0, "neutral": 0.0, "negative": 0.0}
+    weight_sum = 0.0
+    for r, n in zip(results, lengths):
+        w = max(n, 1) * max(max(r.confidence.values(), default=0.0), 1e-6)
+        weight_sum += w
+        for k in totals:
+            totals[k] += w * r.confidence.get(k, 0.0)
+    if weight_sum == 0:
+        return SentimentResult(sentiment="neutral", confidence={"positive": 0.0, "neutral": 1.0, "negative": 0.0})
+    hostile = max((r for r, n in zip(results, lengths) if n >= NEGATIVE_CHUNK_MIN_CHARS),
+                  key=lambda r: r.confidence.get("negative", 0.0), default=None)
+    if hostile is not None and hostile.confidence.get("negative", 0.0) >= NEGATIVE_CHUNK_CONFIDENCE:
+        confidence = {k: round(hostile.confidence.get(k, 0.0), 4) for k in totals}
+    else:
+        confidence = {k: round(v / weight_sum, 4) for k, v in totals.items()}
+    return SentimentResult(sentiment=max(confidence, key=confidence.get), confidence=confidence)
+
+
+def gpt_excerpt(text: str, flagged: Sequence[str], max_chars: int) -> str:
+    """
+    Bounded GPT input for long bodies: the opening of the message plus the chunks Content Safety
+    flagged (in order of appearance), separated by `[...]` markers.
+    """
+    if len(text) <= max_chars:
+        return text
+    marker = "\n[...]\n"
+    head_budget = max_chars if not flagged else max_chars // 2
+    out = [text[:head_budget].rstrip()]
+    used = len(out[0])
+    for chunk in flagged:
+        room = max_chars - used - len(marker)
+        if room <= 0:
+            break
+        piece = chunk[:room].strip()
+        if piece and piece not in out[0]:
+            out.append(piece)
+            used += len(marker) + len(piece)
+    return marker.join(out) + (marker if len(out) == 1 else "")
@@ -1,18 +1,36 @@
 import os
 import json
+import time
+import atexit
+import logging
 import datetime
-from typing import Dict, Any
+import threading
+from typing import TYPE_CHECKING, Dict, Any, Iterable, Optional, Union
 
-from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+# The SDKs are imported where they are first used: importing all of them up front costs close to
+# a second per cold start, and many requests (cache hits, blocked mail) never touch some of them.
+if TYPE_CHECKING:
+    import httpx
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+    from azure.storage.blob import BlobServiceClient
+    from azure.ai.textanalytics import TextAnalyticsClient
+    from azure.ai.contentsafety import ContentSafetyClient
+    from openai import AzureOpenAI
 
-from azure.ai.textanalytics import TextAnalyticsClient
-from azure.ai.contentsafety import ContentSafetyClient
-from azure.ai.contentsafety.models import AnalyzeTextOptions, TextCategory
 
-from openai import AzureOpenAI
-import httpx
+def _env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    if v is None or v == "":
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int_or_none(name: str, default: Optional[int]) -> Optional[int]:
+    v = os.getenv(name)
+    if v is None or v == "":
+        return default
+    return int(v)
 
 
 def load_settings() -> Dict[str, Any]:
@@ -28,32 +46,233 @@ def load_settings() -> Dict[str, Any]:
         "lang_endpoint": os.getenv("AZURE_AI_LANGUAGE_ENDPOINT"),
         "lang_key": os.getenv("AZURE_AI_LANGUAGE_KEY"),
 
+        # Optional secondary endpoints (another region / deployment) for hedging and fail-over;
+        # keys and the deployment default to the primary's
+        "openai_endpoint_secondary": os.getenv("AZURE_OPENAI_SECONDARY_ENDPOINT") or None,
+        "openai_key_secondary": os.getenv("AZURE_OPENAI_SECONDARY_API_KEY") or None,
+        "openai_deployment_secondary": os.getenv("AZURE_OPENAI_SECONDARY_DEPLOYMENT") or None,
+        "cs_endpoint_secondary": os.getenv("AZURE_CONTENT_SAFETY_SECONDARY_ENDPOINT") or None,
+        "cs_key_secondary": os.getenv("AZURE_CONTENT_SAFETY_SECONDARY_KEY") or None,
+        "lang_endpoint_secondary": os.getenv("AZURE_AI_LANGUAGE_SECONDARY_ENDPOINT") or None,
+        "lang_key_secondary": os.getenv("AZURE_AI_LANGUAGE_SECONDARY_KEY") or None,
+
         "storage_conn_str": os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
         "blob_account_url": os.getenv("BLOB_ACCOUNT_URL"),
         "blob_container": os.getenv("BLOB_CONTAINER", "triage-results"),
+
+        # Keep-alive connection pools shared by every client in the worker process
+        "http_pool_max_connections": int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100")),
+        "http_pool_max_keepalive": int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20")),
+        "http_keepalive_expiry": float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+        "openai_timeout": float(os.getenv("AZURE_OPENAI_TIMEOUT", "60")),
+        "connect_timeout_s": float(os.getenv("CONNECT_TIMEOUT_S", "5")),
+
+        # Pipeline execution: independent stages fan out on a bounded executor
+        "triage_concurrent": _env_bool("TRIAGE_CONCURRENT", True),
+        "triage_max_workers": int(os.getenv("TRIAGE_MAX_WORKERS", "16")),
+        "timeout_safety": float(os.getenv("TRIAGE_TIMEOUT_SAFETY_S", "15")),
+        "timeout_sentiment": float(os.getenv("TRIAGE_TIMEOUT_SENTIMENT_S", "15")),
+        "timeout_gpt": float(os.getenv("TRIAGE_TIMEOUT_GPT_S", "45")),
+        # parallel | staged | speculative (see common.pipeline.resolve_gpt)
+        "safety_policy": os.getenv("SAFETY_POLICY", "speculative").strip().lower(),
+        # structured (json_schema) | json (json_object) | text (legacy free text)
+        "gpt_output_mode": os.getenv("GPT_OUTPUT_MODE", "structured").strip().lower(),
+        "gpt_max_tokens": _env_int_or_none("GPT_MAX_TOKENS", None),
+        # Micro-batching: concurrent GPT classifications share one completion (structured/json modes)
+        "microbatch_enabled": _env_bool("MICROBATCH_ENABLED", False),
+        "microbatch_window_ms": float(os.getenv("MICROBATCH_WINDOW_MS", "20")),
+        "microbatch_max_items": int(os.getenv("MICROBATCH_MAX_ITEMS", "8")),
+        "microbatch_max_tokens": int(os.getenv("MICROBATCH_MAX_TOKENS", "6000")),
+        # Cold start: build clients (and open connections) before the first request
+        "warmup_on_load": _env_bool("WARMUP_ON_LOAD", False),
+        "warmup_services": os.getenv("WARMUP_SERVICES", "content_safety,text_analytics,openai,blob"),
+        "warmup_connect": _env_bool("WARMUP_CONNECT", True),
+        # Stage histograms, metadata.timings_ms and /api/metrics (off = no timing on the hot path)
+        "metrics_enabled": _env_bool("TRIAGE_METRICS", True),
+
+        # Long bodies are split into sentence-aligned chunks within the service limits
+        "chunk_safety_chars": int(os.getenv("CHUNK_SAFETY_CHARS", "10000")),
+        "chunk_sentiment_chars": int(os.getenv("CHUNK_SENTIMENT_CHARS", "5120")),
+        "chunk_overlap_chars": int(os.getenv("CHUNK_OVERLAP_CHARS", "200")),
+        "gpt_excerpt_chars": int(os.getenv("GPT_EXCERPT_CHARS", "4000")),
+
+        # Batch endpoint (/api/triage/batch)
+        "batch_max_items": int(os.getenv("BATCH_MAX_ITEMS", "10000")),
+        "batch_window": int(os.getenv("BATCH_WINDOW", "100")),
+        "batch_safety_concurrency": int(os.getenv("BATCH_SAFETY_CONCURRENCY", "8")),
+        "batch_gpt_concurrency": int(os.getenv("BATCH_GPT_CONCURRENCY", "8")),
+
+        # Content-addressed verdict cache (in-process LRU + blob tier)
+        "cache_enabled": _env_bool("CACHE_ENABLED", True),
+        "cache_max_entries": int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+        "cache_max_bytes": int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        "cache_ttl_s": float(os.getenv("CACHE_TTL_S", "86400")),
+        "cache_blob_enabled": _env_bool("CACHE_BLOB_ENABLED", True),
+        "cache_blob_prefix": os.getenv("CACHE_BLOB_PREFIX", "cache/"),
+
+        # Near-duplicate index (MinHash LSH over recent bodies; needs the verdict cache)
+        "neardup_enabled": _env_bool("NEARDUP_ENABLED", False),
+        "neardup_mode": os.getenv("NEARDUP_MODE", "fast_track").strip().lower(),
+        "neardup_min_similarity": float(os.getenv("NEARDUP_MIN_SIMILARITY", "0.8")),
+        "neardup_capacity": int(os.getenv("NEARDUP_CAPACITY", "200000")),
+        "neardup_max_age_s": float(os.getenv("NEARDUP_MAX_AGE_S", "86400")),
+        "neardup_shingle_words": int(os.getenv("NEARDUP_SHINGLE_WORDS", "3")),
+        "neardup_min_shingles": int(os.getenv("NEARDUP_MIN_SHINGLES", "8")),
+        "neardup_bands": int(os.getenv("NEARDUP_BANDS", "8")),
+        "neardup_rows": int(os.getenv("NEARDUP_ROWS", "4")),
+        "neardup_snapshot_s": float(os.getenv("NEARDUP_SNAPSHOT_S", "300")),
+        "neardup_blob_name": os.getenv("NEARDUP_BLOB_NAME", "neardup/index.bin"),
+
+        # Rolling per-sender risk (decayed counters; escalates priority on rising trends)
+        "sender_risk_enabled": _env_bool("SENDER_RISK_ENABLED", False),
+        "sender_risk_recent_half_life_h": float(os.getenv("SENDER_RISK_RECENT_HALF_LIFE_H", "24")),
+        "sender_risk_baseline_half_life_h": float(os.getenv("SENDER_RISK_BASELINE_HALF_LIFE_H", "168")),
+        "sender_risk_max_senders": int(os.getenv("SENDER_RISK_MAX_SENDERS", "200000")),
+        "sender_risk_snapshot_s": float(os.getenv("SENDER_RISK_SNAPSHOT_S", "300")),
+        "sender_risk_blob_name": os.getenv("SENDER_RISK_BLOB_NAME", "sender_risk/state.json.gz"),
+        "sender_risk_rebuild_days": int(os.getenv("SENDER_RISK_REBUILD_DAYS", "14")),
+
+        # On-box sentiment / risk pre-scorer (NumPy): skips confident Language calls, stands in when it fails
+        "prescore_enabled": _env_bool("PRESCORE_ENABLED", False),
+        "prescore_model_path": os.getenv("PRESCORE_MODEL_PATH") or None,
+        "prescore_bits": int(os.getenv("PRESCORE_BITS", "18")),
+        "prescore_skip": _env_bool("PRESCORE_SKIP", True),
+        "prescore_skip_confidence": float(os.getenv("PRESCORE_SKIP_CONFIDENCE", "0.9")),
+        "prescore_skip_labels": os.getenv("PRESCORE_SKIP_LABELS", "positive,neutral"),
+        "prescore_max_risk": float(os.getenv("PRESCORE_MAX_RISK", "0.2")),
+        "prescore_fallback": _env_bool("PRESCORE_FALLBACK", True),
+
+        # Security watchlist prefilter (runs before any remote call; block hits are quarantined locally)
+        "watchlist_enabled": _env_bool("WATCHLIST_ENABLED", False),
+        "watchlist_path": os.getenv("WATCHLIST_PATH") or None,
+        "watchlist_blob_name": os.getenv("WATCHLIST_BLOB_NAME", "watchlist/watchlist.json"),
+        "watchlist_reload_s": float(os.getenv("WATCHLIST_RELOAD_S", "60")),
+        "watchlist_min_term_chars": int(os.getenv("WATCHLIST_MIN_TERM_CHARS", "3")),
+        "watchlist_max_matches": int(os.getenv("WATCHLIST_MAX_MATCHES", "20")),
+
+        # Circuit breakers, one per service endpoint (fail fast while it is down)
+        "breaker_enabled": _env_bool("BREAKER_ENABLED", True),
+        "breaker_failures": int(os.getenv("BREAKER_FAILURES", "5")),
+        "breaker_open_s": float(os.getenv("BREAKER_OPEN_S", "30")),
+
+        # Latency-aware attempt deadlines and hedged requests to the secondary endpoints
+        "latency_window": int(os.getenv("LATENCY_WINDOW", "512")),
+        "latency_min_samples": int(os.getenv("LATENCY_MIN_SAMPLES", "20")),
+        "adaptive_timeout": _env_bool("ADAPTIVE_TIMEOUT", True),
+        "adaptive_timeout_multiplier": float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "3")),
+        "adaptive_timeout_min_s": float(os.getenv("ADAPTIVE_TIMEOUT_MIN_S", "2")),
+        "hedge_enabled": _env_bool("HEDGE_ENABLED", True),
+        "hedge_quantile": float(os.getenv("HEDGE_QUANTILE", "0.95")),
+        "hedge_initial_delay_ms": float(os.getenv("HEDGE_INITIAL_DELAY_MS", "1000")),
+        "hedge_min_delay_ms": float(os.getenv("HEDGE_MIN_DELAY_MS", "20")),
+        "hedge_max_ratio": float(os.getenv("HEDGE_MAX_RATIO", "0.1")),
+        # GPT failures (timeout, open breaker, errors) give a degraded result instead of an error
+        "gpt_optional": _env_bool("GPT_OPTIONAL", True),
+        "gpt_degraded_priority": os.getenv("GPT_DEGRADED_PRIORITY", "medium").strip().lower(),
+
+        # Archival writer: "shards" (NDJSON append blobs), "blob" (one JSON per message) or "both"
+        "archive_mode": os.getenv("ARCHIVE_MODE", "shards").strip().lower(),
+        "archive_prefix": os.getenv("ARCHIVE_PREFIX", "archive/"),
+        "archive_gzip": _env_bool("ARCHIVE_GZIP", False),
+        # Shard encoding: "ndjson" or "msgpack" (smaller and faster to read back; needs msgpack)
+        "archive_format": os.getenv("ARCHIVE_FORMAT", "ndjson").strip().lower(),
+        # Keep the message body in metadata.body (needed to calibrate the pre-scorer on the archive)
+        "archive_include_body": _env_bool("ARCHIVE_INCLUDE_BODY", False),
+        "archive_queue_size": int(os.getenv("ARCHIVE_QUEUE_SIZE", "10000")),
+        "archive_flush_interval_s": float(os.getenv("ARCHIVE_FLUSH_INTERVAL_S", "5")),
+        "archive_flush_bytes": int(os.getenv("ARCHIVE_FLUSH_BYTES", str(1024 * 1024))),
+        "archive_shard_max_bytes": int(os.getenv("ARCHIVE_SHARD_MAX_BYTES", str(64 * 1024 * 1024))),
+        # block | drop | inline: what submit() does when the queue is full
+        "archive_backpressure": os.getenv("ARCHIVE_BACKPRESSURE", "block").strip().lower(),
+        "archive_block_timeout_s": float(os.getenv("ARCHIVE_BLOCK_TIMEOUT_S", "2")),
+
+        # Queue-backed ingestion (/api/triage/async -> triage-jobs queue -> triage_worker)
+        "jobs_prefix": os.getenv("JOBS_PREFIX", "jobs/"),
+        "jobs_max_dequeue": int(os.getenv("JOBS_MAX_DEQUEUE", "5")),
+
+        # Progressive triage (/api/triage/stream; events also polled from jobs/{id}.events.ndjson)
+        "stream_gpt_tokens": _env_bool("STREAM_GPT_TOKENS", True),
+        "stream_flush_ms": float(os.getenv("STREAM_FLUSH_MS", "250")),
+
+        # Rate-limit-aware scheduler (per service/deployment token buckets + AIMD concurrency)
+        "ratelimit_enabled": _env_bool("RATELIMIT_ENABLED", True),
+        "ratelimit_openai_rpm": float(os.getenv("RATELIMIT_OPENAI_RPM", "0")),
+        "ratelimit_openai_tpm": float(os.getenv("RATELIMIT_OPENAI_TPM", "0")),
+        "ratelimit_content_safety_rpm": float(os.getenv("RATELIMIT_CONTENT_SAFETY_RPM", "0")),
+        "ratelimit_language_rpm": float(os.getenv("RATELIMIT_LANGUAGE_RPM", "0")),
+        "ratelimit_initial_concurrency": int(os.getenv("RATELIMIT_INITIAL_CONCURRENCY", "8")),
+        "ratelimit_min_concurrency": int(os.getenv("RATELIMIT_MIN_CONCURRENCY", "1")),
+        "ratelimit_max_concurrency": int(os.getenv("RATELIMIT_MAX_CONCURRENCY", "32")),
+        "ratelimit_max_retries": int(os.getenv("RATELIMIT_MAX_RETRIES", "4")),
+        "ratelimit_max_wait_s": float(os.getenv("RATELIMIT_MAX_WAIT_S", "30")),
+        # SDK-level retries; off by default while the scheduler owns 429 handling
+        "sdk_max_retries": _env_int_or_none(
+            "SDK_MAX_RETRIES", 0 if _env_bool("RATELIMIT_ENABLED", True) else None
+        ),
     }
 
 
 # ---------- Azure Clients ----------
 
-def make_text_analytics_client(s: Dict[str, Any]) -> TextAnalyticsClient:
+def make_requests_session(s: Dict[str, Any]) -> "requests.Session":
+    """
+    requests.Session with a keep-alive pool sized from settings (used by the Azure SDK transports).
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.trust_env = False
+    adapter = HTTPAdapter(
+        pool_connections=s.get("http_pool_max_keepalive", 20),
+        pool_maxsize=s.get("http_pool_max_connections", 100),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _azure_kwargs(s: Dict[str, Any], transport: Optional["RequestsTransport"]) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"transport": transport} if transport else {}
+    if s.get("sdk_max_retries") is not None:
+        kwargs["retry_total"] = s["sdk_max_retries"]
+    return kwargs
+
+
+def make_text_analytics_client(s: Dict[str, Any], transport: Optional["RequestsTransport"] = None
+                               ) -> "TextAnalyticsClient":
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.textanalytics import TextAnalyticsClient
+
+    kwargs = _azure_kwargs(s, transport)
     return TextAnalyticsClient(
         endpoint=s["lang_endpoint"],
-        credential=AzureKeyCredential(s["lang_key"])
+        credential=AzureKeyCredential(s["lang_key"]),
+        **kwargs
     )
 
 
-def make_content_safety_client(s: Dict[str, Any]) -> ContentSafetyClient:
+def make_content_safety_client(s: Dict[str, Any], transport: Optional["RequestsTransport"] = None
+                               ) -> "ContentSafetyClient":
+    from azure.core.credentials import AzureKeyCredential
+    from azure.ai.contentsafety import ContentSafetyClient
+
+    kwargs = _azure_kwargs(s, transport)
     return ContentSafetyClient(
         endpoint=s["cs_endpoint"],
-        credential=AzureKeyCredential(s["cs_key"])
+        credential=AzureKeyCredential(s["cs_key"]),
+        **kwargs
     )
 
 
-def make_openai_client(s: Dict[str, Any]) -> AzureOpenAI:
+def make_openai_client(s: Dict[str, Any], http_client: Optional["httpx.Client"] = None) -> "AzureOpenAI":
     """
     Azure OpenAI client that disables proxy inheritance (fixes 'proxies' kwarg error).
+    Pass a shared `http_client` to reuse its connection pool; otherwise a new one is created.
     """
+    import httpx
+    from openai import AzureOpenAI
+
     # ✅ Remove proxy-related environment variables before client init
     for k in ("HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY",
               "http_proxy", "https_proxy", "all_proxy"):
@@ -61,45 +280,368 @@ def make_openai_client(s: Dict[str, Any]) -> AzureOpenAI:
             os.environ.pop(k)
 
     # ✅ Create httpx client with proxy/env disabled
-    http_client = httpx.Client(trust_env=False, timeout=60.0)
+    if http_client is None:
+        http_client = httpx.Client(trust_env=False, timeout=s.get("openai_timeout", 60.0))
 
     # ✅ Initialize AzureOpenAI cleanly
+    kwargs = {"max_retries": s["sdk_max_retries"]} if s.get("sdk_max_retries") is not None else {}
     return AzureOpenAI(
         api_key=s["openai_key"],
         api_version=s["openai_api_version"],
         azure_endpoint=s["openai_endpoint"],
-        http_client=http_client
+        http_client=http_client,
+        **kwargs
     )
 
 
-def make_blob_client(s: Dict[str, Any]) -> BlobServiceClient:
+def make_blob_client(s: Dict[str, Any], transport: Optional["RequestsTransport"] = None) -> "BlobServiceClient":
     """
     Prefer local Azurite connection string; fallback to real Azure credentials if not available.
     """
+    from azure.storage.blob import BlobServiceClient
+
+    kwargs = {"transport": transport} if transport else {}
     conn = s.get("storage_conn_str")
     if conn:
-        return BlobServiceClient.from_connection_string(conn)
+        return BlobServiceClient.from_connection_string(conn, **kwargs)
 
     url = s.get("blob_account_url")
     if not url:
         raise ValueError("No storage connection string or account URL provided.")
+    from azure.identity import DefaultAzureCredential
     cred = DefaultAzureCredential()
-    return BlobServiceClient(account_url=url, credential=cred)
+    return BlobServiceClient(account_url=url, credential=cred, **kwargs)
+
+
+# Per service: the settings a secondary endpoint overrides ("<key>_secondary"). Setting the endpoint
+# (or, for OpenAI, just another deployment) enables it
+SECONDARY_KEYS = {
+    "openai": ("openai_endpoint", "openai_deployment", "openai_key"),
+    "content_safety": ("cs_endpoint", "cs_key"),
+    "language": ("lang_endpoint", "lang_key"),
+}
+
+
+def secondary_settings(s: Dict[str, Any], service: str) -> Optional[Dict[str, Any]]:
+    """
+    Settings as the service's secondary endpoint sees them, or None when it has none.
+    An OpenAI secondary can be another deployment on the primary endpoint.
+    """
+    keys = SECONDARY_KEYS[service]
+    configured = keys[:2] if service == "openai" else keys[:1]
+    if not any(s.get(f"{k}_secondary") for k in configured):
+        return None
+    return dict(s, **{k: s[f"{k}_secondary"] for k in keys if s.get(f"{k}_secondary")})
+
+
+# ---------- Process-wide client pool ----------
+
+class ClientPool:
+    """
+    Lazily built, process-scoped SDK clients sharing keep-alive connection pools.
+    Azure SDK clients share one requests.Session; the OpenAI client owns one httpx.Client.
+    """
+
+    def __init__(self, s: Dict[str, Any]):
+        self.settings = s
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Any] = {}
+        self._routes: Dict[str, Any] = {}
+        self._session: Optional["requests.Session"] = None
+        self._http_client: Optional["httpx.Client"] = None
+        self._httpx_requests = 0
+        self._httpx_connections = 0
+        self._builds = 0
+        self._hits = 0
+        self._closed = False
+
+    # ----- shared transports -----
+
+    def _transport(self) -> "RequestsTransport":
+        from azure.core.pipeline.transport import RequestsTransport
+
+        if self._session is None:
+            self._session = make_requests_session(self.settings)
+        # session_owner=False: closing one SDK client must not tear down the shared pool
+        return RequestsTransport(session=self._session, session_owner=False)
+
+    def _on_httpx_trace(self, event: str, info: Dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.complete":
+            self._httpx_connections += 1
+
+    def _on_httpx_request(self, request: "httpx.Request") -> None:
+        self._httpx_requests += 1
+        request.extensions["trace"] = self._on_httpx_trace
+
+    def _httpx(self) -> "httpx.Client":
+        if self._http_client is None:
+            import httpx
+
+            s = self.settings
+            self._http_client = httpx.Client(
+                trust_env=False,
+                timeout=s.get("openai_timeout", 60.0),
+                limits=httpx.Limits(
+                    max_connections=s.get("http_pool_max_connections", 100),
+                    max_keepalive_connections=s.get("http_pool_max_keepalive", 20),
+                    keepalive_expiry=s.get("http_keepalive_expiry", 30.0),
+                ),
+                event_hooks={"request": [self._on_httpx_request]},
+            )
+        return self._http_client
+
+    # ----- clients -----
+
+    def _get(self, name: str, factory):
+        client = self._clients.get(name)
+        if client is not None:
+            self._hits += 1
+            return client
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ClientPool is closed")
+            client = self._clients.get(name)
+            if client is None:
+                client = factory()
+                self._clients[name] = client
+                self._builds += 1
+            return client
+
+    @property
+    def text_analytics(self) -> "TextAnalyticsClient":
+        return self._get("text_analytics", lambda: make_text_analytics_client(self.settings, self._transport()))
+
+    @property
+    def content_safety(self) -> "ContentSafetyClient":
+        return self._get("content_safety", lambda: make_content_safety_client(self.settings, self._transport()))
+
+    @property
+    def openai(self) -> "AzureOpenAI":
+        return self._get("openai", lambda: make_openai_client(self.settings, self._httpx()))
+
+    @property
+    def blob(self) -> "BlobServiceClient":
+        return self._get("blob", lambda: make_blob_client(self.settings, self._transport()))
+
+    def route(self, service: str):
+        """
+        The service's `Route` ("content_safety", "language" or "openai"): the primary client
+        and, when a secondary endpoint is configured, a client for it.
+        """
+        route = self._routes.get(service)
+        if route is not None:
+            return route
+        from common.resilience import Route, Endpoint, endpoint_lane
+
+        s = self.settings
+        primary = {"content_safety": lambda: self.content_safety, "language": lambda: self.text_analytics,
+                   "openai": lambda: self.openai}[service]()
+        s2 = secondary_settings(s, service)
+        secondary = None
+        if s2 is not None:
+            make = {
+                "content_safety": lambda: make_content_safety_client(s2, self._transport()),
+                "language": lambda: make_text_analytics_client(s2, self._transport()),
+                "openai": lambda: make_openai_client(s2, self._httpx()),
+            }[service]
+            secondary = Endpoint(f"{service}_secondary", self._get(f"{service}_secondary", make), s2,
+                                 endpoint_lane(service, s2, secondary=True))
+        route = Route(service, Endpoint(service, primary, s, endpoint_lane(service, s)), secondary)
+        return self._routes.setdefault(service, route)
+
+    # ----- warm-up -----
+
+    def _preconnect(self, name: str) -> None:
+        s = self.settings
+        if name == "openai":
+            if s.get("openai_endpoint"):
+                self._httpx().head(s["openai_endpoint"])
+            return
+        url = {
+            "content_safety": s.get("cs_endpoint"),
+            "text_analytics": s.get("lang_endpoint"),
+            "blob": getattr(self._clients.get("blob"), "url", None),
+        }.get(name)
+        if url and self._session is not None:
+            self._session.head(url, timeout=5)
+
+    def warm_up(self, services: Optional[Iterable[str]] = None, connect: Optional[bool] = None) -> Dict[str, float]:
+        """
+        Build the given clients now (importing their SDKs) and, with `connect`, open a keep-alive
+        connection to each endpoint so the first real request skips DNS/TCP/TLS setup.
+        Returns seconds spent per service. Failures are logged, never raised.
+        """
+        s = self.settings
+        if services is None:
+            services = [x.strip() for x in s.get("warmup_services", "").split(",") if x.strip()]
+        connect = s.get("warmup_connect", True) if connect is None else connect
+        spent: Dict[str, float] = {}
+        for name in services:
+            started = time.perf_counter()
+            try:
+                getattr(self, name)
+                if connect:
+                    self._preconnect(name)
+            except Exception as ex:
+                logging.warning("Warm-up of %s failed: %s", name, ex)
+            spent[name] = round(time.perf_counter() - started, 3)
+        return spent
+
+    # ----- observability / lifecycle -----
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Client reuse and connection counters. `*_reused` = requests served on an existing keep-alive connection.
+        """
+        azure_requests = azure_connections = 0
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is not None:
+                        azure_requests += pool.num_requests
+                        azure_connections += pool.num_connections
+        return {
+            "client_builds": self._builds,
+            "client_reuses": self._hits,
+            "azure_requests": azure_requests,
+            "azure_new_connections": azure_connections,
+            "azure_reused": max(azure_requests - azure_connections, 0),
+            "openai_requests": self._httpx_requests,
+            "openai_new_connections": self._httpx_connections,
+            "openai_reused": max(self._httpx_requests - self._httpx_connections, 0),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for client in self._clients.values():
+                try:
+                    client.close()
+                except Exception:
+                    pass
+            self._clients.clear()
+            self._routes.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+            if self._session is not None:
+                self._session.close()
+
+
+_pool: Optional[ClientPool] = None
+_pool_lock = threading.Lock()
+_settings: Optional[Dict[str, Any]] = None
+
+
+def get_settings() -> Dict[str, Any]:
+    """
+    `load_settings()` read once per process; `reset_pool()` makes the next call read the environment again.
+    """
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
+
+def get_pool(s: Optional[Dict[str, Any]] = None) -> ClientPool:
+    """
+    Return the warm process-wide pool. Without `s` this is one global read: the settings are
+    taken once per process (`get_settings`), and environment changes apply after `reset_pool()`
+    or `reload_pool()`. With explicit settings that differ from the pool's, the pool is rebuilt
+    and the replaced one closed after a grace period so in-flight requests can finish on it.
+    """
+    global _pool
+    pool = _pool
+    if s is None:
+        if pool is not None:
+            return pool
+        s = get_settings()
+    if pool is not None and pool.settings == s:
+        return pool
+    with _pool_lock:
+        if _pool is not None and _pool.settings == s:
+            return _pool
+        old, _pool = _pool, ClientPool(s)
+        if old is not None:
+            timer = threading.Timer(float(os.getenv("HTTP_POOL_RETIRE_GRACE_S", "60")), old.close)
+            timer.daemon = True
+            timer.start()
+        return _pool
+
+
+def reset_pool() -> None:
+    """
+    Forget the cached settings and close the pool, so the next `get_pool()` reads the
+    environment again (tests, or after changing settings in-process).
+    """
+    global _settings
+    _settings = None
+    close_pool()
+
+
+def reload_pool() -> ClientPool:
+    """
+    Force a rebuild from the current environment (e.g. after rotating keys).
+    """
+    reset_pool()
+    return get_pool()
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, None
+    if old is not None:
+        old.close()
+
+
+atexit.register(close_pool)
+
+
+def warm_up_in_background() -> Optional[threading.Thread]:
+    """
+    Start `get_pool().warm_up()` on a daemon thread when WARMUP_ON_LOAD is set. Called at
+    function import time so the SDK imports overlap with the host finishing its own start-up.
+    """
+    if not _env_bool("WARMUP_ON_LOAD", False):
+        return None
+    thread = threading.Thread(target=lambda: get_pool().warm_up(), name="triage-warmup", daemon=True)
+    thread.start()
+    return thread
 
 
 # ---------- Helpers ----------
 
-def ensure_container(blob_svc: BlobServiceClient, name: str) -> None:
+# (account_url, container) pairs already known to exist in this process
+_known_containers = set()
+
+
+def ensure_container(blob_svc: "BlobServiceClient", name: str) -> None:
+    from azure.core.exceptions import ResourceExistsError
+
+    key = (getattr(blob_svc, "url", ""), name)
+    if key in _known_containers:
+        return
     try:
         blob_svc.create_container(name)
+        _known_containers.add(key)
+    except ResourceExistsError:
+        _known_containers.add(key)
     except Exception:
-        pass  # Container probably already exists
+        pass  # Transient failure: try again next time; the upload will surface real errors
 
 
-def write_json(blob_svc: BlobServiceClient, container: str, name: str, payload: dict) -> None:
+def write_json(blob_svc: "BlobServiceClient", container: str, name: str, payload: Union[dict, bytes]) -> None:
+    """
+    Upload `payload` as compact JSON (bytes are taken as already-encoded JSON).
+    """
     ensure_container(blob_svc, container)
     blob = blob_svc.get_blob_client(container, name)
-    blob.upload_blob(json.dumps(payload, indent=2).encode("utf-8"), overwrite=True)
+    data = payload if isinstance(payload, bytes) else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    blob.upload_blob(data, overwrite=True)
 
 
 def now_iso() -> str:
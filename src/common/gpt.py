@@ -0,0 +1,229 @@
+import json
+import threading
+from typing import Dict, Any, Tuple, Callable, List, Optional
+
+from common.models import TriageInput, GPTClassification
+from common.ratelimit import scheduled
+from common.resilience import Cancelled, Endpoint, as_route
+
+
+# Original free-text prompt, kept for GPT_OUTPUT_MODE=text
+TEXT_SYSTEM_PROMPT = "You are an IT support triage assistant. Classify email priority (high/medium/low) and suggest 1-3 actions."
+
+# Byte-for-byte stable across requests so the service can reuse its prompt cache for the prefix;
+# everything message-specific goes in the user turn.
+STRUCTURED_SYSTEM_PROMPT = (
+    "You are an IT support triage assistant. Classify the email's operational priority and suggest actions.\n"
+    "Priority rubric:\n"
+    "- high: urgent, time-sensitive, safety-relevant, or blocking work for the sender.\n"
+    "- medium: needs a human response but is not urgent.\n"
+    "- low: informational, routine, or answerable with a standard reply.\n"
+    "Return JSON only. `reason`: one sentence. `suggested_actions`: 1-3 short imperative actions, no numbering."
+)
+
+GPT_OUTPUT_SCHEMA: Dict[str, Any] = {
+    "name": "triage_classification",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "priority": {"type": "string", "enum": ["high", "medium", "low"]},
+            "reason": {"type": "string"},
+            "suggested_actions": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["priority", "reason", "suggested_actions"],
+        "additionalProperties": False,
+    },
+}
+
+# Process-wide GPT usage counters
+USAGE: Dict[str, int] = {
+    "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "parse_fallbacks": 0,
+}
+
+
+def system_prompt(s: Dict[str, Any]) -> str:
+    return TEXT_SYSTEM_PROMPT if s.get("gpt_output_mode", "structured") == "text" else STRUCTURED_SYSTEM_PROMPT
+
+
+def gpt_user_prompt(ti: TriageInput) -> str:
+    return f"Subject: {ti.subject}\nBody: {ti.body}\nSender: {ti.sender}\nImportance: {ti.importance}"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate (~4 characters per token for English text).
+    """
+    return len(text) // 4 + 1
+
+
+def parse_text_reply(msg: str) -> GPTClassification:
+    """
+    Legacy free-text parsing: first priority word found anywhere wins.
+    """
+    pr = "medium"
+    if "high" in msg.lower(): pr = "high"
+    elif "low" in msg.lower(): pr = "low"
+    return GPTClassification(priority=pr, reason=msg, suggested_actions=msg.split("\n"))
+
+
+def parse_structured_reply(msg: str) -> GPTClassification:
+    """
+    Parse a JSON reply that follows GPT_OUTPUT_SCHEMA. Raises ValueError if it does not.
+    """
+    return parse_classification(json.loads(msg))
+
+
+def parse_classification(data: Any) -> GPTClassification:
+    """
+    A decoded GPT_OUTPUT_SCHEMA object as a classification. Raises ValueError if it does not fit.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("GPT reply is not a JSON object")
+    priority = str(data.get("priority", "")).lower()
+    if priority not in ("high", "medium", "low"):
+        raise ValueError(f"Unexpected priority {priority!r}")
+    actions = [str(a).strip() for a in data.get("suggested_actions") or [] if str(a).strip()]
+    return GPTClassification(priority=priority, reason=str(data.get("reason", "")), suggested_actions=actions[:3])
+
+
+def usage_dict(usage) -> Dict[str, int]:
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+    }
+
+
+def response_format(s: Dict[str, Any]):
+    mode = s.get("gpt_output_mode", "structured")
+    if mode == "structured":
+        return {"type": "json_schema", "json_schema": GPT_OUTPUT_SCHEMA}
+    if mode == "json":
+        # For deployments without json_schema support: JSON mode plus the schema in the prompt
+        return {"type": "json_object"}
+    return None
+
+
+def chat_request(s: Dict[str, Any], ti: TriageInput) -> Dict[str, Any]:
+    """
+    Keyword arguments for `chat.completions.create` for one message.
+    """
+    mode = s.get("gpt_output_mode", "structured")
+    system = system_prompt(s)
+    if mode == "json":
+        system += "\nJSON schema: " + json.dumps(GPT_OUTPUT_SCHEMA["schema"], separators=(",", ":"))
+    kwargs: Dict[str, Any] = {
+        "model": s["openai_deployment"],
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": gpt_user_prompt(ti)}],
+        "temperature": 0.0,
+        "max_tokens": s.get("gpt_max_tokens") or (250 if mode == "text" else 160),
+    }
+    fmt = response_format(s)
+    if fmt is not None:
+        kwargs["response_format"] = fmt
+    return kwargs
+
+
+def request_tokens(kwargs: Dict[str, Any]) -> int:
+    """
+    Tokens a request may use (prompt estimate plus the completion cap), for the rate limiter.
+    """
+    return estimate_tokens("".join(m["content"] for m in kwargs["messages"])) + kwargs["max_tokens"]
+
+
+def record_usage(usage) -> Dict[str, int]:
+    out = usage_dict(usage)
+    USAGE["calls"] += 1
+    for k, v in out.items():
+        USAGE[k] += v
+    return out
+
+
+def parse_reply(msg: str, s: Dict[str, Any]) -> GPTClassification:
+    if s.get("gpt_output_mode", "structured") == "text":
+        return parse_text_reply(msg)
+    try:
+        return parse_structured_reply(msg)
+    except ValueError:
+        # Truncated or refused output: keep the legacy heuristic rather than failing the triage
+        USAGE["parse_fallbacks"] += 1
+        return parse_text_reply(msg)
+
+
+def classify_gpt(oa, s: Dict[str, Any], ti: TriageInput) -> Tuple[GPTClassification, Dict[str, int]]:
+    """
+    One chat completion for one message. Returns the classification and its token usage.
+    `oa` is an OpenAI client or the service's Route (hedged to the secondary deployment).
+    """
+    def attempt(ep: Endpoint, timeout: float):
+        kwargs = chat_request(ep.settings, ti)
+        return scheduled(
+            s, "openai",
+            lambda: ep.client.chat.completions.create(**kwargs, timeout=timeout),
+            tokens=request_tokens(kwargs),
+            deployment=ep.lane,
+            actual_tokens=lambda c: c.usage.total_tokens,
+        )
+
+    chat = as_route(oa, "openai", s).call(s, attempt)
+    usage = record_usage(getattr(chat, "usage", None))
+    return parse_reply(chat.choices[0].message.content or "", s), usage
+
+
+class StreamCancelled(Cancelled):
+    """
+    Raised by `classify_gpt_stream` when its `cancel` event is set before the reply is complete.
+    """
+
+
+def classify_gpt_stream(oa, s: Dict[str, Any], ti: TriageInput, on_delta: Callable[[str], None],
+                        cancel: Optional[threading.Event] = None) -> Tuple[GPTClassification, Dict[str, int]]:
+    """
+    Streaming variant of `classify_gpt`: `on_delta(text)` is called with each fragment of the
+    reply as it arrives. Setting `cancel` closes the stream (which stops generation and its
+    billing) at the next fragment. When the call is hedged, fragments are passed on from
+    whichever attempt sent the first one, and the losing stream is closed once the call settles.
+    """
+    settled = threading.Event()
+    owner: List[str] = []
+    owner_lock = threading.Lock()
+
+    def attempt(ep: Endpoint, timeout: float):
+        kwargs = dict(chat_request(ep.settings, ti), stream=True, stream_options={"include_usage": True})
+        tokens = request_tokens(kwargs)
+
+        def consume():
+            parts: List[str] = []
+            usage = None
+            stream = ep.client.chat.completions.create(**kwargs, timeout=timeout)
+            try:
+                for chunk in stream:
+                    if (cancel is not None and cancel.is_set()) or settled.is_set():
+                        raise StreamCancelled()
+                    usage = getattr(chunk, "usage", None) or usage
+                    for choice in chunk.choices or []:
+                        text = choice.delta.content if choice.delta is not None else None
+                        if text:
+                            parts.append(text)
+                            with owner_lock:
+                                if not owner:
+                                    owner.append(ep.name)
+                            if owner[0] == ep.name:
+                                on_delta(text)
+            finally:
+                stream.close()
+            return "".join(parts), usage
+
+        return scheduled(
+            s, "openai", consume,
+            tokens=tokens,
+            deployment=ep.lane,
+            actual_tokens=lambda r: r[1].total_tokens if r[1] is not None else tokens,
+        )
+
+    msg, usage = as_route(oa, "openai", s).call(s, attempt, settled)
+    return parse_reply(msg, s), record_usage(usage)
@@ -0,0 +1,276 @@
+import os
+import gzip
+import sqlite3
+import datetime
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from common.archive import SHARD_EXTENSIONS, is_archive_blob
+from common.serialization import loads, unpack_records, unpack_tail
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    id                TEXT PRIMARY KEY,
+    ts                TEXT NOT NULL,
+    day               TEXT NOT NULL,
+    sender            TEXT,
+    subject           TEXT,
+    combined_priority TEXT,
+    routing_hint      TEXT,
+    blocked           INTEGER,
+    max_severity      INTEGER,
+    sev_hate          INTEGER,
+    sev_selfharm      INTEGER,
+    sev_sexual        INTEGER,
+    sev_violence      INTEGER,
+    sentiment         TEXT,
+    sentiment_pos     REAL,
+    sentiment_neg     REAL,
+    gpt_priority      TEXT,
+    blob              TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_verdicts_ts ON verdicts (ts);
+CREATE INDEX IF NOT EXISTS ix_verdicts_sender_ts ON verdicts (sender, ts);
+CREATE INDEX IF NOT EXISTS ix_verdicts_priority_day ON verdicts (combined_priority, day);
+CREATE INDEX IF NOT EXISTS ix_verdicts_route_day ON verdicts (routing_hint, day);
+CREATE INDEX IF NOT EXISTS ix_verdicts_severity_ts ON verdicts (max_severity, ts);
+CREATE INDEX IF NOT EXISTS ix_verdicts_sentiment_day ON verdicts (sentiment, day);
+
+-- How far each append-blob shard has been read (legacy per-message blobs use the watermark)
+CREATE TABLE IF NOT EXISTS ingest_state (
+    blob          TEXT PRIMARY KEY,
+    offset        INTEGER NOT NULL,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS watermark (
+    name  TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns callers may filter or group on
+COLUMNS = ("ts", "day", "sender", "subject", "combined_priority", "routing_hint", "blocked", "max_severity",
+           "sev_hate", "sev_selfharm", "sev_sexual", "sev_violence", "sentiment", "gpt_priority")
+GROUPABLE = ("day", "sender", "combined_priority", "routing_hint", "blocked", "max_severity", "sentiment",
+             "gpt_priority")
+
+# Legacy blobs modified this long before the watermark are re-checked, to cover clock skew
+LEGACY_OVERLAP = datetime.timedelta(minutes=10)
+
+
+def to_row(record: Dict[str, Any], blob: str) -> Optional[Tuple]:
+    """
+    Flatten one archived TriageOutput into a `verdicts` row (None if it has no id).
+    """
+    meta = record.get("metadata") or {}
+    if not meta.get("id"):
+        return None
+    ts = meta.get("timestamp") or ""
+    sev = {c["category"]: c.get("severity") or 0 for c in (record.get("safety") or {}).get("categories", [])}
+    sentiment = record.get("sentiment") or {}
+    conf = sentiment.get("confidence") or {}
+    return (
+        meta["id"], ts, ts[:10], meta.get("sender"), meta.get("subject"),
+        record.get("combined_priority"), record.get("routing_hint"),
+        int(bool((record.get("safety") or {}).get("blocked"))), max(sev.values(), default=0),
+        sev.get("Hate", 0), sev.get("SelfHarm", 0), sev.get("Sexual", 0), sev.get("Violence", 0),
+        sentiment.get("sentiment"), conf.get("positive"), conf.get("negative"),
+        (record.get("gpt") or {}).get("priority"), blob,
+    )
+
+
+def decode_tail(name: str, data: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Decode the bytes appended to an archive blob since the last read. Returns the records and
+    how many bytes were consumed: a trailing partial line or msgpack record (or gzip member still
+    being written) is left for the next run.
+    """
+    if name.endswith(".gz"):
+        try:
+            text = gzip.decompress(data)
+        except (EOFError, OSError):
+            return [], 0
+        used = len(data)
+        if name.endswith(".msgpack.gz"):
+            return list(unpack_records(text)), used
+    elif name.endswith(".msgpack"):
+        return unpack_tail(data)
+    elif name.endswith(".ndjson"):
+        used = data.rfind(b"\n") + 1
+        text = data[:used]
+    else:
+        return [loads(data)], len(data)
+    return [loads(line) for line in text.splitlines() if line.strip()], used
+
+
+class ArchiveIndex:
+    """
+    Local SQLite index over the triage archive, maintained incrementally.
+
+    Shards are append blobs, so each is read from the byte offset where the previous run
+    stopped; legacy `{id}.json` blobs are picked up by last-modified time against a watermark.
+    Rows are keyed by result id, so re-reading anything is harmless.
+    """
+
+    def __init__(self, path: str = "triage_index.sqlite"):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._db.close()
+
+    # ---------- Ingest ----------
+
+    def _offsets(self) -> Dict[str, int]:
+        return {r["blob"]: r["offset"] for r in self._db.execute("SELECT blob, offset FROM ingest_state")}
+
+    def _watermark(self) -> Optional[datetime.datetime]:
+        row = self._db.execute("SELECT value FROM watermark WHERE name = 'legacy'").fetchone()
+        return datetime.datetime.fromisoformat(row["value"]) if row else None
+
+    def add_records(self, records: Iterable[Dict[str, Any]], blob: str = "") -> int:
+        rows = [r for r in (to_row(rec, blob) for rec in records) if r is not None]
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO verdicts VALUES ({','.join('?' * 18)})", rows)
+        return len(rows)
+
+    def ingest(self, source, s: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Pull everything new from `source` (see BlobSource / DirSource). Returns counters.
+        """
+        offsets = self._offsets()
+        watermark = self._watermark()
+        newest = watermark
+        stats = {"blobs_listed": 0, "blobs_read": 0, "records": 0, "bytes": 0}
+        for name, size, modified in source.list():
+            if not is_archive_blob(name, s):
+                continue
+            stats["blobs_listed"] += 1
+            shard = name.endswith(SHARD_EXTENSIONS)
+            if shard:
+                offset = offsets.get(name, 0)
+                if size <= offset:
+                    continue
+            else:
+                if watermark and modified and modified < watermark - LEGACY_OVERLAP:
+                    continue
+                offset = 0
+            data = source.read(name, offset)
+            records, used = decode_tail(name, data)
+            stats["blobs_read"] += 1
+            stats["bytes"] += used
+            stats["records"] += self.add_records(records, name)
+            if shard and used:
+                with self._lock, self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO ingest_state (blob, offset, last_modified) VALUES (?, ?, ?)",
+                        (name, offset + used, modified.isoformat() if modified else None),
+                    )
+            elif not shard and modified and (newest is None or modified > newest):
+                newest = modified
+        if newest is not None and newest != watermark:
+            with self._lock, self._db:
+                self._db.execute("INSERT OR REPLACE INTO watermark (name, value) VALUES ('legacy', ?)",
+                                 (newest.isoformat(),))
+        return stats
+
+    # ---------- Query ----------
+
+    @staticmethod
+    def _where(since: Optional[str], until: Optional[str], filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if since:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until:
+            clauses.append("ts < ?")
+            params.append(until)
+        for col, value in filters.items():
+            if value is None:
+                continue
+            if col == "min_severity":
+                clauses.append("max_severity >= ?")
+            elif col in COLUMNS:
+                clauses.append(f"{col} = ?")
+            else:
+                raise ValueError(f"Unknown filter {col!r}")
+            params.append(int(value) if isinstance(value, bool) else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None, limit: int = 100,
+              **filters: Any) -> List[Dict[str, Any]]:
+        """
+        Matching verdicts, newest first. `since` / `until` are ISO dates or timestamps (UTC);
+        other filters are column equality (e.g. sender=..., combined_priority="blocked") or
+        `min_severity`.
+        """
+        where, params = self._where(since, until, filters)
+        sql = f"SELECT * FROM verdicts{where} ORDER BY ts DESC LIMIT ?"
+        return [dict(r) for r in self._db.execute(sql, params + [limit])]
+
+    def counts(self, by: str = "combined_priority", since: Optional[str] = None, until: Optional[str] = None,
+               per_day: bool = True, **filters: Any) -> List[Dict[str, Any]]:
+        """
+        Row counts grouped by `by` (and by day unless `per_day` is False).
+        """
+        if by not in GROUPABLE:
+            raise ValueError(f"Cannot group by {by!r}; use one of {', '.join(GROUPABLE)}")
+        where, params = self._where(since, until, filters)
+        keys = f"day, {by}" if per_day and by != "day" else by
+        sql = f"SELECT {keys}, COUNT(*) AS n FROM verdicts{where} GROUP BY {keys} ORDER BY {keys}"
+        return [dict(r) for r in self._db.execute(sql, params)]
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._db.execute("SELECT COUNT(*) AS n, MIN(ts) AS first, MAX(ts) AS last FROM verdicts").fetchone()
+        shards = self._db.execute("SELECT COUNT(*) AS n FROM ingest_state").fetchone()["n"]
+        watermark = self._watermark()
+        return {"verdicts": row["n"], "first": row["first"], "last": row["last"], "shards": shards,
+                "legacy_watermark": watermark.isoformat() if watermark else None}
+
+
+# ---------- Sources ----------
+
+class BlobSource:
+    """
+    The archive container: `list()` streams `(name, size, last_modified)` from the paged
+    `list_blobs`, `read()` downloads from a byte offset (range read).
+    """
+
+    def __init__(self, blob_svc, s: Dict[str, Any], name_starts_with: Optional[str] = None):
+        self.container = blob_svc.get_container_client(s["blob_container"])
+        self.name_starts_with = name_starts_with
+
+    def list(self) -> Iterator[Tuple[str, int, Optional[datetime.datetime]]]:
+        for props in self.container.list_blobs(name_starts_with=self.name_starts_with):
+            yield props.name, props.size, props.last_modified
+
+    def read(self, name: str, offset: int = 0) -> bytes:
+        return self.container.download_blob(name, offset=offset or None).readall()
+
+
+class DirSource:
+    """
+    A local copy of the container (same relative paths), for offline indexing.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def list(self) -> Iterator[Tuple[str, int, Optional[datetime.datetime]]]:
+        for dirpath, _, files in os.walk(self.root):
+            for f in sorted(files):
+                path = os.path.join(dirpath, f)
+                st = os.stat(path)
+                modified = datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc)
+                yield os.path.relpath(path, self.root).replace(os.sep, "/"), st.st_size, modified
+
+    def read(self, name: str, offset: int = 0) -> bytes:
+        with open(os.path.join(self.root, name), "rb") as f:
+            f.seek(offset)
+            return f.read()
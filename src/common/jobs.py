@@ -0,0 +1,180 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple, List, Union
+
+from azure.core.exceptions import ResourceNotFoundError, HttpResponseError
+
+from common.clients import ensure_container, now_iso
+from common.models import TriageInput
+from common.serialization import Encoded, dumps, dumps_with
+
+
+# Storage queue messages are capped at 64 KiB (base64 adds a third), so larger inputs go to a blob
+MAX_INLINE_MESSAGE = 45 * 1024
+
+
+def is_job_id(job_id: str) -> bool:
+    try:
+        return str(uuid.UUID(job_id)) == job_id
+    except (ValueError, TypeError):
+        return False
+
+
+def job_blob_name(s: Dict[str, Any], job_id: str, suffix: str = "") -> str:
+    return f"{s.get('jobs_prefix', 'jobs/')}{job_id}{suffix}.json"
+
+
+def job_events_blob_name(s: Dict[str, Any], job_id: str) -> str:
+    return f"{s.get('jobs_prefix', 'jobs/')}{job_id}.events.ndjson"
+
+
+def _upload(blob_svc, s: Dict[str, Any], name: str, payload: Union[Dict[str, Any], bytes]) -> None:
+    ensure_container(blob_svc, s["blob_container"])
+    blob = blob_svc.get_blob_client(s["blob_container"], name)
+    blob.upload_blob(payload if isinstance(payload, bytes) else dumps(payload), overwrite=True)
+
+
+def _download(blob_svc, s: Dict[str, Any], name: str) -> Optional[Dict[str, Any]]:
+    try:
+        blob = blob_svc.get_blob_client(s["blob_container"], name)
+        return json.loads(blob.download_blob().readall())
+    except ResourceNotFoundError:
+        return None
+
+
+def new_job_message(ti: TriageInput, s: Dict[str, Any], blob_svc_factory) -> Tuple[str, str]:
+    """
+    Build the queue message for a job. Returns `(job_id, message_json)`.
+    Inputs too large for a queue message are parked in `jobs/{id}.input.json` and referenced.
+    """
+    job_id = str(uuid.uuid4())
+    msg = {"job_id": job_id, "enqueued_at": now_iso(), "input": ti.model_dump()}
+    body = json.dumps(msg, separators=(",", ":"))
+    if len(body.encode("utf-8")) > MAX_INLINE_MESSAGE:
+        name = job_blob_name(s, job_id, ".input")
+        _upload(blob_svc_factory(), s, name, msg["input"])
+        body = json.dumps({"job_id": job_id, "enqueued_at": msg["enqueued_at"], "input_blob": name})
+    return job_id, body
+
+
+def load_job_input(msg: Dict[str, Any], s: Dict[str, Any], blob_svc) -> TriageInput:
+    if "input_blob" in msg:
+        data = _download(blob_svc, s, msg["input_blob"])
+        if data is None:
+            raise ValueError(f"Job input blob {msg['input_blob']} is missing")
+        return TriageInput(**data)
+    return TriageInput(**msg["input"])
+
+
+def write_job_status(blob_svc, s: Dict[str, Any], job_id: str, status: str,
+                     result: Optional[Encoded] = None, error: Optional[str] = None) -> None:
+    payload: Dict[str, Any] = {"job_id": job_id, "status": status, "updated_at": now_iso()}
+    if error is not None:
+        payload["error"] = error
+    # The result's JSON bytes are spliced in rather than encoded a second time
+    data = dumps_with(payload, result=result.json) if result is not None else dumps(payload)
+    _upload(blob_svc, s, job_blob_name(s, job_id), data)
+
+
+def read_job_status(blob_svc, s: Dict[str, Any], job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The job's status document, or None if the worker has not finished it yet.
+    """
+    return _download(blob_svc, s, job_blob_name(s, job_id))
+
+
+# Events that end a streamed triage
+FINAL_EVENTS = ("result", "error")
+
+
+class JobEvents:
+    """
+    Progress events of one streamed triage, as NDJSON in an append blob
+    (`jobs/{id}.events.ndjson`) that clients poll while the request is in flight.
+
+    `emit()` only buffers, so stage threads never wait on storage. A writer thread appends
+    what is pending straight away after stage events, and at most every STREAM_FLUSH_MS
+    while GPT fragments trickle in. Every line (bytes) is also kept in `lines` for the response body.
+    """
+
+    def __init__(self, blob_svc, s: Dict[str, Any], job_id: str):
+        self.job_id = job_id
+        self.lines: List[bytes] = []
+        self.flush_s = s.get("stream_flush_ms", 250) / 1000.0
+        self.started = time.perf_counter()
+        self._blob_svc = blob_svc
+        self._s = s
+        self._pending: List[bytes] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="job-events", daemon=True)
+        self._thread.start()
+
+    def emit(self, event: Dict[str, Any], data: Optional[bytes] = None) -> None:
+        """
+        Record `event`; `data` is an already-encoded JSON value for its "data" key.
+        """
+        event = dict(event, ms=round((time.perf_counter() - self.started) * 1000, 1))
+        line = (dumps_with(event, data=data) if data is not None else dumps(event)) + b"\n"
+        with self._lock:
+            self.lines.append(line)
+            self._pending.append(line)
+        if event.get("event") != "gpt_delta":
+            self._wake.set()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Write whatever is still pending and stop the writer.
+        """
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        blob = None
+        try:
+            ensure_container(self._blob_svc, self._s["blob_container"])
+            blob = self._blob_svc.get_blob_client(self._s["blob_container"], job_events_blob_name(self._s, self.job_id))
+            blob.create_append_blob()
+        except Exception as ex:
+            logging.warning("Events blob for %s could not be created: %s", self.job_id, ex)
+            blob = None
+        while True:
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            with self._lock:
+                data, self._pending = b"".join(self._pending), []
+                closed = self._closed
+            if data and blob is not None:
+                try:
+                    blob.append_block(data)
+                except Exception as ex:
+                    logging.warning("Events append for %s failed: %s", self.job_id, ex)
+                    blob = None
+            if closed:
+                return
+
+
+def read_job_events(blob_svc, s: Dict[str, Any], job_id: str,
+                    offset: int = 0) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+    """
+    Complete events written after byte `offset`, and the offset to ask for next time.
+    None if the events blob does not exist (yet).
+    """
+    blob = blob_svc.get_blob_client(s["blob_container"], job_events_blob_name(s, job_id))
+    try:
+        data = blob.download_blob(offset=offset).readall() if offset else blob.download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    except HttpResponseError as ex:
+        if ex.status_code == 416:  # nothing after `offset` yet
+            return [], offset
+        raise
+    complete = data[:data.rfind(b"\n") + 1]
+    events = [json.loads(line) for line in complete.splitlines() if line.strip()]
+    return events, offset + len(complete)
@@ -1,21 +1,36 @@
-from typing import Dict, Any, List
-from azure.ai.contentsafety.models import AnalyzeTextOptions, TextCategory
+from typing import Any, Dict, List, Optional
 from common.models import SafetyResult, SafetyCategory, SentimentResult, GPTClassification
 
 
+# Any category at or above this severity blocks the message
+BLOCK_SEVERITY = 4
+
+# Sender trend escalation (features from common.sender_risk)
+SENDER_MIN_MESSAGES = 3         # decayed baseline messages before a sender's trend counts
+SENDER_RISING_MARGIN = 0.15     # recent negative share above the baseline share
+SENDER_RISING_SEVERITY = 1.0    # recent mean severity above the baseline mean
+SENDER_BLOCKED_HIGH = 2         # recently blocked messages (decayed) that make a sender high risk
+
+
+def evaluate_safety(categories: List[SafetyCategory]) -> SafetyResult:
+    """
+    Apply the block threshold to per-category severities.
+    Used for live Content Safety responses and when replaying archived verdicts.
+    """
+    blocked = any(c.severity is not None and c.severity >= BLOCK_SEVERITY for c in categories)
+    return SafetyResult(blocked=blocked, categories=list(categories))
+
+
 def map_safety(resp) -> SafetyResult:
     """
     Map Azure Content Safety response into our SafetyResult.
-    Any category with severity >= 4 triggers `blocked=True`.
+    Any category with severity >= BLOCK_SEVERITY triggers `blocked=True`.
     """
-    blocked = False
     cats: List[SafetyCategory] = []
     if resp and getattr(resp, "categories_analysis", None):
         for ca in resp.categories_analysis:
             cats.append(SafetyCategory(category=str(ca.category), severity=ca.severity))
-            if ca.severity is not None and ca.severity >= 4:
-                blocked = True
-    return SafetyResult(blocked=blocked, categories=cats)
+    return evaluate_safety(cats)
 
 
 def apply_security_overrides(gpt: GPTClassification, safety: SafetyResult) -> GPTClassification:
@@ -41,6 +56,47 @@ def apply_security_overrides(gpt: GPTClassification, safety: SafetyResult) -> GP
     )
 
 
+def degraded_gpt(priority: str = "medium") -> GPTClassification:
+    """
+    GPT section used when the classification was unavailable (GPT_OPTIONAL).
+    The fixed priority should send the message to a person rather than an auto-reply.
+    """
+    return GPTClassification(
+        priority=priority,
+        reason="Automated classification unavailable; triaged on safety and sentiment only.",
+        suggested_actions=["Review the message manually.", "Re-run triage once classification is available."],
+    )
+
+
+def watchlist_gpt(watchlist: Dict[str, Any]) -> GPTClassification:
+    """
+    GPT section for a message quarantined on a watchlist `block` hit, before any remote call.
+    """
+    return GPTClassification(
+        priority="blocked",
+        reason=f"Matched security watchlist ({', '.join(watchlist['lists'])}). Quarantine and escalate to security.",
+        suggested_actions=[
+            "Quarantine the message (do not deliver to recipient).",
+            "Open an incident and notify Intelligence Unit / Security.",
+            "Preserve full headers and body for evidence.",
+            "Confirm the match; report false positives to the watchlist owners.",
+        ],
+    )
+
+
+def escalate_for_watchlist(priority: str, watchlist: Optional[Dict[str, Any]]) -> str:
+    """
+    Apply a watchlist hit (`metadata.watchlist`): 'block' means blocked, 'escalate' at least high.
+    'flag' only records the match. Never lowers a priority.
+    """
+    action = (watchlist or {}).get("action")
+    if action == "block":
+        return "blocked"
+    if action == "escalate" and priority != "blocked":
+        return "high"
+    return priority
+
+
 def combine_priority(safety: SafetyResult, sentiment: SentimentResult, gpt: GPTClassification) -> str:
     """
     Priority rules:
@@ -59,11 +115,45 @@ def combine_priority(safety: SafetyResult, sentiment: SentimentResult, gpt: GPTC
     return gpt.priority.lower()
 
 
-def routing_hint(priority: str) -> str:
+def sender_risk_level(risk: Optional[Dict[str, Any]]) -> str:
+    """
+    Classify a sender's rolling features:
+      'high'      repeated recent blocks, or a recent mean severity one step below the block threshold
+      'elevated'  recent negativity or severity rising above the sender's own baseline
+      'normal'    otherwise, and always for senders with too little history
+    """
+    if not risk or risk["baseline"]["messages"] < SENDER_MIN_MESSAGES:
+        return "normal"
+    recent, baseline = risk["recent"], risk["baseline"]
+    if recent["blocked"] >= SENDER_BLOCKED_HIGH or max(recent["severity"].values(), default=0) >= BLOCK_SEVERITY - 1:
+        return "high"
+    if recent["negative_share"] >= 0.5 and recent["negative_share"] >= baseline["negative_share"] + SENDER_RISING_MARGIN:
+        return "elevated"
+    for category, mean in recent["severity"].items():
+        if mean >= SENDER_RISING_SEVERITY and mean >= baseline["severity"].get(category, 0) + SENDER_RISING_SEVERITY / 2:
+            return "elevated"
+    return "normal"
+
+
+def escalate_for_sender(priority: str, level: str) -> str:
+    """
+    Raise priority for a risky sender: 'elevated' moves low -> medium -> high, 'high' means at least high.
+    Never lowers a priority and leaves 'blocked' alone.
+    """
+    if priority == "blocked" or level == "normal":
+        return priority
+    if level == "high":
+        return "high"
+    return {"low": "medium", "medium": "high"}.get(priority, priority)
+
+
+def routing_hint(priority: str, sender_level: str = "normal", watchlist_action: Optional[str] = None) -> str:
     """
     Map final priority to a routing destination.
+    High-risk senders and escalating watchlist hits go to the Intelligence Unit even when
+    this message alone is not blocked.
     """
-    if priority == "blocked":
+    if priority == "blocked" or sender_level == "high" or watchlist_action in ("escalate", "block"):
         return "Security Review / Intelligence Unit"
     if priority == "high":
         return "Teams + ITSM Ticket"
@@ -0,0 +1,249 @@
+import re
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+
+
+class Histogram:
+    """
+    Log-linear latency histogram in the style of HdrHistogram: values are kept in microseconds,
+    each power of two is split into 2**SUB_BITS linear sub-buckets, so any percentile is
+    within ~3% of the true value using a few hundred sparse counters whatever the range.
+    """
+
+    SUB_BITS = 5
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _index(cls, v: int) -> int:
+        if v < (1 << cls.SUB_BITS):
+            return v
+        shift = v.bit_length() - cls.SUB_BITS - 1
+        return (shift << cls.SUB_BITS) + (v >> shift)
+
+    @classmethod
+    def _midpoint(cls, idx: int) -> float:
+        if idx < (2 << cls.SUB_BITS):
+            return float(idx)
+        shift = (idx >> cls.SUB_BITS) - 1
+        mantissa = idx - (shift << cls.SUB_BITS)
+        return ((mantissa << shift) + ((mantissa + 1) << shift) - 1) / 2.0
+
+    def record(self, ms: float) -> None:
+        us = max(int(ms * 1000), 0)
+        idx = self._index(us)
+        with self._lock:
+            self.counts[idx] = self.counts.get(idx, 0) + 1
+            self.count += 1
+            self.total_us += us
+            if us > self.max_us:
+                self.max_us = us
+
+    def percentiles(self, qs: List[float]) -> Dict[float, float]:
+        """
+        Values in milliseconds at the given quantiles (0..1).
+        """
+        with self._lock:
+            items = sorted(self.counts.items())
+            count = self.count
+        out: Dict[float, float] = {}
+        if not count:
+            return {q: 0.0 for q in qs}
+        for q in qs:
+            target = max(q * count, 1)
+            seen = 0
+            for idx, n in items:
+                seen += n
+                if seen >= target:
+                    out[q] = round(self._midpoint(idx) / 1000.0, 3)
+                    break
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        p = self.percentiles([0.5, 0.9, 0.99])
+        return {
+            "count": self.count, "sum_ms": round(self.total_us / 1000.0, 3), "max_ms": round(self.max_us / 1000.0, 3),
+            "p50_ms": p[0.5], "p90_ms": p[0.9], "p99_ms": p[0.99],
+        }
+
+
+class Metrics:
+    """
+    Process-wide registry: one latency histogram per stage and labelled counters.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, ms: float) -> None:
+        h = self.histograms.get(stage)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(stage, Histogram())
+        h.record(ms)
+
+    def inc(self, name: str, n: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stages": {stage: h.summary() for stage, h in list(self.histograms.items())},
+            "counters": [{"name": name, "labels": dict(labels), "value": v}
+                         for (name, labels), v in list(self.counters.items())],
+        }
+
+
+METRICS = Metrics()
+
+
+class Timings:
+    """
+    Per-request stage timings. Every stage is recorded into the process histograms and kept
+    for the request's `metadata.timings_ms`. Stages that run on executor threads are timed
+    where they run via `wrap`.
+    """
+
+    __slots__ = ("ms",)
+
+    def __init__(self):
+        self.ms: Dict[str, float] = {}
+
+    def add(self, stage: str, ms: float) -> None:
+        self.ms[stage] = round(self.ms.get(stage, 0.0) + ms, 2)
+        METRICS.observe(stage, ms)
+
+    def since(self, stage: str, started: float) -> float:
+        """
+        Record the time since `started` (a `time.perf_counter()` value) and return now, for chaining.
+        """
+        now = time.perf_counter()
+        self.add(stage, (now - started) * 1000.0)
+        return now
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.since(name, started)
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.since(stage, started)
+        return timed
+
+    def count(self, name: str, n: float = 1, **labels: str) -> None:
+        METRICS.inc(name, n, **labels)
+
+    def snapshot(self) -> Optional[Dict[str, float]]:
+        return dict(self.ms)
+
+
+class _NullTimings(Timings):
+    """
+    Used when TRIAGE_METRICS is off: nothing is recorded and `wrap` returns the callable unchanged.
+    """
+
+    def add(self, stage: str, ms: float) -> None:
+        pass
+
+    def since(self, stage: str, started: float) -> float:
+        return started
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        yield
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        return fn
+
+    def count(self, name: str, n: float = 1, **labels: str) -> None:
+        pass
+
+    def snapshot(self) -> Optional[Dict[str, float]]:
+        return None
+
+
+NULL_TIMINGS = _NullTimings()
+
+
+def request_timings(s: Dict[str, Any]) -> Timings:
+    return Timings() if s.get("metrics_enabled", True) else NULL_TIMINGS
+
+
+# ---------- Prometheus text format ----------
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _name(*parts: str) -> str:
+    return _NAME_RE.sub("_", "_".join(p for p in parts if p)).lower()
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(groups: Optional[Dict[str, Dict[str, Any]]] = None, prefix: str = "triage") -> str:
+    """
+    Stage histograms as summaries (`<prefix>_stage_duration_ms`), the registry counters, and
+    component stats as gauges. In `groups`, `{"cache": {"misses": 3}}` becomes
+    `triage_cache_misses 3`; one more level of nesting becomes a label, e.g. rate-limit lanes:
+    `{"ratelimit": {"openai": {"calls": 5}}}` -> `triage_ratelimit_calls{key="openai"} 5`.
+    """
+    lines: List[str] = []
+    metric = _name(prefix, "stage_duration_ms")
+    lines.append(f"# HELP {metric} Pipeline stage latency in milliseconds.")
+    lines.append(f"# TYPE {metric} summary")
+    for stage, h in sorted(METRICS.histograms.items()):
+        for q, v in h.percentiles([0.5, 0.9, 0.95, 0.99]).items():
+            lines.append(f"{metric}{_labels({'stage': stage, 'quantile': str(q)})} {v}")
+        lines.append(f"{metric}_sum{_labels({'stage': stage})} {h.total_us / 1000.0}")
+        lines.append(f"{metric}_count{_labels({'stage': stage})} {h.count}")
+    max_metric = _name(prefix, "stage_duration_max_ms")
+    lines.append(f"# TYPE {max_metric} gauge")
+    for stage, h in sorted(METRICS.histograms.items()):
+        lines.append(f"{max_metric}{_labels({'stage': stage})} {h.max_us / 1000.0}")
+
+    by_name: Dict[str, List[str]] = {}
+    for (name, labels), v in sorted(METRICS.counters.items()):
+        by_name.setdefault(_name(prefix, name), []).append(f"{_name(prefix, name)}{_labels(dict(labels))} {v}")
+    for name, rows in by_name.items():
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(rows)
+
+    for group, values in (groups or {}).items():
+        flat: Dict[str, List[str]] = {}
+        for key, value in (values or {}).items():
+            if isinstance(value, dict):
+                for sub, v in value.items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        flat.setdefault(_name(prefix, group, sub), []).append(f"{_labels({'key': key})} {v}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                flat.setdefault(_name(prefix, group, key), []).append(f" {value}")
+        for name, rows in flat.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(name + r for r in rows)
+    return "\n".join(lines) + "\n"
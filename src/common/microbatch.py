@@ -0,0 +1,291 @@
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+from common.gpt import (
+    GPT_OUTPUT_SCHEMA, STRUCTURED_SYSTEM_PROMPT, chat_request, classify_gpt, estimate_tokens, gpt_user_prompt,
+    parse_classification, record_usage, request_tokens,
+)
+from common.models import TriageInput, GPTClassification
+from common.ratelimit import scheduled
+from common.resilience import Endpoint, as_route
+
+
+# Same prefix as the single-message prompt (so both share the service's prompt cache), plus the
+# batch framing. Message-specific text goes in the user turn, under `### Message <id>` headers.
+BATCH_SYSTEM_PROMPT = STRUCTURED_SYSTEM_PROMPT + (
+    "\nSeveral emails follow, each under a `### Message <id>` header. Classify each one on its own, "
+    "as if it were the only email. Return one entry per message in `results`, with its `id`."
+)
+
+_ITEM = GPT_OUTPUT_SCHEMA["schema"]
+
+BATCH_OUTPUT_SCHEMA: Dict[str, Any] = {
+    "name": "triage_classification_batch",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"id": {"type": "integer"}, **_ITEM["properties"]},
+                    "required": ["id"] + _ITEM["required"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
+
+
+def batch_request(s: Dict[str, Any], items: List[TriageInput]) -> Dict[str, Any]:
+    """
+    Keyword arguments for one `chat.completions.create` classifying all `items` (ids from 1).
+    """
+    system = BATCH_SYSTEM_PROMPT
+    if s.get("gpt_output_mode", "structured") == "json":
+        system += "\nJSON schema: " + json.dumps(BATCH_OUTPUT_SCHEMA["schema"], separators=(",", ":"))
+        fmt = {"type": "json_object"}
+    else:
+        fmt = {"type": "json_schema", "json_schema": BATCH_OUTPUT_SCHEMA}
+    user = "\n\n".join(f"### Message {i}\n{gpt_user_prompt(ti)}" for i, ti in enumerate(items, 1))
+    return {
+        "model": s["openai_deployment"],
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
+        "temperature": 0.0,
+        "max_tokens": (s.get("gpt_max_tokens") or 160) * len(items),
+        "response_format": fmt,
+    }
+
+
+def parse_batch_reply(msg: str, n: int) -> List[Optional[GPTClassification]]:
+    """
+    Classifications by position for a batch of `n`. An entry that is missing, repeated or does
+    not fit the schema is None; a reply that is not valid JSON gives all None.
+    """
+    out: List[Optional[GPTClassification]] = [None] * n
+    try:
+        results = json.loads(msg).get("results")
+    except (ValueError, AttributeError):
+        return out
+    seen = set()
+    for entry in results if isinstance(results, list) else []:
+        i = entry.get("id") if isinstance(entry, dict) else None
+        if not isinstance(i, int) or not 1 <= i <= n or i in seen:
+            continue
+        seen.add(i)
+        try:
+            out[i - 1] = parse_classification(entry)
+        except ValueError:
+            pass
+    return out
+
+
+def prompt_tokens(kwargs: Dict[str, Any]) -> int:
+    return request_tokens(kwargs) - kwargs["max_tokens"]
+
+
+def split_usage(usage: Dict[str, int], n: int, i: int) -> Dict[str, int]:
+    """
+    Item `i`'s share of a batched call's token usage (an even split; the remainder goes to the first items).
+    """
+    return {k: v // n + (1 if i < v % n else 0) for k, v in usage.items()}
+
+
+class _Pending:
+    __slots__ = ("ti", "tokens", "future")
+
+    def __init__(self, ti: TriageInput, tokens: int):
+        self.ti = ti
+        self.tokens = tokens
+        self.future: Future = Future()
+
+
+class _Batch:
+    __slots__ = ("items", "tokens")
+
+    def __init__(self):
+        self.items: List[_Pending] = []
+        self.tokens = 0
+
+
+class MicroBatcher:
+    """
+    Packs GPT classifications from concurrent requests into one chat completion: calls arriving
+    within MICROBATCH_WINDOW_MS of the first share a request, up to MICROBATCH_MAX_ITEMS
+    messages or MICROBATCH_MAX_TOKENS of prompt. The system prompt is sent once per batch
+    instead of once per message, and the deployment's requests-per-minute quota stretches by
+    the batch size.
+
+    The first caller of a batch leads it: it holds the batch open until the window closes or
+    it is full, sends the completion and hands every caller its entry (with an even share of
+    the usage). The window is only held while other GPT calls are in flight, so a lone request
+    is not delayed. Messages the reply does not classify validly are sent again on their own
+    with `classify_gpt`; a failed call (error, timeout, throttling) fails every message in it.
+    """
+
+    def __init__(self, s: Dict[str, Any]):
+        self.window_s = s.get("microbatch_window_ms", 20.0) / 1000.0
+        self.max_items = max(s.get("microbatch_max_items", 8), 1)
+        self.max_tokens = s.get("microbatch_max_tokens", 6000)
+        self._cond = threading.Condition()
+        self._open: Optional[_Batch] = None
+        self._active = 0
+        # classifications: calls to `classify`; gpt_requests: completions actually sent for them
+        self.counters = {
+            "classifications": 0, "gpt_requests": 0, "batches": 0, "batched_items": 0, "max_batch_size": 0,
+            "singles": 0, "oversize": 0, "reply_fallbacks": 0, "item_fallbacks": 0, "prompt_tokens_saved_est": 0,
+        }
+
+    def _single(self, oa, s: Dict[str, Any], ti: TriageInput) -> Tuple[GPTClassification, Dict[str, int]]:
+        self.counters["gpt_requests"] += 1
+        return classify_gpt(oa, s, ti)
+
+    def classify(self, oa, s: Dict[str, Any], ti: TriageInput) -> Tuple[GPTClassification, Dict[str, int]]:
+        self.counters["classifications"] += 1
+        tokens = estimate_tokens(gpt_user_prompt(ti))
+        if tokens > self.max_tokens:
+            self.counters["oversize"] += 1
+            return self._single(oa, s, ti)
+        item = _Pending(ti, tokens)
+        with self._cond:
+            self._active += 1
+            batch, lead = self._join(item)
+        try:
+            if lead:
+                self._hold(batch)
+                self._send(oa, s, batch)
+            result = item.future.result()
+        finally:
+            with self._cond:
+                self._active -= 1
+        if result is None:
+            self.counters["item_fallbacks"] += 1
+            return self._single(oa, s, ti)
+        return result
+
+    def _join(self, item: _Pending) -> Tuple[_Batch, bool]:
+        """
+        Add `item` to the open batch, or open a new one led by this caller. Called under the lock.
+        """
+        batch = self._open
+        if batch is not None and batch.tokens + item.tokens > self.max_tokens:
+            # No room: the open batch goes as it is (its leader wakes up) and this one starts the next
+            self._open = batch = None
+            self._cond.notify_all()
+        lead = batch is None
+        if lead:
+            batch = self._open = _Batch()
+        batch.items.append(item)
+        batch.tokens += item.tokens
+        if len(batch.items) >= self.max_items:
+            self._open = None
+            self._cond.notify_all()
+        return batch, lead
+
+    def _hold(self, batch: _Batch) -> None:
+        deadline = time.monotonic() + self.window_s
+        with self._cond:
+            if self._open is not batch or self._active > 1:
+                while self._open is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if self._open is batch:
+                self._open = None
+
+    def _send(self, oa, s: Dict[str, Any], batch: _Batch) -> None:
+        items = batch.items
+        if len(items) == 1:
+            # Nothing joined: the ordinary single-message request
+            self.counters["singles"] += 1
+            try:
+                items[0].future.set_result(self._single(oa, s, items[0].ti))
+            except Exception as ex:
+                items[0].future.set_exception(ex)
+            return
+        msgs = [p.ti for p in items]
+
+        def attempt(ep: Endpoint, timeout: float):
+            kwargs = batch_request(ep.settings, msgs)
+            return scheduled(
+                s, "openai",
+                lambda: ep.client.chat.completions.create(**kwargs, timeout=timeout),
+                tokens=request_tokens(kwargs),
+                deployment=ep.lane,
+                actual_tokens=lambda c: c.usage.total_tokens,
+            )
+
+        self.counters["gpt_requests"] += 1
+        try:
+            chat = as_route(oa, "openai", s).call(s, attempt)
+            usage = record_usage(getattr(chat, "usage", None))
+            results = parse_batch_reply(chat.choices[0].message.content or "", len(items))
+        except Exception as ex:
+            # Every caller is waiting on this batch: none may be left without an answer
+            for p in items:
+                p.future.set_exception(ex)
+            return
+        self._count(s, msgs, results)
+        for i, (p, gpt) in enumerate(zip(items, results)):
+            p.future.set_result((gpt, split_usage(usage, len(items), i)) if gpt is not None else None)
+
+    def _count(self, s: Dict[str, Any], msgs: List[TriageInput], results: List[Optional[GPTClassification]]) -> None:
+        c = self.counters
+        n = len(msgs)
+        c["batches"] += 1
+        c["batched_items"] += n
+        c["max_batch_size"] = max(c["max_batch_size"], n)
+        if all(r is None for r in results):
+            c["reply_fallbacks"] += 1
+            logging.warning("Batched GPT reply for %d messages did not validate; classifying them one by one", n)
+        single = sum(prompt_tokens(chat_request(s, m)) for m in msgs)
+        c["prompt_tokens_saved_est"] += max(single - prompt_tokens(batch_request(s, msgs)), 0)
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self.counters)
+        c["mean_batch_size"] = round(c["batched_items"] / c["batches"], 2) if c["batches"] else 0.0
+        # Completions not sent thanks to batching: the saving against the requests-per-minute quota
+        with self._cond:
+            c["waiting"] = self._active
+        c["requests_saved"] = max(c["classifications"] - c["waiting"] - c["gpt_requests"], 0)
+        done = c["classifications"] - c["waiting"]
+        c["request_reduction"] = round(c["requests_saved"] / done, 3) if done else 0.0
+        return c
+
+
+_batcher: Optional[MicroBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_microbatcher(s: Dict[str, Any]) -> Optional[MicroBatcher]:
+    """
+    Process-wide micro-batcher, or None when MICROBATCH_ENABLED is off or GPT_OUTPUT_MODE=text
+    (free-text replies cannot be split per message).
+    """
+    global _batcher
+    if not s.get("microbatch_enabled", False) or s.get("gpt_output_mode", "structured") == "text":
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(s)
+    return _batcher
+
+
+def classify_gpt_batched(oa, s: Dict[str, Any], ti: TriageInput) -> Tuple[GPTClassification, Dict[str, int]]:
+    """
+    `classify_gpt`, micro-batched with concurrent callers when MICROBATCH_ENABLED is on.
+    """
+    batcher = get_microbatcher(s)
+    if batcher is None:
+        return classify_gpt(oa, s, ti)
+    return batcher.classify(oa, s, ti)
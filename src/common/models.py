@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 
 class SafetyCategory(BaseModel):
@@ -7,7 +7,7 @@ class SafetyCategory(BaseModel):
 
 class SafetyResult(BaseModel):
     blocked: bool = False
-    categories: List[SafetyCategory] = []
+    categories: List[SafetyCategory] = Field(default_factory=list)
 
 class SentimentResult(BaseModel):
     sentiment: str
@@ -16,14 +16,14 @@ class SentimentResult(BaseModel):
 class GPTClassification(BaseModel):
     priority: str
     reason: str
-    suggested_actions: List[str] = []
+    suggested_actions: List[str] = Field(default_factory=list)
 
 class TriageInput(BaseModel):
     subject: str = ""
     body: str = ""
     sender: Optional[str] = None
     to: Optional[List[str]] = None
-    headers: Dict[str, Any] = {}
+    headers: Dict[str, Any] = Field(default_factory=dict)
     importance: Optional[str] = None
 
 class TriageOutput(BaseModel):
@@ -32,4 +32,4 @@ class TriageOutput(BaseModel):
     gpt: GPTClassification
     combined_priority: str
     routing_hint: str
-    metadata: Dict[str, Any] = {}
+    metadata: Dict[str, Any] = Field(default_factory=dict)
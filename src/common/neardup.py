@@ -0,0 +1,303 @@
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+
+from common.cache import normalize_text
+
+
+# ---------- Signatures ----------
+
+_WORD_RE = re.compile(r"\w+")
+_MASK64 = (1 << 64) - 1
+
+_PERMS = 64
+_SKETCH_BYTES = _PERMS // 2     # 4 bits per minimum
+_NIBBLES = int("11" * _SKETCH_BYTES, 16)
+# Multiply-add hash functions standing in for random permutations; derived from a constant so
+# every instance and every snapshot agree on them
+_HASHES = [
+    (int.from_bytes(hashlib.blake2b(b"neardup-a%d" % i, digest_size=8).digest(), "little") | 1,
+     int.from_bytes(hashlib.blake2b(b"neardup-b%d" % i, digest_size=8).digest(), "little"))
+    for i in range(_PERMS)
+]
+
+
+def shingles(text: str, words: int = 3) -> List[int]:
+    """
+    64-bit hashes of the distinct `words`-word shingles of the normalized, lowercased text.
+    """
+    tokens = _WORD_RE.findall(normalize_text(text).lower())
+    grams = {" ".join(tokens[i:i + words]) for i in range(max(len(tokens) - words + 1, 1))} if tokens else set()
+    return [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams]
+
+
+def signature(hashes: List[int], bands: int = 8, rows: int = 4) -> Tuple[List[int], bytes]:
+    """
+    MinHash a shingle set with 64 hash functions. Returns `bands` LSH band keys (`rows`
+    minimums each) and a 32-byte sketch holding 4 bits of every minimum (b-bit MinHash),
+    used to estimate Jaccard similarity without keeping the signature itself.
+    """
+    mins = [min([(h * a + c) & _MASK64 for h in hashes]) for a, c in _HASHES]
+    keys = []
+    for b in range(bands):
+        v = 0
+        for m in mins[b * rows:(b + 1) * rows]:
+            v = ((v * 0x100000001B3) ^ m) & _MASK64
+        keys.append(v)
+    sketch = 0
+    for i, m in enumerate(mins):
+        sketch |= ((m >> 32) & 15) << (4 * i)
+    return keys, sketch.to_bytes(_SKETCH_BYTES, "little")
+
+
+def estimate_similarity(a: bytes, b: bytes) -> float:
+    """
+    Jaccard estimate from two sketches: the share of equal 4-bit minimums, corrected for
+    the 1 in 16 that agree by chance.
+    """
+    x = int.from_bytes(a, "little") ^ int.from_bytes(b, "little")
+    x |= x >> 1
+    x |= x >> 2
+    equal = _PERMS - (x & _NIBBLES).bit_count()
+    return max((equal / _PERMS - 1 / 16) / (1 - 1 / 16), 0.0)
+
+
+def fingerprint(text: str, s: Dict[str, Any]) -> Optional[Tuple[List[int], int]]:
+    """
+    `(band_keys, sketch)` of a message body, or None when it is too short for near-duplicate
+    matching (short notes like "thank you" would all collide).
+    """
+    hashes = shingles(text, s.get("neardup_shingle_words", 3))
+    if len(hashes) < max(s.get("neardup_min_shingles", 8), 1):
+        return None
+    return signature(hashes, s.get("neardup_bands", 8), s.get("neardup_rows", 4))
+
+
+# ---------- Index ----------
+
+_KEY_BYTES = 32     # verdict cache key (sha256)
+_ID_BYTES = 36      # result id (uuid string)
+_REF_BYTES = _KEY_BYTES + _ID_BYTES
+_SNAPSHOT_VERSION = 1
+
+
+class NearDupIndex:
+    """
+    Sliding window of MinHash signatures of recently analysed bodies, with LSH lookup.
+
+    An entry is a candidate when any of its band keys equals the query's; candidates are then
+    checked against `min_similarity` with the sketch. Storage is a fixed ring of typed arrays
+    (about 250 bytes per entry with 8 bands, bucket tables included): each band has a bucket table holding the
+    sequence number of its newest entry and a per-slot array with the sequence number of the
+    next (older) one. The ring overwrites the oldest entry, so a link whose slot now holds a
+    different sequence number marks the end of the chain. Entries also expire after `max_age_s`.
+    """
+
+    def __init__(self, capacity: int = 200000, bands: int = 8, min_similarity: float = 0.7,
+                 max_age_s: float = 86400.0):
+        self.capacity = capacity
+        self.bands = bands
+        self.min_similarity = min_similarity
+        self.max_age_s = max_age_s
+        self.table_bits = max(capacity.bit_length(), 10)
+        self._tmask = (1 << self.table_bits) - 1
+        self.seq = 0
+        self.sketches = bytearray(capacity * _SKETCH_BYTES)
+        self.seqs = array("q", [-1]) * capacity
+        self.stamps = array("d", [0.0]) * capacity
+        self.refs = bytearray(capacity * _REF_BYTES)
+        self.nexts = [array("q", [-1]) * capacity for _ in range(bands)]
+        self.heads = [array("q", [-1]) * (1 << self.table_bits) for _ in range(bands)]
+        self._lock = threading.Lock()
+        self.counters = {"lookups": 0, "matches": 0, "added": 0, "compared": 0}
+
+    def add(self, fp: Tuple[List[int], bytes], key: str, result_id: str, now: Optional[float] = None) -> None:
+        keys, sketch = fp
+        now = time.time() if now is None else now
+        ref = bytes.fromhex(key)[:_KEY_BYTES].ljust(_KEY_BYTES, b"\0") + \
+            result_id.encode("ascii", "replace")[:_ID_BYTES].ljust(_ID_BYTES, b"\0")
+        with self._lock:
+            slot = self.seq % self.capacity
+            self.sketches[slot * _SKETCH_BYTES:(slot + 1) * _SKETCH_BYTES] = sketch
+            self.seqs[slot] = self.seq
+            self.stamps[slot] = now
+            self.refs[slot * _REF_BYTES:(slot + 1) * _REF_BYTES] = ref
+            for j, k in enumerate(keys):
+                b = k & self._tmask
+                self.nexts[j][slot] = self.heads[j][b]
+                self.heads[j][b] = self.seq
+            self.seq += 1
+            self.counters["added"] += 1
+
+    def lookup(self, fp: Tuple[List[int], bytes], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Most similar live entry at or above `min_similarity` (newest wins ties), as
+        `{"id", "key", "similarity"}`, or None.
+        """
+        keys, sketch = fp
+        now = time.time() if now is None else now
+        oldest = now - self.max_age_s
+        best_slot, best_sim, best_seq = -1, self.min_similarity, -1
+        compared = 0
+        seen = set()
+        with self._lock:
+            for j, k in enumerate(keys):
+                nexts = self.nexts[j]
+                sq = self.heads[j][k & self._tmask]
+                while sq >= 0:
+                    slot = sq % self.capacity
+                    if self.seqs[slot] != sq or self.stamps[slot] < oldest:
+                        break  # slot reused by a newer entry, or everything from here on has expired
+                    if sq not in seen:
+                        seen.add(sq)
+                        compared += 1
+                        sim = estimate_similarity(self.sketches[slot * _SKETCH_BYTES:(slot + 1) * _SKETCH_BYTES], sketch)
+                        if sim > best_sim or (sim == best_sim and sq > best_seq):
+                            best_slot, best_sim, best_seq = slot, sim, sq
+                    sq = nexts[slot]
+            self.counters["lookups"] += 1
+            self.counters["compared"] += compared
+            if best_slot < 0:
+                return None
+            self.counters["matches"] += 1
+            ref = bytes(self.refs[best_slot * _REF_BYTES:(best_slot + 1) * _REF_BYTES])
+        return {
+            "id": ref[_KEY_BYTES:].rstrip(b"\0").decode("ascii"),
+            "key": ref[:_KEY_BYTES].hex(),
+            "similarity": round(best_sim, 3),
+        }
+
+    def __len__(self) -> int:
+        return min(self.seq, self.capacity)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, entries=len(self), capacity=self.capacity)
+
+    # ----- snapshot -----
+
+    def _arrays(self) -> List[Any]:
+        return [self.sketches, self.seqs, self.stamps, self.refs] + self.nexts + self.heads
+
+    def _shape(self) -> Tuple:
+        return _SNAPSHOT_VERSION, self.capacity, self.bands, self.table_bits
+
+    def to_bytes(self) -> bytes:
+        """
+        Header line (JSON) followed by the raw arrays, in `_arrays()` order.
+        """
+        with self._lock:
+            header = {"shape": list(self._shape()), "seq": self.seq}
+            return json.dumps(header).encode("utf-8") + b"\n" + b"".join(bytes(a) for a in self._arrays())
+
+    def load_bytes(self, data: bytes) -> bool:
+        """
+        Restore from `to_bytes()` output. Snapshots taken with a different capacity or band
+        count are ignored (returns False); the window then refills from new traffic.
+        """
+        end = data.index(b"\n")
+        header = json.loads(data[:end])
+        if tuple(header.get("shape") or ()) != self._shape():
+            return False
+        with self._lock:
+            offset = end + 1
+            for a in self._arrays():
+                size = len(a) * (a.itemsize if isinstance(a, array) else 1)
+                if isinstance(a, array):
+                    a[:] = array(a.typecode, data[offset:offset + size])
+                else:
+                    a[:] = data[offset:offset + size]
+                offset += size
+            self.seq = header["seq"]
+        return True
+
+
+class NearDupStore:
+    """
+    The process-wide index plus its blob snapshot: loaded once at start-up and rewritten
+    off the request path at most every `neardup_snapshot_s` seconds after new entries.
+    """
+
+    def __init__(self, s: Dict[str, Any], blob_svc_factory=None):
+        self.index = NearDupIndex(
+            capacity=s.get("neardup_capacity", 200000),
+            bands=s.get("neardup_bands", 8),
+            min_similarity=s.get("neardup_min_similarity", 0.7),
+            max_age_s=s.get("neardup_max_age_s", 86400.0),
+        )
+        self.container = s.get("blob_container")
+        self.blob_name = s.get("neardup_blob_name", "neardup/index.bin")
+        self.interval = s.get("neardup_snapshot_s", 300.0)
+        self._blob_svc_factory = blob_svc_factory if self.interval > 0 else None
+        self._last_snapshot = time.monotonic()
+        self._saved_seq = 0
+        self._saving = False
+        self._lock = threading.Lock()
+        self.counters = {"snapshot_loads": 0, "snapshot_writes": 0, "snapshot_errors": 0}
+        self._load()
+
+    def _load(self) -> None:
+        if self._blob_svc_factory is None:
+            return
+        try:
+            blob = self._blob_svc_factory().get_blob_client(self.container, self.blob_name)
+            if self.index.load_bytes(blob.download_blob().readall()):
+                self._saved_seq = self.index.seq
+                self.counters["snapshot_loads"] += 1
+        except Exception as ex:
+            if type(ex).__name__ != "ResourceNotFoundError":
+                self.counters["snapshot_errors"] += 1
+                logging.warning("Near-duplicate snapshot load failed: %s", ex)
+
+    def snapshot(self) -> None:
+        try:
+            seq = self.index.seq
+            blob = self._blob_svc_factory().get_blob_client(self.container, self.blob_name)
+            blob.upload_blob(self.index.to_bytes(), overwrite=True)
+            self._saved_seq = seq
+            self.counters["snapshot_writes"] += 1
+        except Exception as ex:
+            self.counters["snapshot_errors"] += 1
+            logging.warning("Near-duplicate snapshot write failed: %s", ex)
+        finally:
+            self._saving = False
+
+    def maybe_snapshot(self, executor) -> None:
+        """
+        Queue a snapshot on `executor` when the interval has passed and there is something new.
+        """
+        if self._blob_svc_factory is None or self.index.seq == self._saved_seq:
+            return
+        with self._lock:
+            if self._saving or time.monotonic() - self._last_snapshot < self.interval:
+                return
+            self._saving = True
+            self._last_snapshot = time.monotonic()
+        executor.submit(self.snapshot)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.index.stats(), **self.counters)
+
+
+_store: Optional[NearDupStore] = None
+_store_lock = threading.Lock()
+
+
+def get_neardup(s: Dict[str, Any], blob_svc_factory=None) -> Optional[NearDupStore]:
+    """
+    Process-wide near-duplicate index, or None when NEARDUP_ENABLED is off. It points at
+    verdicts in the verdict cache, so it is also off when the cache is.
+    """
+    global _store
+    if not s.get("neardup_enabled", False) or not s.get("cache_enabled", True):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = NearDupStore(s, blob_svc_factory)
+    return _store
@@ -0,0 +1,816 @@
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Callable, List, Union, Tuple
+
+from common.clients import ClientPool, get_pool, now_iso
+from common.models import TriageInput, SafetyResult, SentimentResult, GPTClassification, TriageOutput
+from common.logic import (
+    map_safety, apply_security_overrides, combine_priority, routing_hint, sender_risk_level, escalate_for_sender,
+    degraded_gpt, watchlist_gpt, escalate_for_watchlist,
+)
+from common.cache import get_cache, verdict_key
+from common.neardup import get_neardup, fingerprint
+from common.sender_risk import get_sender_risk
+from common.watchlist import get_watchlist
+from common.ratelimit import Throttled, scheduled
+from common.resilience import as_route, get_breaker
+from common.metrics import Timings, request_timings
+from common.gpt import USAGE, classify_gpt_stream, estimate_tokens, gpt_user_prompt, system_prompt
+from common.microbatch import classify_gpt_batched
+from common.chunking import (
+    CONTENT_SAFETY_MAX_CHARS, LANGUAGE_MAX_CHARS, chunk_texts, merge_safety, merge_sentiment, gpt_excerpt
+)
+
+
+# Content Safety categories requested (TextCategory values; plain strings so this module loads without the SDK)
+SAFETY_CATEGORIES = ["Hate", "Violence", "SelfHarm", "Sexual"]
+
+# Bump whenever the GPT prompt or output parsing changes so cached verdicts are not reused
+PROMPT_VERSION = "v2"
+
+# Azure AI Language accepts at most 10 documents per synchronous sentiment request
+SENTIMENT_BATCH_SIZE = 10
+
+
+class StageTimeout(TimeoutError):
+    """
+    Raised when a pipeline stage does not finish within its configured timeout.
+    """
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"Stage '{stage}' timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+# ---------- Stages ----------
+
+def azure_timeouts(s: Dict[str, Any], timeout: float) -> Dict[str, float]:
+    """
+    Per-call transport deadlines for an Azure SDK request.
+    """
+    return {"connection_timeout": min(s.get("connect_timeout_s", 5.0), timeout), "read_timeout": timeout}
+
+
+def _safety_call(cs, text: str, s: Dict[str, Any]) -> SafetyResult:
+    from azure.ai.contentsafety.models import AnalyzeTextOptions
+
+    options = AnalyzeTextOptions(text=text, categories=SAFETY_CATEGORIES)
+    cs_resp = as_route(cs, "content_safety", s).call(s, lambda ep, timeout: scheduled(
+        s, "content_safety", lambda: ep.client.analyze_text(options, **azure_timeouts(s, timeout)), deployment=ep.lane))
+    return map_safety(cs_resp)
+
+
+def map_chunks(fn: Callable, items: List[Any], s: Dict[str, Any]) -> List[Any]:
+    """
+    Apply `fn` to every chunk, in parallel on the chunk executor when TRIAGE_CONCURRENT is on.
+    Chunks get their own executor so a stage never waits on work queued behind itself.
+    """
+    if len(items) <= 1 or not s.get("triage_concurrent", True):
+        return [fn(x) for x in items]
+    return list(get_chunk_executor(s).map(fn, items))
+
+
+def analyze_safety(cs, text: str, s: Optional[Dict[str, Any]] = None,
+                   chunks: Optional[Dict[str, Any]] = None) -> SafetyResult:
+    """
+    Content Safety verdict for `text`. Bodies over CHUNK_SAFETY_CHARS are split into overlapping,
+    sentence-aligned chunks scored in parallel; the worst severity per category wins.
+    If `chunks` is given it receives the chunk count and the texts of chunks with any finding.
+    """
+    s = s or {}
+    parts = chunk_texts(text, s.get("chunk_safety_chars", CONTENT_SAFETY_MAX_CHARS), s.get("chunk_overlap_chars", 200))
+    if len(parts) <= 1:
+        return _safety_call(cs, text, s)
+    results = map_chunks(lambda part: _safety_call(cs, part, s), parts, s)
+    if chunks is not None:
+        chunks["safety"] = len(parts)
+        chunks["flagged"] = [p for p, r in zip(parts, results)
+                             if r.blocked or any(c.severity for c in r.categories)]
+    return merge_safety(results)
+
+
+def to_sentiment(sa) -> SentimentResult:
+    return SentimentResult(
+        sentiment=sa.sentiment,
+        confidence={
+            "positive": sa.confidence_scores.positive,
+            "neutral": sa.confidence_scores.neutral,
+            "negative": sa.confidence_scores.negative
+        }
+    )
+
+
+def _sentiment_call(ta, texts: List[str], s: Dict[str, Any]) -> List[Union[SentimentResult, Exception]]:
+    out: List[Union[SentimentResult, Exception]] = []
+    docs = as_route(ta, "language", s).call(s, lambda ep, timeout: scheduled(
+        s, "language", lambda: ep.client.analyze_sentiment(texts, **azure_timeouts(s, timeout)), deployment=ep.lane))
+    for doc in docs:
+        if getattr(doc, "is_error", False):
+            out.append(ValueError(f"Sentiment failed: {doc.error.code}: {doc.error.message}"))
+        else:
+            out.append(to_sentiment(doc))
+    return out
+
+
+def analyze_sentiment(ta, text: str, s: Optional[Dict[str, Any]] = None,
+                      chunks: Optional[Dict[str, Any]] = None) -> SentimentResult:
+    """
+    Sentiment for `text`. Bodies over CHUNK_SENTIMENT_CHARS are split into chunks sent
+    SENTIMENT_BATCH_SIZE per request, and the chunk scores are combined by `merge_sentiment`.
+    """
+    s = s or {}
+    parts = chunk_texts(text, s.get("chunk_sentiment_chars", LANGUAGE_MAX_CHARS), s.get("chunk_overlap_chars", 200))
+    if len(parts) <= 1:
+        result = _sentiment_call(ta, [text], s)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    groups = [parts[i:i + SENTIMENT_BATCH_SIZE] for i in range(0, len(parts), SENTIMENT_BATCH_SIZE)]
+    results = [r for g in map_chunks(lambda g: _sentiment_call(ta, g, s), groups, s) for r in g]
+    ok = [(r, len(p)) for r, p in zip(results, parts) if not isinstance(r, Exception)]
+    if not ok:
+        raise results[0]
+    if chunks is not None:
+        chunks["sentiment"] = len(parts)
+    return merge_sentiment([r for r, _ in ok], [n for _, n in ok])
+
+
+def analyze_sentiment_batch(ta, texts: List[str], s: Optional[Dict[str, Any]] = None
+                            ) -> List[Union[SentimentResult, Exception]]:
+    """
+    One Language call for up to SENTIMENT_BATCH_SIZE documents. Per-document errors are
+    returned in place (as exceptions) so one bad document does not fail its neighbours.
+    Documents over CHUNK_SENTIMENT_CHARS are chunked separately via `analyze_sentiment`.
+    """
+    s = s or {}
+    limit = s.get("chunk_sentiment_chars", LANGUAGE_MAX_CHARS)
+    short = [i for i, t in enumerate(texts) if len(t) <= limit]
+    out: List[Union[SentimentResult, Exception]] = [None] * len(texts)  # type: ignore[list-item]
+    if short:
+        for i, r in zip(short, _sentiment_call(ta, [texts[i] for i in short], s)):
+            out[i] = r
+    for i, t in enumerate(texts):
+        if len(t) > limit:
+            try:
+                out[i] = analyze_sentiment(ta, t, s)
+            except Exception as ex:
+                out[i] = ex
+    return out
+
+
+def prescore_messages(texts: List[str], s: Dict[str, Any]) -> Optional[List[Tuple[Any, bool]]]:
+    """
+    `(prescore, skip_remote)` for every text from one vectorised pass of the on-box scorer,
+    or None when PRESCORE_ENABLED is off.
+    """
+    if not s.get("prescore_enabled", False):
+        return None
+    # Imported here so NumPy is only loaded (and paid for at cold start) when the tier is on
+    from common.prescore import get_prescorer, can_skip
+    return [(p, can_skip(p, s)) for p in get_prescorer(s).score(texts)]
+
+
+def settle_sentiment(remote: Union[SentimentResult, Exception, None], pre, s: Dict[str, Any]
+                     ) -> Tuple[SentimentResult, str]:
+    """
+    The sentiment to use and its source: "language", "prescore" (confident pre-score, the remote
+    call was skipped: `remote` is None) or "prescore_fallback" (the call failed, timed out or its
+    breaker is open, and PRESCORE_FALLBACK lets the pre-score stand in). Otherwise the error is raised.
+    """
+    if remote is None:
+        return pre.sentiment, "prescore"
+    if not isinstance(remote, Exception):
+        return remote, "language"
+    if pre is None or not s.get("prescore_fallback", True):
+        raise remote
+    breaker = get_breaker(s, "language")
+    if isinstance(remote, StageTimeout) and breaker is not None:
+        breaker.record_failure()
+    STATS["sentiment_fallbacks"] += 1
+    logging.warning("Sentiment unavailable, using the pre-score: %s", remote)
+    return pre.sentiment, "prescore_fallback"
+
+
+def sentiment_metadata(pre, source: str) -> Dict[str, Any]:
+    if pre is None:
+        return {}
+    meta: Dict[str, Any] = {
+        "sentiment_source": source,
+        "prescore": {"sentiment": pre.sentiment.sentiment, "confidence": pre.confidence, "risk": pre.risk},
+    }
+    if source == "prescore_fallback":
+        meta["degraded"] = ["sentiment"]
+    return meta
+
+
+def gpt_input(ti: TriageInput, s: Dict[str, Any], flagged: Optional[List[str]] = None) -> TriageInput:
+    """
+    The message as GPT sees it: bodies over GPT_EXCERPT_CHARS become the opening of the
+    message plus any chunks Content Safety flagged.
+    """
+    limit = s.get("gpt_excerpt_chars", 4000)
+    if not limit or len(ti.body) <= limit:
+        return ti
+    return ti.model_copy(update={"body": gpt_excerpt(ti.body, flagged or [], limit)})
+
+
+def gpt_waits_for_safety(ti: TriageInput, s: Dict[str, Any]) -> bool:
+    """
+    Whether the GPT stage is started only once Content Safety clears the message: always with
+    SAFETY_POLICY=staged, and with `speculative` when the body is over GPT_EXCERPT_CHARS, so
+    the chunks safety flagged go into the excerpt. Other mail runs GPT alongside safety.
+    """
+    policy = s.get("safety_policy", "speculative")
+    return policy == "staged" or (policy == "speculative" and gpt_input(ti, s) is not ti)
+
+
+# Process-wide counters for GPT calls avoided by the safety-first policy
+STATS: Dict[str, int] = {"gpt_calls_saved": 0, "gpt_tokens_saved_est": 0, "gpt_results_discarded": 0,
+                         "neardup_inherit": 0, "neardup_fast_track": 0,
+                         "sentiment_prescored": 0, "sentiment_fallbacks": 0, "gpt_degraded": 0,
+                         "watchlist_blocked": 0}
+
+
+def record_gpt_saved(ti: TriageInput, s: Dict[str, Any]) -> None:
+    calls = USAGE["calls"]
+    avg_completion = USAGE["completion_tokens"] // calls if calls else 0
+    STATS["gpt_calls_saved"] += 1
+    STATS["gpt_tokens_saved_est"] += estimate_tokens(system_prompt(s) + gpt_user_prompt(gpt_input(ti, s))) + avg_completion
+
+
+# ---------- Execution ----------
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(s: Dict[str, Any]) -> ThreadPoolExecutor:
+    """
+    Bounded, process-wide executor used to fan out the independent service calls.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=s.get("triage_max_workers", 16), thread_name_prefix="triage-stage"
+                )
+    return _executor
+
+
+_chunk_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_chunk_executor(s: Dict[str, Any]) -> ThreadPoolExecutor:
+    """
+    Process-wide executor for the per-chunk calls of long bodies.
+    """
+    global _chunk_executor
+    if _chunk_executor is None:
+        with _executor_lock:
+            if _chunk_executor is None:
+                _chunk_executor = ThreadPoolExecutor(
+                    max_workers=s.get("triage_max_workers", 16), thread_name_prefix="triage-chunk"
+                )
+    return _chunk_executor
+
+
+def wait_stage(name: str, fut: Future, timeout: float, started: float):
+    """
+    Wait for a submitted stage, measuring its timeout from submission rather than from this call.
+    """
+    remaining = max(timeout - (time.monotonic() - started), 0.0)
+    try:
+        return fut.result(timeout=remaining)
+    except FutureTimeout:
+        fut.cancel()
+        raise StageTimeout(name, timeout)
+
+
+class _Deferred:
+    """
+    Future-like wrapper used when TRIAGE_CONCURRENT is off: the stage runs on first `result()`,
+    so a stage that is cancelled before anyone waits on it is never called.
+    """
+
+    def __init__(self, fn: Callable[[], Any]):
+        self._fn = fn
+        self._done = False
+        self._cancelled = False
+        self._value = None
+
+    def result(self, timeout: Optional[float] = None):
+        if self._cancelled:
+            raise RuntimeError("stage was cancelled")
+        if not self._done:
+            self._value = self._fn()
+            self._done = True
+        return self._value
+
+    def done(self) -> bool:
+        return self._done or self._cancelled
+
+    def cancel(self) -> bool:
+        if self._done:
+            return False
+        self._cancelled = True
+        return True
+
+
+def submit_stages(stages: Dict[str, Callable[[], Any]], s: Dict[str, Any]):
+    """
+    Start independent stages and return `(futures_by_name, started)` for use with `wait_stage`.
+    With TRIAGE_CONCURRENT off, stages are deferred and run one after another as they are awaited.
+    """
+    started = time.monotonic()
+    if not s.get("triage_concurrent", True):
+        return {name: _Deferred(fn) for name, fn in stages.items()}, started
+    ex = get_executor(s)
+    return {name: ex.submit(fn) for name, fn in stages.items()}, started
+
+
+def submit_after(ex: ThreadPoolExecutor, gate: Future, should_run: Callable[[Any], bool],
+                 fn: Callable, *args) -> Future:
+    """
+    Submit `fn(*args)` once `gate` completes, only if `should_run(gate_result)` is true;
+    otherwise the returned future resolves to None. Chained through a done-callback so no
+    executor thread ever blocks waiting on another task.
+    """
+    out: Future = Future()
+
+    def relay(f: Future) -> None:
+        err = None if not f.cancelled() else RuntimeError("stage was cancelled")
+        err = err or f.exception()
+        if err is not None:
+            out.set_exception(err)
+        else:
+            out.set_result(f.result())
+
+    def on_gate(g: Future) -> None:
+        if not out.set_running_or_notify_cancel():
+            return  # the waiter cancelled before the gate opened: skip the call entirely
+        try:
+            run = not g.cancelled() and g.exception() is None and should_run(g.result())
+        except Exception:
+            run = True
+        if run:
+            ex.submit(fn, *args).add_done_callback(relay)
+        else:
+            out.set_result(None)
+
+    gate.add_done_callback(on_gate)
+    return out
+
+
+def observe_sender(ti: TriageInput, safety: SafetyResult, sentiment: SentimentResult,
+                   s: Dict[str, Any], meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Give `meta` (the output metadata for `build_output`) its result id, kept when the caller
+    set one (a job id), and `sender_risk`: the sender's features with this message folded in,
+    or None when SENDER_RISK_ENABLED is off or the message has no sender. Every distinct
+    message counts, whether its verdict came from the stages, the verdict cache, a near-duplicate
+    or the watchlist; an id seen before (queue re-delivery) is counted once.
+    """
+    meta["id"] = meta.get("id") or str(uuid.uuid4())
+    store = get_sender_risk(s, lambda: get_pool().blob)
+    if store is None or not ti.sender:
+        meta["sender_risk"] = None
+        return meta
+    meta["sender_risk"] = store.observe(ti.sender, safety, sentiment, message_id=meta["id"])
+    store.maybe_snapshot(get_executor(s))
+    return meta
+
+
+def sender_features(ti: TriageInput, s: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    The sender's current features without counting this message, for outputs built outside
+    `triage` and `triage_batch` (which count every message through `observe_sender`).
+    """
+    store = get_sender_risk(s, lambda: get_pool().blob) if s is not None else None
+    if store is None or not ti.sender:
+        return None
+    return store.features(ti.sender)
+
+
+def scan_watchlist(ti: TriageInput, s: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    The message's watchlist hit for `metadata.watchlist`, or None (no match, or WATCHLIST_ENABLED off).
+    """
+    store = get_watchlist(s, lambda: get_pool().blob) if s is not None else None
+    if store is None:
+        return None
+    store.maybe_reload(get_executor(s))
+    return store.scan(ti, s.get("watchlist_max_matches", 20))
+
+
+def watchlist_verdict(ti: TriageInput, s: Dict[str, Any], watchlist: Dict[str, Any]):
+    """
+    Stage outputs for a message quarantined on a watchlist `block` hit without calling the
+    services: blocked safety with no categories, the on-box pre-score (PRESCORE_ENABLED) or
+    an `unknown` sentiment, and the watchlist playbook.
+    """
+    pre = (prescore_messages([ti.body], s) or [(None, False)])[0][0]
+    sentiment = pre.sentiment if pre is not None else SentimentResult(sentiment="unknown", confidence={})
+    return SafetyResult(blocked=True, categories=[]), sentiment, watchlist_gpt(watchlist)
+
+
+def build_output(ti: TriageInput, safety: SafetyResult, sentiment: SentimentResult,
+                 gpt: GPTClassification, metadata: Optional[Dict[str, Any]] = None,
+                 s: Optional[Dict[str, Any]] = None) -> TriageOutput:
+    """
+    Apply the decision policy. With `s` and SENDER_RISK_ENABLED, the sender's rolling trend can
+    raise the priority and routing; the features are kept in `metadata.sender_risk` (taken from
+    `metadata` when the caller observed the message, else read without counting it). With
+    WATCHLIST_ENABLED, a watchlist hit (`metadata.watchlist`, scanned here unless `metadata`
+    already carries the scan) escalates priority and routing.
+    """
+    metadata = dict(metadata or {})
+    watchlist = metadata.pop("watchlist") if "watchlist" in metadata else scan_watchlist(ti, s)
+    combined = combine_priority(safety, sentiment, gpt)
+    risk = metadata.pop("sender_risk") if "sender_risk" in metadata else sender_features(ti, s)
+    level = sender_risk_level(risk)
+    escalated = escalate_for_sender(combined, level)
+    final = escalate_for_watchlist(escalated, watchlist)
+    route = routing_hint(final, level, watchlist["action"] if watchlist else None)
+    meta = {
+        "id": str(uuid.uuid4()),
+        "timestamp": now_iso(),
+        "subject": ti.subject,
+        "sender": ti.sender
+    }
+    if s is not None and s.get("archive_include_body", False):
+        meta["body"] = ti.body
+    if risk is not None:
+        meta["sender_risk"] = dict(risk, level=level, escalated_from=combined if escalated != combined else None)
+    if watchlist is not None:
+        meta["watchlist"] = dict(watchlist, escalated_from=escalated if final != escalated else None)
+    combined = final
+    meta.update(metadata)
+    return TriageOutput(
+        safety=safety,
+        sentiment=sentiment,
+        gpt=gpt,
+        combined_priority=combined,
+        routing_hint=route,
+        metadata=meta
+    )
+
+
+def verdict_to_dict(safety: SafetyResult, sentiment: SentimentResult, gpt: GPTClassification) -> Dict[str, Any]:
+    return {"safety": safety.model_dump(), "sentiment": sentiment.model_dump(), "gpt": gpt.model_dump()}
+
+
+def verdict_from_dict(v: Dict[str, Any]):
+    return SafetyResult(**v["safety"]), SentimentResult(**v["sentiment"]), GPTClassification(**v["gpt"])
+
+
+def lookup_verdict(ti: TriageInput, s: Dict[str, Any], blob: bool = True):
+    """
+    Check the verdict cache. Returns `(key, verdict_or_None, source)`; key is None when caching is off.
+    With `blob` false only the memory tier is checked; follow a miss with `lookup_blob_verdict`.
+    """
+    cache = get_cache(s, lambda: get_pool().blob)
+    if cache is None:
+        return None, None, "disabled"
+    # The policy decides what a blocked verdict's GPT section holds, so it is part of the key
+    version = f"{PROMPT_VERSION}:{s.get('gpt_output_mode', 'structured')}:{s.get('safety_policy', 'speculative')}"
+    key = verdict_key(ti, s, version, SAFETY_CATEGORIES)
+    cached, source = cache.get(key, blob)
+    return key, cached, source
+
+
+def lookup_blob_verdict(key: Optional[str], s: Dict[str, Any]) -> Optional[Future]:
+    """
+    Start the blob-tier lookup for `key` on the stage executor, to run alongside the stages
+    after a memory miss. None when there is no blob tier to ask.
+    """
+    cache = get_cache(s, lambda: get_pool().blob)
+    if cache is None or key is None or not cache.blob_enabled:
+        return None
+    return get_executor(s).submit(cache.get_blob, key)
+
+
+def settle_blob_verdict(blob_fut: Optional[Future], safety_fut: Future) -> Optional[Dict[str, Any]]:
+    """
+    The blob tier's verdict if it answers no later than Content Safety, else None. The lookup
+    never holds up the stages; a late hit still lands in the memory tier for the next copy.
+    """
+    if blob_fut is None:
+        return None
+    wait([blob_fut, safety_fut], return_when=FIRST_COMPLETED)
+    if not blob_fut.done() or blob_fut.exception() is not None:
+        return None
+    return blob_fut.result()
+
+
+def cached_output(ti: TriageInput, cached: Dict[str, Any], source: str,
+                  extra: Dict[str, Any], s: Dict[str, Any]) -> TriageOutput:
+    safety, sentiment, gpt = verdict_from_dict(cached)
+    return build_output(ti, safety, sentiment, gpt, observe_sender(
+        ti, safety, sentiment, s, {"cache_hit": True, "cache_source": source, **extra}), s)
+
+
+def store_verdict(key: Optional[str], s: Dict[str, Any], safety: SafetyResult,
+                  sentiment: SentimentResult, gpt: GPTClassification) -> None:
+    """
+    Fill the cache off the request path (the blob tier write is a network round trip).
+    """
+    cache = get_cache(s, lambda: get_pool().blob)
+    if cache is None or key is None:
+        return
+    get_executor(s).submit(cache.put, key, verdict_to_dict(safety, sentiment, gpt))
+
+
+def lookup_near_duplicate(ti: TriageInput, s: Dict[str, Any], key: Optional[str]):
+    """
+    Check the near-duplicate index after a cache miss. Returns `(fingerprint, match, prior)`:
+    fingerprint is None when the index is off or the body is too short to match, and `prior`
+    (the matched message's cached verdict) is None when nothing similar is indexed or the
+    verdict has since left the cache.
+    """
+    store = get_neardup(s, lambda: get_pool().blob)
+    if store is None or key is None:
+        return None, None, None
+    fp = fingerprint(ti.body, s)
+    if fp is None:
+        return None, None, None
+    match = store.index.lookup(fp)
+    if match is None:
+        return fp, None, None
+    prior, _ = get_cache(s, lambda: get_pool().blob).get(match["key"])
+    return fp, match, prior
+
+
+def index_near_duplicate(fp, key: Optional[str], out: TriageOutput, s: Dict[str, Any]) -> None:
+    """
+    Add a fully analysed message to the near-duplicate index. Messages that reused another
+    verdict are not added, so edits of edits do not drift away from the analysed original.
+    """
+    store = get_neardup(s, lambda: get_pool().blob)
+    if store is None or fp is None or key is None:
+        return
+    store.index.add(fp, key, out.metadata["id"])
+    store.maybe_snapshot(get_executor(s))
+
+
+def security_playbook(safety: SafetyResult) -> GPTClassification:
+    """
+    GPT section for blocked mail when the chat completion was skipped.
+    """
+    return apply_security_overrides(GPTClassification(priority="blocked", reason=""), safety)
+
+
+def resolve_gpt(ti: TriageInput, s: Dict[str, Any], safety: SafetyResult, gpt_fut, started: float):
+    """
+    Apply SAFETY_POLICY once the safety verdict is known. Returns `(gpt, skipped, discarded, usage)`:
+    `skipped` when the GPT call was never made, `discarded` when it was made (and billed) but
+    its answer was replaced by the security playbook.
+
+      parallel     GPT always runs and its answer is kept (original behaviour)
+      staged       GPT is only started after safety clears; blocked mail never calls it
+      speculative  GPT starts with the other stages and is cancelled (or its answer dropped) on
+                   block; bodies that GPT sees as an excerpt are staged (see `gpt_waits_for_safety`)
+    """
+    policy = s.get("safety_policy", "speculative")
+    if policy == "parallel" or not safety.blocked:
+        gpt, usage = wait_stage("gpt", gpt_fut, s.get("timeout_gpt", 45.0), started)
+        return gpt, False, False, usage
+
+    skipped = gpt_fut.cancel()
+    if not skipped and gpt_fut.done():
+        # A gated GPT stage resolves to None when the gate skipped it
+        try:
+            skipped = gpt_fut.result(timeout=0) is None
+        except Exception:
+            skipped = False
+    if skipped:
+        record_gpt_saved(ti, s)
+    else:
+        STATS["gpt_results_discarded"] += 1
+    return security_playbook(safety), skipped, not skipped, {}
+
+
+def settle_gpt(ti: TriageInput, s: Dict[str, Any], safety: SafetyResult, gpt_fut, started: float):
+    """
+    `resolve_gpt`, except that with GPT_OPTIONAL a failed GPT stage (timeout, open breaker or
+    service error) gives the `degraded_gpt` section instead of failing the triage; throttling
+    is still raised. Returns `(gpt, skipped, discarded, usage, error)`, `error` set only when degraded.
+    """
+    try:
+        gpt, skipped, discarded, usage = resolve_gpt(ti, s, safety, gpt_fut, started)
+        return gpt, skipped, discarded, usage, None
+    except Throttled:
+        raise
+    except Exception as ex:
+        if not s.get("gpt_optional", True):
+            raise
+        STATS["gpt_degraded"] += 1
+        logging.warning("GPT unavailable, degraded result: %s", ex)
+        return degraded_gpt(s.get("gpt_degraded_priority", "medium")), False, False, {}, ex
+
+
+def degraded_metadata(meta: Dict[str, Any], gpt_error: Optional[Exception]) -> Dict[str, Any]:
+    """
+    Add the GPT failure to `meta` (from `sentiment_metadata`): `degraded` lists every stand-in section.
+    """
+    if gpt_error is not None:
+        meta["degraded"] = meta.get("degraded", []) + ["gpt"]
+        meta["gpt_error"] = f"{type(gpt_error).__name__}: {gpt_error}"[:300]
+    return meta
+
+
+def reporting(name: str, fn: Callable[[], Any], on_event: Optional[Callable[[Dict[str, Any]], None]]):
+    """
+    Wrap a stage so its result is passed to `on_event` on the thread that produced it.
+    """
+    if on_event is None:
+        return fn
+
+    def run():
+        result = fn()
+        on_event({"event": name, "data": result.model_dump()})
+        return result
+    return run
+
+
+def triage(ti: TriageInput, pool: Optional[ClientPool] = None,
+           metadata: Optional[Dict[str, Any]] = None, timings: Optional[Timings] = None,
+           on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> TriageOutput:
+    """
+    Run Content Safety, Sentiment and GPT for one message and apply the decision policy.
+    The remote calls run at the same time; with the default speculative policy GPT is cancelled
+    or its answer dropped when Content Safety blocks (long bodies wait for safety instead, so
+    the excerpt includes the flagged chunks).
+    Identical messages are served from the verdict cache; policy is always re-applied. Only its
+    memory tier is checked up front: the blob tier is read alongside the stages, and a hit
+    arriving no later than Content Safety is returned with the stages dropped.
+    With NEARDUP_ENABLED, lightly edited copies of a recent message reuse its verdict
+    (`inherit`) or its GPT answer (`fast_track`, safety and sentiment still run), and
+    `metadata.near_duplicate` links the original.
+    With PRESCORE_ENABLED, confidently routine mail takes its sentiment from the on-box
+    pre-scorer instead of the Language service, and the pre-score stands in (flagged in
+    `metadata.degraded`) when the Language call fails or its breaker is open.
+    Each service call goes through its Route (per-attempt deadlines, breakers, hedging to a
+    secondary endpoint). Safety is required: if it fails the triage fails. With GPT_OPTIONAL a
+    failed GPT stage gives the `degraded_gpt` section, listed in `metadata.degraded`.
+    `metadata` is merged into the output metadata (e.g. a job id to use as the result id).
+    With WATCHLIST_ENABLED the message is scanned for watchlist terms before anything else: a
+    `block` hit is quarantined without any remote call (`metadata.short_circuit`), and
+    `escalate` hits raise priority and routing once the verdict is in.
+    Stage timings go to `timings` (a fresh one per call if omitted) and `metadata.timings_ms`.
+    `on_event` receives `safety` and `sentiment` events as those stages finish (from the stage
+    threads), `gpt_delta` events with the streamed reply (STREAM_GPT_TOKENS) and a `gpt` event
+    once policy has settled the GPT section, and a `watchlist` event (with the routing it forces)
+    first for escalating hits. Cached and inherited verdicts send no stage events (a blob-tier hit
+    may follow stage events already sent).
+    """
+    pool = pool or get_pool()
+    s = pool.settings
+    policy = s.get("safety_policy", "speculative")
+    extra = metadata or {}
+    tm = timings or request_timings(s)
+    t0 = time.perf_counter()
+
+    t = t0
+    if s.get("watchlist_enabled", False):
+        watchlist = scan_watchlist(ti, s)
+        t = tm.since("watchlist", t)
+        if watchlist is not None and on_event is not None and watchlist["action"] != "flag":
+            on_event({"event": "watchlist", "data": watchlist,
+                      "routing_hint": routing_hint(escalate_for_watchlist("low", watchlist), "normal", watchlist["action"])})
+        if watchlist is not None and watchlist["action"] == "block":
+            # Quarantined on the watchlist alone: no remote call, nothing cached
+            STATS["watchlist_blocked"] += 1
+            safety, sentiment, gpt = watchlist_verdict(ti, s, watchlist)
+            out = build_output(ti, safety, sentiment, gpt, observe_sender(
+                ti, safety, sentiment, s, {"watchlist": watchlist, "short_circuit": "watchlist", **extra}), s)
+            tm.since("policy", t)
+            return _with_timings(out, tm, t0)
+        # Scanned once: build_output reuses it
+        extra = dict(extra, watchlist=watchlist)
+
+    # The blob tier is a storage round trip: with concurrent stages it runs alongside them
+    concurrent = s.get("triage_concurrent", True)
+    key, cached, source = lookup_verdict(ti, s, blob=not concurrent)
+    t = tm.since("cache", t)
+    if cached is not None:
+        out = cached_output(ti, cached, source, extra, s)
+        tm.since("policy", t)
+        return _with_timings(out, tm, t0)
+
+    fp, near, prior = lookup_near_duplicate(ti, s, key)
+    if fp is not None:
+        t = tm.since("neardup", t)
+    mode = "inherit" if s.get("neardup_mode") == "inherit" else "fast_track"
+    near_meta = {"of": near["id"], "similarity": near["similarity"], "mode": mode} if prior is not None else None
+    if prior is not None and mode == "inherit":
+        STATS["neardup_inherit"] += 1
+        safety, sentiment, gpt = verdict_from_dict(prior)
+        store_verdict(key, s, safety, sentiment, gpt)
+        out = build_output(ti, safety, sentiment, gpt, observe_sender(
+            ti, safety, sentiment, s, {"cache_hit": False, "cache_source": source, "near_duplicate": near_meta, **extra}), s)
+        tm.since("policy", t)
+        return _with_timings(out, tm, t0)
+    # A blocked original has no real GPT answer to reuse
+    prior_gpt = GPTClassification(**prior["gpt"]) if prior is not None and not prior["safety"]["blocked"] else None
+
+    pre, skip_sentiment = (prescore_messages([ti.body], s) or [(None, False)])[0]
+    cs, ta, oa = pool.route("content_safety"), pool.route("language"), pool.route("openai")
+    chunks: Dict[str, Any] = {}
+    stages = {
+        "safety": tm.wrap("safety", reporting("safety", lambda: analyze_safety(cs, ti.body, s, chunks), on_event)),
+    }
+    if skip_sentiment:
+        STATS["sentiment_prescored"] += 1
+        if on_event is not None:
+            on_event({"event": "sentiment", "data": pre.sentiment.model_dump(), "source": "prescore"})
+    else:
+        stages["sentiment"] = tm.wrap("sentiment", reporting(
+            "sentiment", lambda: analyze_sentiment(ta, ti.body, s, chunks), on_event))
+    # Set once the GPT answer is no longer needed, so a streamed completion stops generating
+    gpt_done = threading.Event()
+
+    def classify(msg: TriageInput):
+        if on_event is None or not s.get("stream_gpt_tokens", True):
+            return classify_gpt_batched(oa, s, msg)
+        return classify_gpt_stream(oa, s, msg, lambda text: on_event({"event": "gpt_delta", "data": text}), gpt_done)
+
+    blob_fut = lookup_blob_verdict(key, s) if concurrent else None
+    futures, started = submit_stages(stages, s)
+    if prior_gpt is not None:
+        STATS["neardup_fast_track"] += 1
+    elif gpt_waits_for_safety(ti, s) and s.get("triage_concurrent", True):
+        # Safety has finished when this runs, so flagged chunks can go into the excerpt
+        gpt_stage = tm.wrap("gpt", lambda: classify(gpt_input(ti, s, chunks.get("flagged"))))
+        futures["gpt"] = submit_after(get_executor(s), futures["safety"], lambda r: not r.blocked, gpt_stage)
+    else:
+        # Deferred (sequential) GPT also runs after safety; concurrent GPT gets the opening only
+        sequential = not s.get("triage_concurrent", True)
+        gpt_stage = tm.wrap("gpt", lambda: classify(gpt_input(ti, s, chunks.get("flagged") if sequential else None)))
+        futures.update(submit_stages({"gpt": gpt_stage}, s)[0])
+
+    try:
+        cached = settle_blob_verdict(blob_fut, futures["safety"])
+        if cached is not None:
+            # An identical message's verdict was in the blob tier: the stages are dropped
+            out = cached_output(ti, cached, "blob", extra, s)
+            tm.since("policy", tm.since("cache", t))
+            return _with_timings(out, tm, t0)
+        safety = wait_stage("safety", futures["safety"], s.get("timeout_safety", 15.0), started)
+        if prior_gpt is not None:
+            gpt = security_playbook(safety) if safety.blocked and policy != "parallel" else prior_gpt
+            gpt_skipped, gpt_discarded, gpt_usage, gpt_error = True, False, {}, None
+            record_gpt_saved(ti, s)
+        else:
+            gpt, gpt_skipped, gpt_discarded, gpt_usage, gpt_error = settle_gpt(ti, s, safety, futures["gpt"], started)
+        if on_event is not None:
+            event = {"event": "gpt", "data": gpt.model_dump(), "skipped": gpt_skipped, "discarded": gpt_discarded}
+            on_event(dict(event, degraded=True) if gpt_error is not None else event)
+        try:
+            remote = wait_stage("sentiment", futures["sentiment"], s.get("timeout_sentiment", 15.0),
+                                started) if "sentiment" in futures else None
+        except Exception as ex:
+            remote = ex
+        sentiment, sentiment_source = settle_sentiment(remote, pre, s)
+        if sentiment_source == "prescore_fallback" and on_event is not None:
+            on_event({"event": "sentiment", "data": sentiment.model_dump(), "source": sentiment_source})
+    finally:
+        gpt_done.set()
+        for fut in futures.values():
+            fut.cancel()
+
+    meta = {
+        "cache_hit": False, "cache_source": source,
+        "safety_policy": policy, "gpt_skipped": gpt_skipped, "gpt_discarded": gpt_discarded, "gpt_usage": gpt_usage,
+        **degraded_metadata(sentiment_metadata(pre, sentiment_source), gpt_error),
+    }
+    # Stand-in sections are not cached, so the next copy of this message gets the real ones
+    degraded = "degraded" in meta
+    if not degraded:
+        store_verdict(key, s, safety, sentiment, gpt)
+    if chunks or gpt_input(ti, s) is not ti:
+        meta["chunks"] = {
+            "safety": chunks.get("safety", 1), "sentiment": chunks.get("sentiment", 1),
+            "flagged": len(chunks.get("flagged", [])),
+            "gpt_excerpt": not gpt_skipped and gpt_input(ti, s) is not ti,
+        }
+    if prior_gpt is not None:
+        meta["near_duplicate"] = near_meta
+    t = time.perf_counter()
+    out = build_output(ti, safety, sentiment, gpt, observe_sender(ti, safety, sentiment, s, {**meta, **extra}), s)
+    tm.since("policy", t)
+    if prior_gpt is None and not degraded:
+        index_near_duplicate(fp, key, out, s)
+    return _with_timings(out, tm, t0)
+
+
+def _with_timings(out: TriageOutput, tm: Timings, started: float) -> TriageOutput:
+    tm.since("total", started)
+    snapshot = tm.snapshot()
+    if snapshot is not None:
+        out.metadata["timings_ms"] = snapshot
+    return out
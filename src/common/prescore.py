@@ -0,0 +1,256 @@
+import re
+import json
+import zlib
+import logging
+import threading
+from typing import Dict, Any, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from common.models import SentimentResult
+
+
+# Output columns: three sentiment logits, then the logit of "Content Safety finds something"
+LABELS = ("positive", "neutral", "negative")
+RISK = len(LABELS)
+
+# A message counts as risky for training when any category reaches this severity
+RISK_SEVERITY = 2
+
+# Words that flip the polarity of the next few tokens ("not happy" -> NOT_happy)
+NEGATORS = frozenset(("not", "no", "never", "cannot", "cant", "dont", "didnt", "wont", "isnt", "wasnt"))
+NEGATION_SPAN = 3
+
+_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# Built-in weights, used until a model is calibrated on archived Language results
+POSITIVE = (
+    "thank thanks thankful grateful appreciate appreciated appreciation glad happy pleased great good "
+    "wonderful excellent love loved kind helpful blessed hope hopeful proud excited enjoy enjoyed "
+    "congratulations welcome nice best better fine well safe"
+).split()
+NEGATIVE = (
+    "angry upset frustrated frustrating unfair wrong terrible horrible awful bad worse worst hate hated "
+    "sick pain hurt hurting scared afraid worried worry anxious depressed hopeless alone lonely tired "
+    "ignored denied refused complaint complain disappointed disappointing unacceptable lost missing "
+    "broken never threat threatened regret abuse abused harass harassed sad cry crying miserable"
+).split()
+RISKY = (
+    "kill killed killing knife shank weapon gun shoot stab stabbed attack beat hurt blood die dead death "
+    "suicide overdose pills cut cutting end hang hit riot escape contraband drugs phone smuggle gang "
+    "brothers colors signal package drop tonight officer guard regret revenge payback"
+).split()
+
+
+class Prescore(NamedTuple):
+    sentiment: SentimentResult
+    confidence: float       # probability of the predicted label
+    risk: float             # estimated probability that Content Safety reports any finding
+
+
+def tokens(text: str) -> List[str]:
+    """
+    Lowercase word tokens; up to NEGATION_SPAN tokens after a negator get a `NOT_` prefix.
+    """
+    out: List[str] = []
+    negate = 0
+    for tok in _TOKEN.findall(text.lower()):
+        tok = tok.replace("'", "")
+        if tok in NEGATORS:
+            negate = NEGATION_SPAN
+            out.append(tok)
+            continue
+        out.append("NOT_" + tok if negate else tok)
+        negate = max(negate - 1, 0)
+    return out
+
+
+def feature_ids(text: str, bits: int) -> List[int]:
+    """
+    Hashed unigram and bigram ids of `text` (each id once: features are presence, not counts).
+    """
+    toks = tokens(text)
+    mask = (1 << bits) - 1
+    grams = toks + [a + " " + b for a, b in zip(toks, toks[1:])]
+    return list({zlib.crc32(g.encode("utf-8")) & mask for g in grams})
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class Prescorer:
+    """
+    On-box sentiment and risk scorer: a linear model over hashed unigrams and bigrams.
+
+    `weights` has one row per hash bucket and four columns (positive, neutral, negative logits
+    and the risk logit). A batch is scored with one gather over the active buckets and one
+    `bincount` per column; tokenising is most of the cost. Without a calibrated model the weights come from the small
+    built-in lexicon; `fit` learns them from archived Language and Content Safety results.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, bits: int, source: str = "lexicon",
+                 info: Optional[Dict[str, Any]] = None):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.bits = bits
+        self.source = source
+        self.info = info or {}
+        self.counters = {"scored": 0, "batches": 0}
+
+    # ----- construction -----
+
+    @classmethod
+    def from_lexicon(cls, bits: int = 18) -> "Prescorer":
+        w = np.zeros((1 << bits, len(LABELS) + 1), dtype=np.float32)
+        mask = (1 << bits) - 1
+
+        def put(word: str, col: int, value: float) -> None:
+            w[zlib.crc32(word.encode("utf-8")) & mask, col] += value
+
+        for word in POSITIVE:
+            put(word, 0, 1.6)
+            put("NOT_" + word, 2, 1.2)
+        for word in NEGATIVE:
+            put(word, 2, 1.6)
+            put("NOT_" + word, 1, 0.8)
+        for word in RISKY:
+            put(word, RISK, 1.5)
+        # No lexicon hit: neutral (p ~ 0.8) and low risk (p ~ 0.05)
+        return cls(w, np.array([0.0, 2.2, 0.0, -3.0], dtype=np.float32), bits, "lexicon")
+
+    @classmethod
+    def load(cls, path: str) -> "Prescorer":
+        with np.load(path) as z:
+            info = json.loads(str(z["info"])) if "info" in z.files else {}
+            return cls(z["weights"], z["bias"], int(z["bits"]), path, info)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, weights=self.weights.astype(np.float16), bias=self.bias,
+                            bits=np.int64(self.bits), info=json.dumps(self.info))
+
+    # ----- scoring -----
+
+    def _features(self, texts: Sequence[str]):
+        ids = [feature_ids(t, self.bits) for t in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(x) for x in ids])
+        cols = np.fromiter((i for x in ids for i in x), dtype=np.int64, count=len(rows))
+        return rows, cols
+
+    def logits(self, texts: Sequence[str]) -> np.ndarray:
+        rows, cols = self._features(texts)
+        gathered = self.weights[cols]
+        out = np.empty((len(texts), self.weights.shape[1]), dtype=np.float64)
+        for j in range(self.weights.shape[1]):
+            out[:, j] = np.bincount(rows, weights=gathered[:, j], minlength=len(texts))
+        return out + self.bias
+
+    def score(self, texts: Sequence[str]) -> List[Prescore]:
+        """
+        Sentiment (as the Language service would report it), its confidence and the risk estimate
+        for every text, in one vectorised pass.
+        """
+        if not texts:
+            return []
+        z = self.logits(texts)
+        probs = _softmax(z[:, :RISK])
+        risk = 1.0 / (1.0 + np.exp(-z[:, RISK]))
+        best = probs.argmax(axis=1)
+        self.counters["scored"] += len(texts)
+        self.counters["batches"] += 1
+        return [
+            Prescore(
+                SentimentResult(sentiment=LABELS[b], confidence={k: round(float(p[i]), 4) for i, k in enumerate(LABELS)}),
+                round(float(p[b]), 4),
+                round(float(r), 4),
+            )
+            for b, p, r in zip(best, probs, risk)
+        ]
+
+    # ----- calibration -----
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str], risky: Sequence[bool], epochs: int = 8,
+            lr: float = 0.5, l2: float = 1e-6, batch: int = 256, seed: int = 0) -> None:
+        """
+        Learn the weights from labelled messages (multinomial logistic regression for sentiment,
+        logistic for risk) with mini-batch AdaGrad. Starts from the current weights, so fitting
+        a lexicon model keeps its priors for words the data never shows. "mixed" counts as neutral.
+        """
+        y = np.array([LABELS.index(l) if l in LABELS else 1 for l in labels])
+        r = np.asarray(risky, dtype=np.float64)
+        feats = [np.array(feature_ids(t, self.bits), dtype=np.int64) for t in texts]
+        w = self.weights.astype(np.float64)
+        b = self.bias.astype(np.float64)
+        gw = np.full_like(w, 1e-8)
+        gb = np.full_like(b, 1e-8)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(texts))
+            for start in range(0, len(order), batch):
+                idx = order[start:start + batch]
+                rows = np.repeat(np.arange(len(idx)), [len(feats[i]) for i in idx])
+                cols = np.concatenate([feats[i] for i in idx]) if len(rows) else np.zeros(0, dtype=np.int64)
+                z = np.zeros((len(idx), w.shape[1]))
+                for j in range(w.shape[1]):
+                    z[:, j] = np.bincount(rows, weights=w[cols, j], minlength=len(idx))
+                z += b
+                delta = np.zeros_like(z)
+                delta[:, :RISK] = _softmax(z[:, :RISK])
+                delta[np.arange(len(idx)), y[idx]] -= 1.0
+                delta[:, RISK] = 1.0 / (1.0 + np.exp(-z[:, RISK])) - r[idx]
+                delta /= len(idx)
+                grad = np.zeros_like(w)
+                np.add.at(grad, cols, delta[rows])
+                touched = np.unique(cols)
+                grad[touched] += l2 * w[touched]
+                gw[touched] += grad[touched] ** 2
+                w[touched] -= lr * grad[touched] / np.sqrt(gw[touched])
+                g = delta.sum(axis=0)
+                gb += g ** 2
+                b -= lr * g / np.sqrt(gb)
+        self.weights = w.astype(np.float32)
+        self.bias = b.astype(np.float32)
+        self.source = "calibrated"
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters, buckets=self.weights.shape[0])
+
+
+def can_skip(p: Prescore, s: Dict[str, Any]) -> bool:
+    """
+    True when the remote sentiment call can be skipped: a confident label from
+    PRESCORE_SKIP_LABELS and a low risk estimate (risky mail always gets the real service).
+    """
+    if not s.get("prescore_skip", True):
+        return False
+    labels = [x.strip() for x in s.get("prescore_skip_labels", "positive,neutral").split(",")]
+    return (p.sentiment.sentiment in labels and p.confidence >= s.get("prescore_skip_confidence", 0.9)
+            and p.risk <= s.get("prescore_max_risk", 0.2))
+
+
+_prescorer: Optional[Prescorer] = None
+_prescorer_lock = threading.Lock()
+
+
+def get_prescorer(s: Dict[str, Any]) -> Optional[Prescorer]:
+    """
+    Process-wide pre-scorer, or None when PRESCORE_ENABLED is off. Loads PRESCORE_MODEL_PATH
+    (written by scripts/calibrate_prescore.py) or falls back to the built-in lexicon.
+    """
+    global _prescorer
+    if not s.get("prescore_enabled", False):
+        return None
+    if _prescorer is None:
+        with _prescorer_lock:
+            if _prescorer is None:
+                path = s.get("prescore_model_path")
+                scorer = None
+                if path:
+                    try:
+                        scorer = Prescorer.load(path)
+                    except Exception as ex:
+                        logging.warning("Pre-score model %s could not be loaded, using the lexicon: %s", path, ex)
+                _prescorer = scorer or Prescorer.from_lexicon(s.get("prescore_bits", 18))
+    return _prescorer
@@ -0,0 +1,277 @@
+import time
+import email.utils
+import random
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable
+
+
+class Throttled(Exception):
+    """
+    Raised when a call is still throttled after the scheduler's retries (or its wait budget) ran out.
+    """
+
+    def __init__(self, lane: str, retry_after: float):
+        super().__init__(f"'{lane}' is throttled (retry after {retry_after:.1f}s)")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def throttle_delay(ex: Exception) -> Optional[float]:
+    """
+    If `ex` is a throttling response (HTTP 429) from the OpenAI or Azure SDKs, return how long to
+    back off in seconds (from retry-after-ms / Retry-After, default 1s); otherwise None.
+    """
+    resp = getattr(ex, "response", None)
+    status = getattr(ex, "status_code", None) or getattr(resp, "status_code", None)
+    if status != 429:
+        return None
+    headers = getattr(resp, "headers", None) or {}
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / 1000.0
+            except ValueError:
+                pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return 1.0
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens/second up to `capacity`.
+    A rate of 0 disables the bucket. `pause()` empties it until a given time (Retry-After).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n: float) -> float:
+        """
+        Take `n` tokens (going into debt if needed) and return how long to wait before proceeding.
+        """
+        if self.rate <= 0:
+            return max(self.paused_until - time.monotonic(), 0.0)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now, 0.0)
+
+    def refund(self, n: float) -> None:
+        if self.rate > 0 and n:
+            with self._lock:
+                self.tokens = min(self.capacity, self.tokens + n)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: +1 slot per window of successful calls, halved on throttling.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, throttled: bool) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                # additive increase: roughly +1 per `limit` successes
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+
+class Lane:
+    """
+    Scheduling state for one service (and deployment): request and token buckets, AIMD limiter, counters.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float, s: Dict[str, Any]):
+        self.name = name
+        self.requests = TokenBucket(rpm / 60.0, max(rpm / 6.0, 1.0)) if rpm else TokenBucket(0)
+        self.tokens = TokenBucket(tpm / 60.0, max(tpm / 6.0, 1.0)) if tpm else TokenBucket(0)
+        self.limiter = AdaptiveLimiter(
+            s.get("ratelimit_initial_concurrency", 8),
+            s.get("ratelimit_min_concurrency", 1),
+            s.get("ratelimit_max_concurrency", 32),
+        )
+        self.counters = {"calls": 0, "throttled": 0, "retries": 0, "failed_throttled": 0, "wait_ms": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self.counters,
+            concurrency_limit=round(self.limiter.limit, 2),
+            in_flight=self.limiter.in_flight,
+            queue_depth=self.limiter.waiting,
+        )
+
+
+class RateLimitScheduler:
+    """
+    Shared gate in front of every remote AI call.
+
+    Each call waits for (1) a concurrency slot from the lane's AIMD limiter and (2) request and
+    token budget from the lane's buckets. A 429 halves the lane's concurrency, pauses its
+    buckets for the server's Retry-After and retries, so bursts settle at the highest rate the
+    service accepts instead of turning into retry storms.
+    """
+
+    def __init__(self, s: Dict[str, Any]):
+        self.s = s
+        self.max_retries = s.get("ratelimit_max_retries", 4)
+        self.max_wait = s.get("ratelimit_max_wait_s", 30.0)
+        self._lanes: Dict[str, Lane] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, lane: Lane, key: str, n: int = 1) -> None:
+        # Lanes are shared by every calling thread; `+=` on a dict entry is not atomic
+        with self._lock:
+            lane.counters[key] += n
+
+    def lane(self, service: str, deployment: str = "") -> Lane:
+        name = f"{service}:{deployment}" if deployment else service
+        lane = self._lanes.get(name)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.get(name)
+                if lane is None:
+                    rpm = self.s.get(f"ratelimit_{service}_rpm", 0)
+                    tpm = self.s.get(f"ratelimit_{service}_tpm", 0)
+                    lane = self._lanes[name] = Lane(name, rpm, tpm, self.s)
+        return lane
+
+    def call(self, service: str, fn: Callable[[], Any], tokens: int = 0, deployment: str = "",
+             actual_tokens: Optional[Callable[[Any], int]] = None) -> Any:
+        """
+        Run `fn()` under the lane's limits. `tokens` is the estimated cost charged up front;
+        `actual_tokens(result)` lets the caller true it up once usage is known.
+        """
+        lane = self.lane(service, deployment)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            wait = max(lane.requests.reserve(1), lane.tokens.reserve(tokens))
+            if time.monotonic() - started + wait > self.max_wait:
+                lane.requests.refund(1)
+                lane.tokens.refund(tokens)
+                self._count(lane, "failed_throttled")
+                raise Throttled(lane.name, wait)
+            if wait:
+                time.sleep(wait)
+            if not lane.limiter.acquire(max(self.max_wait - (time.monotonic() - started), 0.0)):
+                # The call is never made: give back the budget reserved for it
+                lane.requests.refund(1)
+                lane.tokens.refund(tokens)
+                self._count(lane, "failed_throttled")
+                raise Throttled(lane.name, 0.0)
+            self._count(lane, "wait_ms", int((time.monotonic() - queued) * 1000))
+
+            throttled = False
+            try:
+                self._count(lane, "calls")
+                result = fn()
+            except Exception as ex:
+                delay = throttle_delay(ex)
+                if delay is None:
+                    raise
+                throttled = True
+                self._count(lane, "throttled")
+                lane.requests.pause(delay)
+                lane.tokens.pause(delay)
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._count(lane, "failed_throttled")
+                    raise Throttled(lane.name, delay) from ex
+                self._count(lane, "retries")
+                logging.info("%s throttled; retry %d in %.2fs", lane.name, attempt, delay)
+                # jitter so callers released by the same Retry-After do not arrive together
+                time.sleep(delay * random.uniform(1.0, 1.2))
+                continue
+            finally:
+                lane.limiter.release(throttled)
+
+            if actual_tokens is not None and tokens:
+                try:
+                    lane.tokens.refund(tokens - actual_tokens(result))
+                except Exception:
+                    pass
+            return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: lane.stats() for name, lane in list(self._lanes.items())}
+
+
+_scheduler: Optional[RateLimitScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(s: Dict[str, Any]) -> Optional[RateLimitScheduler]:
+    """
+    Process-wide scheduler, or None when RATELIMIT_ENABLED is off.
+    """
+    global _scheduler
+    if not s.get("ratelimit_enabled", True):
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RateLimitScheduler(s)
+    return _scheduler
+
+
+def scheduled(s: Dict[str, Any], service: str, fn: Callable[[], Any], tokens: int = 0,
+              deployment: str = "", actual_tokens: Optional[Callable[[Any], int]] = None) -> Any:
+    """
+    Run `fn` through the scheduler if it is enabled, otherwise call it directly.
+    """
+    scheduler = get_scheduler(s)
+    if scheduler is None:
+        return fn()
+    return scheduler.call(service, fn, tokens, deployment, actual_tokens)
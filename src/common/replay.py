@@ -0,0 +1,238 @@
+import os
+import json
+import importlib
+import importlib.util
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from types import ModuleType
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+from common.archive import ARCHIVE_EXTENSIONS, read_archive_blob, is_archive_blob
+from common.models import SafetyCategory, SentimentResult, GPTClassification
+
+
+# ---------- Policy ----------
+
+_policies: Dict[Optional[str], ModuleType] = {}
+
+
+def load_policy(path: Optional[str] = None) -> ModuleType:
+    """
+    The policy module to replay with: `common.logic` by default, or a candidate file defining
+    the same functions (`evaluate_safety`, `apply_security_overrides`, `combine_priority`,
+    `routing_hint`). Loaded once per process.
+    """
+    policy = _policies.get(path)
+    if policy is None:
+        if path is None:
+            policy = importlib.import_module("common.logic")
+        else:
+            spec = importlib.util.spec_from_file_location("replay_policy", path)
+            policy = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(policy)
+        _policies[path] = policy
+    return policy
+
+
+def replay_record(record: Dict[str, Any], policy: ModuleType) -> Dict[str, Any]:
+    """
+    Re-apply the policy to one archived result using its stored stage outputs (and the
+    sender's rolling features from `metadata.sender_risk`, when the policy defines
+    `sender_risk_level`; the watchlist hit from `metadata.watchlist`, when it defines
+    `escalate_for_watchlist`).
+
+    Severities are re-thresholded from the raw categories, so block-threshold changes take effect.
+    A message that was blocked before and would pass now has no real GPT answer (the call was
+    skipped and the security playbook stored); it is reported as `needs_gpt` instead of guessed.
+    """
+    old_priority = record.get("combined_priority")
+    old_route = record.get("routing_hint")
+    safety = policy.evaluate_safety([SafetyCategory(**c) for c in record["safety"].get("categories", [])])
+    sentiment = SentimentResult(**record["sentiment"])
+    gpt = GPTClassification(**record["gpt"])
+    out = {
+        "id": (record.get("metadata") or {}).get("id"),
+        "old_priority": old_priority, "old_route": old_route,
+    }
+    meta = record.get("metadata") or {}
+    watchlist = meta.get("watchlist") if hasattr(policy, "escalate_for_watchlist") else None
+    # A watchlist block never called the services: its blocked GPT section is not a safety block
+    quarantined = watchlist is not None and watchlist.get("action") == "block"
+    if not safety.blocked and gpt.priority == "blocked" and not quarantined:
+        return dict(out, status="needs_gpt", new_priority=None, new_route=None)
+    new_priority = policy.combine_priority(safety, sentiment, policy.apply_security_overrides(gpt, safety))
+    risk = meta.get("sender_risk")
+    level = "normal"
+    if risk and hasattr(policy, "sender_risk_level"):
+        # The sender's rolling features as they were when the message was triaged
+        level = policy.sender_risk_level(risk)
+        new_priority = policy.escalate_for_sender(new_priority, level)
+    if watchlist is not None:
+        new_priority = policy.escalate_for_watchlist(new_priority, watchlist)
+        new_route = policy.routing_hint(new_priority, level, watchlist.get("action"))
+    elif risk and hasattr(policy, "sender_risk_level"):
+        new_route = policy.routing_hint(new_priority, level)
+    else:
+        new_route = policy.routing_hint(new_priority)
+    status = "same" if (new_priority, new_route) == (old_priority, old_route) else "changed"
+    return dict(out, status=status, new_priority=new_priority, new_route=new_route)
+
+
+def replay_blob(name: str, data: bytes, policy_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Decode one archive blob and replay every record in it. Runs in a worker process and returns
+    only counts plus the changed records, so large shards do not travel back to the parent.
+    """
+    policy = load_policy(policy_path)
+    priorities: Counter = Counter()
+    routes: Counter = Counter()
+    changed: List[Dict[str, Any]] = []
+    records = errors = needs_gpt = 0
+    try:
+        for record in read_archive_blob(name, data):
+            records += 1
+            try:
+                r = replay_record(record, policy)
+            except Exception:
+                errors += 1
+                continue
+            priorities[(r["old_priority"], r["new_priority"] or "needs_gpt")] += 1
+            routes[(r["old_route"], r["new_route"] or "needs_gpt")] += 1
+            if r["status"] == "needs_gpt":
+                needs_gpt += 1
+            if r["status"] != "same":
+                changed.append(dict(r, blob=name))
+    except Exception:
+        errors += 1
+    return {"records": records, "errors": errors, "needs_gpt": needs_gpt,
+            "priorities": priorities, "routes": routes, "changed": changed}
+
+
+# ---------- Sources ----------
+
+def iter_blob_names(blob_svc, s: Dict[str, Any], name_starts_with: Optional[str] = None) -> Iterator[str]:
+    """
+    Archive blob names straight from the paged `list_blobs` iterator (one page in memory at a time).
+    """
+    container = blob_svc.get_container_client(s["blob_container"])
+    for props in container.list_blobs(name_starts_with=name_starts_with):
+        if is_archive_blob(props.name, s):
+            yield props.name
+
+
+def iter_dir_names(root: str) -> Iterator[str]:
+    """
+    Archive files under a local directory (e.g. a downloaded copy of the container), as relative paths.
+    """
+    for dirpath, _, files in os.walk(root):
+        for f in sorted(files):
+            if f.endswith(ARCHIVE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, f), root).replace(os.sep, "/")
+
+
+# ---------- Driver ----------
+
+class ReplayReport:
+    """
+    Running totals of a replay: old -> new priority and route transitions, counts per value and
+    the number of changed / needs_gpt / unreadable records. Changed records are streamed to
+    `changed_out` (NDJSON) as they arrive, so memory stays flat.
+    """
+
+    def __init__(self, changed_out=None):
+        self.blobs = 0
+        self.records = 0
+        self.errors = 0
+        self.needs_gpt = 0
+        self.changed = 0
+        self.priorities: Counter = Counter()
+        self.routes: Counter = Counter()
+        self.changed_out = changed_out
+        self.sample: List[str] = []
+
+    def add(self, result: Dict[str, Any]) -> None:
+        self.blobs += 1
+        self.records += result["records"]
+        self.errors += result["errors"]
+        self.needs_gpt += result["needs_gpt"]
+        self.priorities.update(result["priorities"])
+        self.routes.update(result["routes"])
+        for r in result["changed"]:
+            if r["status"] == "changed":
+                self.changed += 1
+                if len(self.sample) < 100:
+                    self.sample.append(r["id"])
+            if self.changed_out is not None:
+                self.changed_out.write(json.dumps(r) + "\n")
+
+    @staticmethod
+    def _totals(pairs: Counter, side: int) -> Dict[str, int]:
+        out: Counter = Counter()
+        for pair, n in pairs.items():
+            out[str(pair[side])] += n
+        return dict(out.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "blobs": self.blobs,
+            "records": self.records,
+            "changed": self.changed,
+            "needs_gpt": self.needs_gpt,
+            "errors": self.errors,
+            "priority": {"old": self._totals(self.priorities, 0), "new": self._totals(self.priorities, 1)},
+            "route": {"old": self._totals(self.routes, 0), "new": self._totals(self.routes, 1)},
+            "changed_ids_sample": self.sample,
+            "priority_transitions": [
+                {"old": o, "new": n, "count": c}
+                for (o, n), c in sorted(self.priorities.items(), key=lambda kv: -kv[1]) if o != n
+            ],
+        }
+
+
+def replay(names: Iterable[str], fetch, report: ReplayReport, policy_path: Optional[str] = None,
+           download_workers: int = 16, processes: Optional[int] = None, window: int = 64,
+           executor: Optional[Executor] = None) -> ReplayReport:
+    """
+    Download blobs with a thread pool (`fetch(name) -> bytes`) and replay them on a process
+    pool. At most `window` blobs are downloading or being replayed at any time, so memory is
+    bounded by the window, not by the size of the archive.
+    """
+    procs = executor or ProcessPoolExecutor(max_workers=processes)
+    downloads: deque = deque()
+    replays: deque = deque()
+
+    def hand_off() -> None:
+        name, data = downloads.popleft().result()
+        replays.append(procs.submit(replay_blob, name, data, policy_path))
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="replay-download") as io:
+            for name in names:
+                downloads.append(io.submit(lambda n: (n, fetch(n)), name))
+                while downloads and downloads[0].done():
+                    hand_off()
+                while len(downloads) + len(replays) >= window:
+                    if downloads and (downloads[0].done() or not replays):
+                        hand_off()
+                    else:
+                        report.add(replays.popleft().result())
+            while downloads:
+                hand_off()
+        while replays:
+            report.add(replays.popleft().result())
+    finally:
+        if executor is None:
+            procs.shutdown(cancel_futures=True)
+    return report
+
+
+def blob_fetcher(blob_svc, s: Dict[str, Any]):
+    container = blob_svc.get_container_client(s["blob_container"])
+    return lambda name: container.download_blob(name).readall()
+
+
+def dir_fetcher(root: str):
+    def fetch(name: str) -> bytes:
+        with open(os.path.join(root, name), "rb") as f:
+            return f.read()
+    return fetch
@@ -0,0 +1,428 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Callable, List, NamedTuple
+
+from common.ratelimit import Throttled, throttle_delay
+
+
+# Settings key of the stage timeout that caps each service's attempts
+STAGE_TIMEOUTS = {"content_safety": "timeout_safety", "language": "timeout_sentiment", "openai": "timeout_gpt"}
+
+
+class BreakerOpen(Exception):
+    """
+    Raised instead of calling a service whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"'{name}' circuit is open (retry after {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Cancelled(Exception):
+    """
+    Raised by a call abandoned on purpose (e.g. the losing side of a hedge); not a service failure.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for a while instead of making every request wait for it.
+
+      closed     calls go through; `failure_threshold` consecutive failures open the circuit
+      open       calls fail fast with BreakerOpen for `open_s`
+      half_open  one probe call is let through; success closes the circuit, failure re-opens it
+
+    Only endpoint failures count. A call abandoned on purpose (Cancelled) or turned away by
+    rate limiting (Throttled from the local scheduler, or an HTTP 429) says nothing about the
+    endpoint's health and is neither a failure nor a success.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_s: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.open_s = open_s
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "failures": 0, "throttled": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.open_s:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logging.info("Circuit '%s' closed", self.name)
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.counters["failures"] += 1
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                if self.state == "closed":
+                    logging.warning("Circuit '%s' opened after %d failures", self.name, self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.counters["opened"] += 1
+
+    def available(self) -> bool:
+        """
+        False while the circuit is open and cooling down. Unlike `allow`, never takes the half-open probe.
+        """
+        with self._lock:
+            if self.state == "open":
+                return time.monotonic() - self._opened_at >= self.open_s
+            return self.state == "closed" or not self._probing
+
+    def retry_after(self) -> float:
+        return max(self.open_s - (time.monotonic() - self._opened_at), 0.0)
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        if not self.allow():
+            raise BreakerOpen(self.name, self.retry_after())
+        self.counters["calls"] += 1
+        try:
+            result = fn()
+        except Exception as ex:
+            cancelled = isinstance(ex, Cancelled)
+            if not cancelled and not isinstance(ex, Throttled) and throttle_delay(ex) is None:
+                self.record_failure()
+                raise
+            with self._lock:
+                self._probing = False
+                if not cancelled:
+                    self.counters["throttled"] += 1
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters, open=int(self.state != "closed"))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(s: Dict[str, Any], name: str) -> Optional[CircuitBreaker]:
+    """
+    Process-wide breaker for one service, or None when BREAKER_ENABLED is off.
+    """
+    if not s.get("breaker_enabled", True):
+        return None
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                name, CircuitBreaker(name, s.get("breaker_failures", 5), s.get("breaker_open_s", 30.0)))
+    return breaker
+
+
+def guarded(s: Dict[str, Any], name: str, fn: Callable[[], Any]) -> Any:
+    """
+    `fn()` through the service's breaker (or directly when breakers are off).
+    """
+    breaker = get_breaker(s, name)
+    return breaker.call(fn) if breaker is not None else fn()
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: b.stats() for name, b in _breakers.items()}
+
+
+def available(s: Dict[str, Any], name: str) -> bool:
+    breaker = get_breaker(s, name)
+    return breaker is None or breaker.available()
+
+
+# ---------- Latency tracking ----------
+
+class LatencyTracker:
+    """
+    Latencies of the last `window` calls to one endpoint, for hedge delays and attempt timeouts.
+    The sorted copy used for quantiles is rebuilt at most every `RESORT_EVERY` samples.
+    """
+
+    RESORT_EVERY = 16
+
+    def __init__(self, window: int = 512):
+        self._samples: deque = deque(maxlen=window)
+        self._sorted: List[float] = []
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, ms: float) -> None:
+        with self._lock:
+            self._samples.append(ms)
+            self._stale += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            if not self._sorted or self._stale >= self.RESORT_EVERY:
+                self._sorted = sorted(self._samples)
+                self._stale = 0
+            values = self._sorted
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+
+
+def get_tracker(s: Dict[str, Any], name: str) -> LatencyTracker:
+    tracker = _trackers.get(name)
+    if tracker is None:
+        with _breakers_lock:
+            tracker = _trackers.setdefault(name, LatencyTracker(s.get("latency_window", 512)))
+    return tracker
+
+
+def _observed(s: Dict[str, Any], name: str, q: float) -> Optional[float]:
+    """
+    The endpoint's `q` latency quantile in seconds, or None until LATENCY_MIN_SAMPLES calls were seen.
+    """
+    tracker = get_tracker(s, name)
+    if len(tracker) < s.get("latency_min_samples", 20):
+        return None
+    return tracker.quantile(q) / 1000.0
+
+
+def attempt_timeout(s: Dict[str, Any], name: str, ceiling: float) -> float:
+    """
+    Deadline for one call to endpoint `name`: ADAPTIVE_TIMEOUT_MULTIPLIER times its observed p99,
+    at least ADAPTIVE_TIMEOUT_MIN_S and never more than the stage timeout `ceiling`.
+    """
+    if not s.get("adaptive_timeout", True):
+        return ceiling
+    p99 = _observed(s, name, 0.99)
+    if p99 is None:
+        return ceiling
+    return min(max(p99 * s.get("adaptive_timeout_multiplier", 3.0), s.get("adaptive_timeout_min_s", 2.0)), ceiling)
+
+
+def hedge_delay(s: Dict[str, Any], name: str, ceiling: float) -> float:
+    """
+    How long to wait on the primary before hedging: its observed HEDGE_QUANTILE latency
+    (HEDGE_INITIAL_DELAY_MS until enough calls were seen), at least HEDGE_MIN_DELAY_MS.
+    """
+    observed = _observed(s, name, s.get("hedge_quantile", 0.95))
+    delay = observed if observed is not None else s.get("hedge_initial_delay_ms", 1000.0) / 1000.0
+    return min(max(delay, s.get("hedge_min_delay_ms", 20.0) / 1000.0), ceiling)
+
+
+# ---------- Hedged routes ----------
+
+class HedgeBudget:
+    """
+    Caps hedges at a share of calls: every call earns `ratio` of a hedge (up to `burst`), every
+    hedge spends one. Keeps a service-wide slowdown from doubling the load on it.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._credit = burst
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self._credit = min(self._credit + self.ratio, self.burst)
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            return True
+
+
+class Endpoint(NamedTuple):
+    name: str                   # breaker and latency tracker key, e.g. "openai" or "openai_secondary"
+    client: Any
+    settings: Dict[str, Any]    # settings as this endpoint sees them (its own deployment)
+    lane: str = ""              # rate-limit lane within the service
+
+
+def endpoint_lane(service: str, s: Dict[str, Any], secondary: bool = False) -> str:
+    lane = s.get("openai_deployment", "") if service == "openai" else ""
+    if secondary:
+        lane = f"secondary:{lane}" if lane else "secondary"
+    return lane
+
+
+class Route:
+    """
+    A service's primary endpoint and its optional secondary (another region or deployment).
+
+    `call(s, fn)` runs `fn(endpoint, timeout)` on the primary. With a secondary configured, a
+    duplicate request goes to it when the primary has not answered within the hedge delay
+    (HEDGE_ENABLED, within the HEDGE_MAX_RATIO budget), or straight away when the primary
+    fails or its breaker is open; the first success wins and the loser is left to finish (or
+    time out) in the background. Every attempt has its own latency-aware timeout and goes
+    through its endpoint's breaker.
+    """
+
+    def __init__(self, service: str, primary: Endpoint, secondary: Optional[Endpoint] = None):
+        self.service = service
+        self.primary = primary
+        self.secondary = secondary
+
+    def _attempt(self, s: Dict[str, Any], ep: Endpoint, fn: Callable[[Endpoint, float], Any]) -> Any:
+        timeout = attempt_timeout(s, ep.name, s.get(STAGE_TIMEOUTS.get(self.service, ""), 30.0))
+        started = time.perf_counter()
+        try:
+            result = guarded(s, ep.name, lambda: fn(ep, timeout))
+        except (BreakerOpen, Cancelled, Throttled):
+            raise
+        except Exception:
+            # A call cut off by its deadline still says how slow the endpoint is; fast errors do not
+            elapsed = time.perf_counter() - started
+            if elapsed >= timeout * 0.9:
+                get_tracker(s, ep.name).record(elapsed * 1000.0)
+            raise
+        get_tracker(s, ep.name).record((time.perf_counter() - started) * 1000.0)
+        return result
+
+    def call(self, s: Dict[str, Any], fn: Callable[[Endpoint, float], Any],
+             settled: Optional[threading.Event] = None) -> Any:
+        """
+        `settled` is set once the call has an outcome, so a losing attempt can stop early.
+        """
+        counters = _hedge_counters(self.service)
+        counters["calls"] += 1
+        primary, secondary = self.primary, self.secondary
+        try:
+            if secondary is None:
+                return self._attempt(s, primary, fn)
+            if not available(s, primary.name):
+                counters["failovers"] += 1
+                return self._attempt(s, secondary, fn)
+            return self._hedged(s, fn, counters)
+        finally:
+            if settled is not None:
+                settled.set()
+
+    def _hedged(self, s: Dict[str, Any], fn: Callable[[Endpoint, float], Any], counters: Dict[str, int]) -> Any:
+        primary, secondary = self.primary, self.secondary
+        ceiling = s.get(STAGE_TIMEOUTS.get(self.service, ""), 30.0)
+        budget = _hedge_budget(s, self.service)
+        budget.earn()
+        executor = _hedge_executor(s)
+        pending: Dict[Future, Endpoint] = {executor.submit(self._attempt, s, primary, fn): primary}
+        hedge_at = time.monotonic() + hedge_delay(s, primary.name, ceiling) if s.get("hedge_enabled", True) else None
+        errors: List[Exception] = []
+        spare: Optional[Endpoint] = secondary
+        while pending:
+            timeout = max(hedge_at - time.monotonic(), 0.0) if spare is not None and hedge_at is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ep = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as ex:
+                    errors.append(ex)
+                    continue
+                if ep is secondary:
+                    counters["secondary_wins"] += 1
+                return result
+            if spare is None or not available(s, spare.name):
+                spare = None
+                continue
+            if done:
+                # The primary failed: fail over rather than surface its error
+                counters["failovers"] += 1
+            elif budget.spend():
+                counters["hedged"] += 1
+            else:
+                counters["budget_denied"] += 1
+                hedge_at = None
+                continue
+            pending[executor.submit(self._attempt, s, spare, fn)] = spare
+            spare = None
+        # Throttling is reported as such (the caller answers 503 + Retry-After)
+        throttled = [e for e in errors if isinstance(e, Throttled)]
+        raise throttled[0] if len(throttled) == len(errors) else next(e for e in errors if not isinstance(e, Throttled))
+
+
+def as_route(target: Any, service: str, s: Dict[str, Any]) -> Route:
+    """
+    `target` if it is already a Route, else a single-endpoint Route around a bare SDK client.
+    """
+    if isinstance(target, Route):
+        return target
+    return Route(service, Endpoint(service, target, s, endpoint_lane(service, s)))
+
+
+_hedge_stats: Dict[str, Dict[str, int]] = {}
+_budgets: Dict[str, HedgeBudget] = {}
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _hedge_counters(service: str) -> Dict[str, int]:
+    counters = _hedge_stats.get(service)
+    if counters is None:
+        with _breakers_lock:
+            counters = _hedge_stats.setdefault(
+                service, {"calls": 0, "hedged": 0, "failovers": 0, "secondary_wins": 0, "budget_denied": 0})
+    return counters
+
+
+def _hedge_budget(s: Dict[str, Any], service: str) -> HedgeBudget:
+    budget = _budgets.get(service)
+    if budget is None:
+        with _breakers_lock:
+            budget = _budgets.setdefault(service, HedgeBudget(s.get("hedge_max_ratio", 0.1)))
+    return budget
+
+
+def _hedge_executor(s: Dict[str, Any]) -> ThreadPoolExecutor:
+    """
+    Attempts of hedged calls run here, so the calling stage can return as soon as either answers.
+    """
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _breakers_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=2 * s.get("triage_max_workers", 16),
+                                                 thread_name_prefix="triage-hedge")
+    return _hedge_pool
+
+
+def hedge_stats() -> Dict[str, Dict[str, int]]:
+    return {name: dict(c) for name, c in _hedge_stats.items()}
+
+
+def latency_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Observed p50 / p95 / p99 (ms) per endpoint.
+    """
+    out = {}
+    for name, tracker in list(_trackers.items()):
+        out[name] = {f"p{int(q * 100)}_ms": round(tracker.quantile(q) or 0.0, 1) for q in (0.5, 0.95, 0.99)}
+        out[name]["samples"] = len(tracker)
+    return out
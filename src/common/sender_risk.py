@@ -0,0 +1,419 @@
+import gzip
+import json
+import hashlib
+import math
+import time
+import logging
+import datetime
+import threading
+from array import array
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from common.archive import iter_archive_records
+from common.clients import ensure_container
+from common.models import SafetyResult, SentimentResult
+
+
+# Content Safety categories tracked per sender, in storage order
+CATEGORIES = ("Hate", "SelfHarm", "Sexual", "Violence")
+
+# Per window: decayed message count, negative count, blocked count, then one severity sum per category
+_FIELDS = 3 + len(CATEGORIES)
+_STATE_SIZE = 1 + 2 * _FIELDS      # last update (epoch seconds) + recent window + baseline window
+_SNAPSHOT_VERSION = 2
+
+# Bound on the message keys and the observations waiting for a snapshot write (oldest dropped first)
+_MAX_PENDING = 200000
+
+
+def record_time(record: Dict[str, Any]) -> Optional[float]:
+    """
+    Epoch seconds of an archived result's `metadata.timestamp` (UTC), or None.
+    """
+    ts = (record.get("metadata") or {}).get("timestamp") or ""
+    try:
+        when = datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.timestamp()
+
+
+def _window(st: array, offset: int) -> Dict[str, Any]:
+    n = st[offset]
+    mean = (lambda v: round(v / n, 3)) if n > 0 else (lambda v: 0.0)
+    return {
+        "messages": round(n, 2),
+        "negative_share": mean(st[offset + 1]),
+        "blocked": round(st[offset + 2], 2),
+        "severity": {c: mean(st[offset + 3 + i]) for i, c in enumerate(CATEGORIES)},
+    }
+
+
+def _add(table: Dict[str, array], sender: str, when: float, values: List[float],
+         half_lives: Tuple[float, float]) -> array:
+    """
+    Fold one message into `table[sender]`: decay the sums to the message time and add it.
+    """
+    st = table.get(sender)
+    if st is None:
+        st = table[sender] = array("d", [when] + [0.0] * (_STATE_SIZE - 1))
+    age = when - st[0]
+    for w, half_life in enumerate(half_lives):
+        offset = 1 + w * _FIELDS
+        if age >= 0:
+            decay, weight = math.exp2(-age / half_life), 1.0
+        else:
+            decay, weight = 1.0, math.exp2(age / half_life)
+        for i, v in enumerate(values):
+            st[offset + i] = st[offset + i] * decay + v * weight
+    if age > 0:
+        st[0] = when
+    return st
+
+
+def message_key(message_id: Optional[str]) -> Optional[str]:
+    """
+    Short fixed-size key for a message id (job or result id), kept to count each message once.
+    """
+    return hashlib.sha1(message_id.encode("utf-8")).hexdigest()[:16] if message_id else None
+
+
+class SenderRiskStore:
+    """
+    Rolling per-sender risk state as exponentially decayed counters.
+
+    Each sender has one fixed-size array: the time of the last update and, for a short
+    ("recent") and a long ("baseline") half-life, decayed sums of messages, negative
+    sentiment, blocks and severity per category. An update decays the sums to the message
+    time and adds it, so it is O(1) however long the history; messages older than the last
+    update (archive rebuild) are added already decayed. Means are sum / messages, so a recent
+    mean above the baseline mean is a rising trend.
+
+    Sums are additive, so instances share one snapshot blob by merging into it: a snapshot
+    reads the blob, adds this instance's observations since its last write, and writes it back
+    only if its ETag is unchanged (re-reading on a conflict). The blob also keeps the keys of
+    recently counted messages, so a message observed twice (queue re-delivery, or an archive
+    catch-up of a message another instance already wrote) is counted once.
+    """
+
+    def __init__(self, s: Dict[str, Any], blob_svc_factory=None):
+        self.half_lives = (s.get("sender_risk_recent_half_life_h", 24.0) * 3600.0,
+                           s.get("sender_risk_baseline_half_life_h", 168.0) * 3600.0)
+        self.max_senders = s.get("sender_risk_max_senders", 200000)
+        self.container = s.get("blob_container")
+        self.blob_name = s.get("sender_risk_blob_name", "sender_risk/state.json.gz")
+        self.interval = s.get("sender_risk_snapshot_s", 300.0)
+        self.rebuild_days = s.get("sender_risk_rebuild_days", 14)
+        self.archive_prefix = s.get("archive_prefix", "archive/")
+        # Message keys are kept long enough to cover observations still waiting for a write
+        self.key_retention = max(3 * self.interval, 3600.0)
+        self.settings = s
+        self._blob_svc_factory = blob_svc_factory
+        self._senders: Dict[str, array] = {}
+        # Observations not yet merged into the snapshot blob: (sender, when, values, key)
+        self._pending: List[Tuple[str, float, List[float], Optional[str]]] = []
+        self._keys: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._last_snapshot = time.monotonic()
+        self._saving = False
+        self.started_at = time.time()
+        self.counters = {"observed": 0, "duplicates": 0, "rebuilt": 0, "pruned": 0,
+                         "snapshot_loads": 0, "snapshot_writes": 0, "snapshot_conflicts": 0, "snapshot_errors": 0}
+
+    # ----- updates -----
+
+    def _observe(self, sender: str, when: float, negative: bool, blocked: bool,
+                 severities: Dict[str, int], message_id: Optional[str] = None) -> Optional[array]:
+        sender = (sender or "").strip().lower()
+        if not sender:
+            return None
+        key = message_key(message_id)
+        values = [1.0, float(negative), float(blocked)] + [float(severities.get(c) or 0) for c in CATEGORIES]
+        with self._lock:
+            if key is not None and key in self._keys:
+                self.counters["duplicates"] += 1
+                st = self._senders.get(sender)
+                return array("d", st) if st is not None else None
+            st = _add(self._senders, sender, when, values, self.half_lives)
+            if self._blob_svc_factory is not None and self.interval > 0:
+                self._pending.append((sender, when, values, key))
+                if len(self._pending) > _MAX_PENDING:
+                    del self._pending[:len(self._pending) - _MAX_PENDING]
+            if key is not None:
+                self._keys[key] = when
+                if len(self._keys) > _MAX_PENDING:
+                    for old in list(self._keys)[:len(self._keys) - _MAX_PENDING]:
+                        del self._keys[old]
+            self.counters["observed"] += 1
+            return array("d", st)
+
+    def _features(self, st: array, now: float) -> Dict[str, Any]:
+        # Decay to `now` so a quiet sender's counts fall even without new messages
+        view = array("d", st)
+        age = max(now - st[0], 0.0)
+        for w, half_life in enumerate(self.half_lives):
+            decay = math.exp2(-age / half_life)
+            for i in range(1 + w * _FIELDS, 1 + (w + 1) * _FIELDS):
+                view[i] *= decay
+        return {"recent": _window(view, 1), "baseline": _window(view, 1 + _FIELDS)}
+
+    def observe(self, sender: Optional[str], safety: SafetyResult, sentiment: SentimentResult,
+                when: Optional[float] = None, message_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Add one message and return the sender's features including it (None without a sender).
+        A `message_id` already counted is not added again.
+        """
+        when = time.time() if when is None else when
+        st = self._observe(sender, when, (sentiment.sentiment or "").lower() == "negative", safety.blocked,
+                           {c.category: c.severity for c in safety.categories}, message_id)
+        return self._features(st, when) if st is not None else None
+
+    def observe_record(self, record: Dict[str, Any], when: Optional[float] = None) -> bool:
+        """
+        Add one archived TriageOutput (dict), at its own timestamp unless `when` is given.
+        """
+        meta = record.get("metadata") or {}
+        when = record_time(record) if when is None else when
+        if when is None:
+            return False
+        safety = record.get("safety") or {}
+        observed = self.counters["observed"]
+        st = self._observe(meta.get("sender"), when,
+                           ((record.get("sentiment") or {}).get("sentiment") or "").lower() == "negative",
+                           bool(safety.get("blocked")),
+                           {c["category"]: c.get("severity") for c in safety.get("categories", [])},
+                           meta.get("id"))
+        return st is not None and self.counters["observed"] > observed
+
+    def features(self, sender: Optional[str], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            st = self._senders.get((sender or "").strip().lower())
+            st = array("d", st) if st is not None else None
+        return self._features(st, time.time() if now is None else now) if st is not None else None
+
+    # ----- archive rebuild -----
+
+    def rebuild(self, records: Iterable[Tuple[str, Dict[str, Any]]], since: float, until: float) -> int:
+        """
+        Fold archived results with `since <= timestamp < until` into the state. `until` is when
+        this process started observing live traffic; results already in the snapshot blob are
+        skipped by their message key when the snapshot is next written.
+        """
+        n = 0
+        for _, record in records:
+            when = record_time(record)
+            if when is not None and since <= when < until and self.observe_record(record, when):
+                n += 1
+        self.counters["rebuilt"] += n
+        return n
+
+    def rebuild_from_archive(self, since: float) -> int:
+        """
+        Read the hourly archive partitions from `since` (or `sender_risk_rebuild_days` back)
+        to process start. Legacy per-message blobs outside the partitions are not read.
+        """
+        since = max(since, self.started_at - self.rebuild_days * 86400.0)
+        blob_svc = self._blob_svc_factory()
+        day = datetime.datetime.fromtimestamp(since, datetime.timezone.utc).date()
+        last = datetime.datetime.fromtimestamp(self.started_at, datetime.timezone.utc).date()
+        n = 0
+        while day <= last:
+            prefix = f"{self.archive_prefix}{day:%Y/%m/%d}/"
+            n += self.rebuild(iter_archive_records(blob_svc, self.settings, prefix), since, self.started_at)
+            day += datetime.timedelta(days=1)
+        return n
+
+    def start(self) -> None:
+        """
+        Load the snapshot, then catch up from the archive on a background thread.
+        """
+        if self._blob_svc_factory is None:
+            return
+        saved_at = self.load()
+
+        def catch_up() -> None:
+            try:
+                n = self.rebuild_from_archive(saved_at or 0.0)
+                logging.info("Sender risk: %d archived results folded in", n)
+            except Exception as ex:
+                logging.warning("Sender risk rebuild failed: %s", ex)
+
+        threading.Thread(target=catch_up, name="sender-risk-rebuild", daemon=True).start()
+
+    # ----- snapshot -----
+
+    def _prune_table(self, table: Dict[str, array], now: float) -> int:
+        idle = [k for k, st in table.items()
+                if st[1 + _FIELDS] * math.exp2(-max(now - st[0], 0.0) / self.half_lives[1]) < 0.01]
+        for k in idle:
+            del table[k]
+        extra = len(table) - self.max_senders
+        if extra > 0:
+            for k in sorted(table, key=lambda k: table[k][0])[:extra]:
+                del table[k]
+        return len(idle) + max(extra, 0)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Drop senders whose baseline has decayed to nothing, then the least recently seen ones
+        above `max_senders`.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            pruned = self._prune_table(self._senders, now)
+            self.counters["pruned"] += pruned
+        return pruned
+
+    def encode(self, senders: Dict[str, array], keys: Dict[str, float]) -> bytes:
+        doc = {"version": _SNAPSHOT_VERSION, "half_lives": list(self.half_lives), "saved_at": time.time(),
+               "senders": {k: list(st) for k, st in senders.items()}, "keys": keys}
+        return gzip.compress(json.dumps(doc, separators=(",", ":")).encode("utf-8"))
+
+    def decode(self, data: bytes) -> Optional[Tuple[Dict[str, array], Dict[str, float], float]]:
+        """
+        `(senders, message keys, saved_at)` of a snapshot, or None if it was taken with other half-lives.
+        """
+        doc = json.loads(gzip.decompress(data))
+        if doc.get("version") not in (1, _SNAPSHOT_VERSION) or tuple(doc.get("half_lives") or ()) != self.half_lives:
+            return None
+        senders = {k: array("d", v) for k, v in doc["senders"].items() if len(v) == _STATE_SIZE}
+        return senders, dict(doc.get("keys") or {}), doc["saved_at"]
+
+    def _adopt(self, senders: Dict[str, array], keys: Dict[str, float]) -> None:
+        """
+        Make the shared state the local one, plus the observations still waiting for a write.
+        Called under the lock.
+        """
+        for sender, when, values, key in self._pending:
+            _add(senders, sender, when, values, self.half_lives)
+            if key is not None:
+                keys[key] = when
+        self._senders, self._keys = senders, keys
+
+    def _read(self, blob) -> Tuple[Optional[Tuple[Dict[str, array], Dict[str, float], float]], Optional[str]]:
+        try:
+            download = blob.download_blob()
+            return self.decode(download.readall()), download.properties.etag
+        except Exception as ex:
+            if type(ex).__name__ == "ResourceNotFoundError":
+                return None, None
+            raise
+
+    def load(self) -> Optional[float]:
+        try:
+            blob = self._blob_svc_factory().get_blob_client(self.container, self.blob_name)
+            shared, _ = self._read(blob)
+            if shared is None:
+                return None
+            senders, keys, saved_at = shared
+            with self._lock:
+                self._adopt(senders, keys)
+            self.counters["snapshot_loads"] += 1
+            return saved_at
+        except Exception as ex:
+            self.counters["snapshot_errors"] += 1
+            logging.warning("Sender risk snapshot load failed: %s", ex)
+            return None
+
+    def _merge(self, blob) -> bool:
+        """
+        One read-merge-write of the snapshot blob. Returns False when another instance wrote
+        it in between (nothing was written).
+        """
+        shared, etag = self._read(blob)
+        senders, keys, _ = shared if shared is not None else ({}, {}, 0.0)
+        with self._lock:
+            pending, self._pending = self._pending, []
+        written = False
+        try:
+            written = self._write(blob, etag, senders, keys, pending)
+        finally:
+            if not written:
+                # Not in the blob: these go into the next attempt, ahead of newer observations
+                with self._lock:
+                    self._pending = pending + self._pending
+        return written
+
+    def _write(self, blob, etag: Optional[str], senders: Dict[str, array], keys: Dict[str, float],
+               pending: List[Tuple[str, float, List[float], Optional[str]]]) -> bool:
+        from azure.core import MatchConditions
+
+        for sender, when, values, key in pending:
+            if key is not None and key in keys:
+                continue
+            _add(senders, sender, when, values, self.half_lives)
+            if key is not None:
+                keys[key] = when
+        now = time.time()
+        self.counters["pruned"] += self._prune_table(senders, now)
+        keys = {k: when for k, when in keys.items() if now - when < self.key_retention}
+        data = self.encode(senders, keys)
+        try:
+            if etag is None:
+                blob.upload_blob(data, overwrite=False)
+            else:
+                blob.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+        except Exception as ex:
+            if type(ex).__name__ in ("ResourceModifiedError", "ResourceExistsError"):
+                return False
+            raise
+        with self._lock:
+            self._adopt(senders, keys)
+        return True
+
+    def snapshot(self, attempts: int = 3) -> None:
+        try:
+            blob_svc = self._blob_svc_factory()
+            ensure_container(blob_svc, self.container)
+            blob = blob_svc.get_blob_client(self.container, self.blob_name)
+            for _ in range(attempts):
+                if self._merge(blob):
+                    self.counters["snapshot_writes"] += 1
+                    return
+                self.counters["snapshot_conflicts"] += 1
+            logging.warning("Sender risk snapshot not written: %d conflicting writes", attempts)
+        except Exception as ex:
+            self.counters["snapshot_errors"] += 1
+            logging.warning("Sender risk snapshot write failed: %s", ex)
+        finally:
+            self._saving = False
+
+    def maybe_snapshot(self, executor) -> None:
+        """
+        Queue a snapshot on `executor` when the interval has passed and there were updates.
+        """
+        if self._blob_svc_factory is None or self.interval <= 0 or not self._pending:
+            return
+        with self._lock:
+            if self._saving or time.monotonic() - self._last_snapshot < self.interval:
+                return
+            self._saving = True
+            self._last_snapshot = time.monotonic()
+        executor.submit(self.snapshot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, senders=len(self._senders), pending=len(self._pending))
+
+
+_store: Optional[SenderRiskStore] = None
+_store_lock = threading.Lock()
+
+
+def get_sender_risk(s: Dict[str, Any], blob_svc_factory=None) -> Optional[SenderRiskStore]:
+    """
+    Process-wide sender risk store, or None when SENDER_RISK_ENABLED is off. The first call
+    loads the blob snapshot and starts the archive catch-up in the background.
+    """
+    global _store
+    if not s.get("sender_risk_enabled", False):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = SenderRiskStore(s, blob_svc_factory)
+                store.start()
+                _store = store
+    return _store
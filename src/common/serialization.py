@@ -0,0 +1,96 @@
+import io
+import json
+from typing import Dict, Any, Iterator, NamedTuple, Union
+
+from common.models import TriageOutput
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for ARCHIVE_FORMAT=msgpack
+    msgpack = None
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact JSON as UTF-8 bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps_with(obj: Dict[str, Any], **raw: bytes) -> bytes:
+    """
+    `dumps(obj)` with already-encoded JSON values added as extra keys, without decoding them.
+    """
+    out = dumps(obj)
+    if not raw:
+        return out
+    extra = b",".join(b'"%s":%s' % (k.encode("utf-8"), v) for k, v in raw.items())
+    return out[:-1] + (b"," if len(out) > 2 else b"") + extra + b"}"
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class Encoded(NamedTuple):
+    """
+    A result serialized once: its plain-data form and compact JSON bytes, shared by the HTTP
+    response, the job status and the archive writer.
+    """
+    data: Dict[str, Any]
+    json: bytes
+
+
+def encode_result(out: TriageOutput) -> Encoded:
+    data = out.model_dump()
+    return Encoded(data, dumps(data))
+
+
+def has_msgpack() -> bool:
+    return msgpack is not None
+
+
+def _msgpack():
+    if msgpack is None:
+        raise RuntimeError("ARCHIVE_FORMAT=msgpack needs the msgpack package (pip install msgpack)")
+    return msgpack
+
+
+def archive_bytes(record: Union[Dict[str, Any], Encoded], fmt: str = "ndjson") -> bytes:
+    """
+    One record as stored in a shard: a JSON line, or a msgpack map for ARCHIVE_FORMAT=msgpack.
+    Encoded records reuse their JSON bytes.
+    """
+    data, raw = (record.data, record.json) if isinstance(record, Encoded) else (record, None)
+    if fmt == "msgpack":
+        return _msgpack().packb(data)
+    return (raw if raw is not None else dumps(data)) + b"\n"
+
+
+def unpack_records(data: bytes) -> Iterator[Dict[str, Any]]:
+    """
+    Records of a (decompressed) msgpack shard.
+    """
+    yield from _msgpack().Unpacker(io.BytesIO(data), raw=False)
+
+
+def unpack_tail(data: bytes):
+    """
+    Complete records at the start of `data` and how many bytes they used; a record still
+    being written at the end is left for the next read.
+    """
+    unpacker = _msgpack().Unpacker(raw=False)
+    unpacker.feed(data)
+    records = []
+    used = 0
+    for record in unpacker:
+        records.append(record)
+        used = unpacker.tell()
+    return records, used
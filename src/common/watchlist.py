@@ -0,0 +1,425 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from common.models import TriageInput
+
+
+# Watchlist actions, weakest first (the decision rules are in common.logic)
+ACTIONS = ("flag", "escalate", "block")
+
+# Characters that stand in for letters: leetspeak and look-alike symbols
+LEET = {"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g",
+        "@": "a", "$": "s", "!": "i", "|": "i", "+": "t", "€": "e", "£": "l"}
+
+# Cyrillic and Greek letters that look like Latin ones
+HOMOGLYPHS = {"а": "a", "в": "b", "е": "e", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c",
+              "т": "t", "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s", "α": "a", "β": "b", "ε": "e",
+              "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t", "υ": "u", "χ": "x"}
+
+# Invisible characters used to split words ("sh​ank"): read as separators
+INVISIBLE = "­​‌‍⁠﻿"
+
+
+def _fold_table() -> Dict[int, str]:
+    """
+    One character in, one character out, so offsets in folded text are offsets in the original.
+    """
+    table = {ord(c): c.lower() for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"}
+    for code in range(0x00C0, 0x0250):
+        base = unicodedata.normalize("NFKD", chr(code))[:1].lower()
+        if "a" <= base <= "z":
+            table[code] = base
+    for src, dst in list(LEET.items()) + list(HOMOGLYPHS.items()):
+        table[ord(src)] = dst
+        table[ord(src.upper())] = dst
+    for c in INVISIBLE:
+        table[ord(c)] = " "
+    return table
+
+
+_FOLD = _fold_table()
+_SEPARATORS = re.compile(r"[^a-z0-9]+")
+_REPEATS = re.compile(r"([a-z0-9])\1+")
+_RUNS = re.compile(r"([a-z0-9])\1*")
+_WORD = re.compile(r"[a-z0-9]")
+
+
+def fold(text: str) -> str:
+    """
+    Lowercase Latin letters with accents, leetspeak and homoglyphs resolved; same length as `text`.
+    """
+    return text.translate(_FOLD)
+
+
+def squash(folded: str) -> str:
+    """
+    Folded text with everything but letters and digits dropped and repeated characters
+    collapsed, so "S h 4 a n k", "sh.ank" and "shaaank" all read "shank".
+    """
+    return _REPEATS.sub(r"\1", _SEPARATORS.sub("", folded))
+
+
+def normalize_term(term: str) -> str:
+    """
+    A term folded with separators dropped. Repeated letters are kept: "weed" must not read "wed".
+    """
+    return _SEPARATORS.sub("", fold(term))
+
+
+def runs(norm: str) -> Tuple[str, Tuple[int, ...]]:
+    """
+    `norm` with repeated characters collapsed, and the length of each run.
+    """
+    return squash(norm), tuple(len(m.group()) for m in _RUNS.finditer(norm))
+
+
+def _positions(folded: str) -> Tuple[List[int], List[int], List[int]]:
+    """
+    For each character of `squash(folded)`: the offsets of the first and last characters of
+    `folded` it stands for (a collapsed run covers several), and how many characters the run has.
+    """
+    first: List[int] = []
+    last: List[int] = []
+    count: List[int] = []
+    prev = ""
+    for m in _WORD.finditer(folded):
+        c, i = m.group(), m.start()
+        if c == prev:
+            last[-1] = i
+            count[-1] += 1
+        else:
+            first.append(i)
+            last.append(i)
+            count.append(1)
+            prev = c
+    return first, last, count
+
+
+def _trie_regex(terms: List[str]) -> str:
+    """
+    One pattern matching any of `terms`, nested by shared prefix so the regex engine does
+    not try every term at every position.
+    """
+    trie: Dict[str, Any] = {}
+    for term in terms:
+        node = trie
+        for c in term:
+            node = node.setdefault(c, {})
+        node[""] = True
+
+    def pattern(node: Dict[str, Any]) -> str:
+        alts = [re.escape(c) + pattern(child) for c, child in sorted(node.items()) if c]
+        if not alts:
+            return ""
+        if len(alts) == 1 and "" not in node:
+            return alts[0]
+        group = "(?:" + "|".join(alts) + ")"
+        return group + "?" if "" in node else group
+
+    return pattern(trie)
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over normalized terms: one pass over the text finds every
+    occurrence of every term, overlapping ones included, in time linear in the text plus
+    the number of matches.
+    """
+
+    def __init__(self, terms: List[str]):
+        self.lengths = [len(t) for t in terms]
+        self.goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for tid, term in enumerate(terms):
+            node = 0
+            for c in term:
+                nxt = self.goto[node].get(c)
+                if nxt is None:
+                    nxt = self.goto[node][c] = len(self.goto)
+                    self.goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(tid)
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(c, 0)
+                self.fail[child] = target if target != child else 0
+                # A term ending here also ends every term that is a suffix of it
+                out[child] = out[child] + out[self.fail[child]]
+        self.out = [tuple(o) for o in out]
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def iter(self, text: str):
+        """
+        `(start, end, term_id)` for each occurrence, `end` inclusive.
+        """
+        goto, fail, out, lengths = self.goto, self.fail, self.out, self.lengths
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if out[node]:
+                for tid in out[node]:
+                    yield i - lengths[tid] + 1, i, tid
+
+
+class Match(NamedTuple):
+    field: str      # "subject" or "body"
+    start: int      # offsets in the original field text, end exclusive
+    end: int
+    term: str       # the watchlist term as written
+    list: str       # the list it belongs to
+    action: str
+
+
+class Watchlist:
+    """
+    Security terms compiled for scanning. `lists` maps a list name to `{"action": ..., "terms": [...]}`
+    (action "flag", "escalate" or "block"; default "escalate").
+
+    Subject and body are folded (case, accents, leetspeak, homoglyphs) and squashed (separators
+    dropped, repeated characters collapsed) before matching, and terms get the same treatment,
+    so "sh4nk", "s h a n k" and "shaaank" all hit "shank". Each run in the text must be at least
+    as long as the same run in the term, so padding a letter still matches ("weeeed") but
+    dropping one of a pair does not ("Wed" is not "weed"). A hit must start and end on a word
+    boundary of the original text, which keeps "shank" from matching inside "Shankar" or
+    across "his hank". A combined regex finds out whether anything matches at all (most mail
+    does not); only then does the automaton produce spans.
+    """
+
+    def __init__(self, lists: Dict[str, Dict[str, Any]], min_chars: int = 3, version: str = ""):
+        self.version = version
+        terms: Dict[str, int] = {}
+        self.entries: List[Tuple[str, str, str]] = []       # (term, list, action) per normalized term
+        skipped = 0
+        for name, spec in lists.items():
+            action = str(spec.get("action", "escalate")).lower()
+            if action not in ACTIONS:
+                raise ValueError(f"Watchlist '{name}': unknown action {action!r}")
+            for term in spec.get("terms") or []:
+                norm = normalize_term(str(term))
+                if len(squash(norm)) < min_chars:
+                    skipped += 1
+                    continue
+                tid = terms.get(norm)
+                if tid is None:
+                    terms[norm] = len(self.entries)
+                    self.entries.append((str(term), name, action))
+                elif ACTIONS.index(action) > ACTIONS.index(self.entries[tid][2]):
+                    # The same term on two lists takes the stronger action
+                    self.entries[tid] = (str(term), name, action)
+        normalized = list(terms)
+        collapsed = [runs(norm) for norm in normalized]
+        # Run lengths only for terms with a repeated letter; the rest match on the collapsed form alone
+        self.repeats: List[Optional[Tuple[int, ...]]] = [r if max(r) > 1 else None for _, r in collapsed]
+        self.automaton = Automaton([c for c, _ in collapsed])
+        self._gate = re.compile(_trie_regex(sorted({c for c, _ in collapsed}))) if normalized else None
+        self.counts = {"lists": len(lists), "terms": len(normalized), "skipped_terms": skipped,
+                       "states": len(self.automaton)}
+
+    @classmethod
+    def from_bytes(cls, data: bytes, min_chars: int = 3) -> "Watchlist":
+        doc = json.loads(data)
+        return cls(doc.get("lists") or {}, min_chars, version=hashlib.sha1(data).hexdigest()[:12])
+
+    def scan_text(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        `(start, end, entry)` spans in `text` (end exclusive), in order of the end offset.
+        """
+        if self._gate is None or not text:
+            return []
+        folded = fold(text)
+        squashed = squash(folded)
+        if not self._gate.search(squashed):
+            return []
+        first, last, count = _positions(folded)
+        n = len(text)
+        out = []
+        for a, b, tid in self.automaton.iter(squashed):
+            # A collapsed run can straddle two words ("rim month"): the match may start or end
+            # at any of its characters. Boundaries are judged on the original characters, so
+            # "shank!" ends at the "!" even though "!" folds to a letter inside a word.
+            start = next((i for i in range(last[a], first[a] - 1, -1)
+                          if _WORD.match(folded, i) and (i == 0 or not text[i - 1].isalnum())), None)
+            end = next((i + 1 for i in range(first[b], last[b] + 1)
+                        if _WORD.match(folded, i) and (i + 1 == n or not text[i + 1].isalnum())), None)
+            if start is None or end is None or start >= end:
+                continue
+            repeats = self.repeats[tid]
+            if repeats is not None and not self._runs_fit(folded, repeats, a, b, start, end, first, last, count):
+                continue
+            out.append((start, end, tid))
+        return out
+
+    @staticmethod
+    def _runs_fit(folded: str, repeats: Tuple[int, ...], a: int, b: int, start: int, end: int,
+                  first: List[int], last: List[int], count: List[int]) -> bool:
+        """
+        Whether every run of the match is at least as long as the term's. The first and last
+        runs only count the characters inside `[start, end)`, so "all lama" is not "llama".
+        """
+        for k, need in enumerate(repeats):
+            if need == 1:
+                continue
+            j = a + k
+            if j == a or j == b:
+                lo, hi = max(first[j], start), min(last[j] + 1, end)
+                have = sum(1 for i in range(lo, hi) if _WORD.match(folded, i))
+            else:
+                have = count[j]
+            if have < need:
+                return False
+        return True
+
+    def scan(self, ti: TriageInput, limit: int = 20) -> List[Match]:
+        matches = []
+        for field in ("subject", "body"):
+            text = getattr(ti, field) or ""
+            for start, end, tid in self.scan_text(text):
+                term, name, action = self.entries[tid]
+                matches.append(Match(field, start, end, term, name, action))
+                if len(matches) >= limit:
+                    return matches
+        return matches
+
+
+def summarize(matches: List[Match], ti: TriageInput, version: str = "") -> Optional[Dict[str, Any]]:
+    """
+    `metadata.watchlist` for a message: the strongest action, the lists hit and each span with
+    the text it covered. None without matches.
+    """
+    if not matches:
+        return None
+    return {
+        "action": max((m.action for m in matches), key=ACTIONS.index),
+        "lists": sorted({m.list for m in matches}),
+        "matches": [{"list": m.list, "term": m.term, "field": m.field, "start": m.start, "end": m.end,
+                     "text": getattr(ti, m.field)[m.start:m.end]} for m in matches],
+        "version": version,
+    }
+
+
+class WatchlistStore:
+    """
+    The compiled watchlist, loaded from WATCHLIST_PATH or from WATCHLIST_BLOB_NAME in the
+    results container, and reloaded without a restart: at most every WATCHLIST_RELOAD_S a
+    check (file mtime or blob ETag) runs off the request path, and a changed list is compiled
+    and swapped in whole. A list that fails to load or compile leaves the current one in place.
+    """
+
+    def __init__(self, s: Dict[str, Any], blob_svc_factory=None):
+        self.path = s.get("watchlist_path")
+        self.container = s.get("blob_container")
+        self.blob_name = s.get("watchlist_blob_name", "watchlist/watchlist.json")
+        self.interval = s.get("watchlist_reload_s", 60.0)
+        self.min_chars = s.get("watchlist_min_term_chars", 3)
+        self._blob_svc_factory = blob_svc_factory
+        self._tag: Optional[str] = None
+        self._last_check = time.monotonic()
+        self._checking = False
+        self._lock = threading.Lock()
+        self.watchlist: Optional[Watchlist] = None
+        self.counters = {"loads": 0, "load_errors": 0, "scans": 0, "hits": 0}
+        self.reload()
+
+    def _source(self) -> Tuple[Optional[str], Any]:
+        """
+        (ETag or mtime, reader) of the configured source, or (None, None) when it does not exist.
+        """
+        if self.path:
+            if not os.path.exists(self.path):
+                return None, None
+            return str(os.path.getmtime(self.path)), lambda: open(self.path, "rb").read()
+        if self._blob_svc_factory is None:
+            return None, None
+        blob = self._blob_svc_factory().get_blob_client(self.container, self.blob_name)
+        try:
+            tag = blob.get_blob_properties().etag
+        except Exception as ex:
+            if type(ex).__name__ == "ResourceNotFoundError":
+                return None, None
+            raise
+        return tag, lambda: blob.download_blob().readall()
+
+    def reload(self) -> bool:
+        """
+        Compile the source again if it changed. Returns True when a new list was swapped in.
+        """
+        try:
+            tag, read = self._source()
+            if tag is None or tag == self._tag:
+                return False
+            watchlist = Watchlist.from_bytes(read(), self.min_chars)
+        except Exception as ex:
+            self.counters["load_errors"] += 1
+            logging.warning("Watchlist load failed, keeping the current one: %s", ex)
+            return False
+        finally:
+            self._checking = False
+        self.watchlist, self._tag = watchlist, tag
+        self.counters["loads"] += 1
+        logging.info("Watchlist %s loaded: %s", watchlist.version, watchlist.counts)
+        return True
+
+    def maybe_reload(self, executor) -> None:
+        """
+        Queue a reload check on `executor` when the interval has passed.
+        """
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._checking or time.monotonic() - self._last_check < self.interval:
+                return
+            self._checking = True
+            self._last_check = time.monotonic()
+        executor.submit(self.reload)
+
+    def scan(self, ti: TriageInput, limit: int = 20) -> Optional[Dict[str, Any]]:
+        watchlist = self.watchlist
+        if watchlist is None:
+            return None
+        self.counters["scans"] += 1
+        summary = summarize(watchlist.scan(ti, limit), ti, watchlist.version)
+        if summary is not None:
+            self.counters["hits"] += 1
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        counts = self.watchlist.counts if self.watchlist is not None else {}
+        return dict(counts, **self.counters)
+
+
+_store: Optional[WatchlistStore] = None
+_store_lock = threading.Lock()
+
+
+def get_watchlist(s: Dict[str, Any], blob_svc_factory=None) -> Optional[WatchlistStore]:
+    """
+    Process-wide watchlist, or None when WATCHLIST_ENABLED is off.
+    """
+    global _store
+    if not s.get("watchlist_enabled", False):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WatchlistStore(s, blob_svc_factory)
+    return _store
@@ -1,7 +1,11 @@
 import json
+import time
+import uuid
 import requests
 import streamlit as st
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
 
 # -----------------------------
 # App Config & Styling
@@ -70,6 +74,11 @@ with st.sidebar:
         value="http://localhost:7071/api/triage",
         help="Your running triage endpoint.",
     )
+    progressive = st.checkbox(
+        "Show partial results",
+        value=True,
+        help="Use /triage/stream and show safety and sentiment as soon as they are known, before GPT finishes.",
+    )
 
     st.markdown("---")
     st.subheader("Quick Examples")
@@ -168,6 +177,63 @@ def explain_services(resp: dict) -> str:
 def nice_json(obj):
     return json.dumps(obj, indent=2, ensure_ascii=False)
 
+
+def sibling_url(api_url: str, suffix: str) -> str:
+    # /api/triage?code=... -> /api/triage/<suffix>?code=...
+    parts = urlsplit(api_url)
+    return urlunsplit(parts._replace(path=parts.path.rstrip("/") + "/" + suffix))
+
+
+def run_progressive(api_url: str, payload: dict):
+    """
+    POST to the streaming endpoint and, while it runs, poll its events so each stage is shown
+    as soon as it finishes. Returns the response and the final result (None on error).
+    """
+    job_id = str(uuid.uuid4())
+    st.markdown("#### Live progress")
+    slots = {k: st.empty() for k in ("safety", "sentiment", "gpt")}
+    for k, slot in slots.items():
+        slot.caption(f"{k.title()}: waiting…")
+    gpt_text = []
+
+    def show(e):
+        kind, d = e.get("event"), e.get("data")
+        if kind == "safety":
+            verdict = "🚫 **BLOCKED**" if d.get("blocked") else "✅ not blocked"
+            slots["safety"].markdown(f"**Safety:** {verdict} _({e.get('ms', 0):.0f} ms)_")
+        elif kind == "sentiment":
+            slots["sentiment"].markdown(f"**Sentiment:** {d.get('sentiment', 'unknown').title()} _({e.get('ms', 0):.0f} ms)_")
+        elif kind == "gpt_delta":
+            gpt_text.append(d)
+            slots["gpt"].code("".join(gpt_text))
+        elif kind == "gpt":
+            skipped = " (GPT skipped: security playbook)" if e.get("skipped") else ""
+            slots["gpt"].markdown(f"**GPT:** {d.get('priority', 'unknown').title()}{skipped} _({e.get('ms', 0):.0f} ms)_")
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        fut = ex.submit(requests.post, sibling_url(api_url, "stream"), params={"id": job_id}, json=payload, timeout=40)
+        offset = 0
+        while not fut.done():
+            try:
+                page = requests.get(sibling_url(api_url, f"events/{job_id}"), params={"offset": offset}, timeout=5)
+                if page.status_code == 200:
+                    doc = page.json()
+                    for e in doc["events"]:
+                        show(e)
+                    offset = doc["next_offset"]
+            except requests.exceptions.RequestException:
+                pass  # the final response still carries every event
+            time.sleep(0.3)
+        r = fut.result()
+
+    events = []
+    if r.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+        events = [json.loads(line) for line in r.text.splitlines() if line.strip()]
+    for e in events:
+        if e.get("event") in ("safety", "sentiment", "gpt"):
+            show(e)
+    return r, next((e["data"] for e in events if e.get("event") == "result"), None)
+
 # -----------------------------
 # Call API & Render
 # -----------------------------
@@ -176,12 +242,15 @@ if submitted:
         st.warning("Please enter a subject and/or body to analyze.")
     else:
         try:
-            with st.spinner("Contacting triage service…"):
-                r = requests.post(api_url, json={"subject": subj, "body": body}, timeout=40)
-            if r.status_code != 200:
+            if progressive:
+                r, data = run_progressive(api_url, {"subject": subj, "body": body})
+            else:
+                with st.spinner("Contacting triage service…"):
+                    r = requests.post(api_url, json={"subject": subj, "body": body}, timeout=40)
+                data = r.json() if r.status_code == 200 else None
+            if r.status_code != 200 or data is None:
                 st.error(f"API returned {r.status_code}: {r.text}")
             else:
-                data = r.json()
 
                 # Header summary
                 top_l, top_r = st.columns([0.7, 0.3])
@@ -287,4 +356,4 @@ if submitted:
 # Footer
 st.markdown("<div class='hr'></div>", unsafe_allow_html=True)
 st.caption(
-    "This dashboard calls your local Azure Function `/api/triage`. It uses Azure AI Content Safety for harm categories, Azure AI Language for sentiment, and Azure OpenAI for classification & suggested actions. Policies: block if any category severity ≥ 4; otherwise combine sentiment and GPT rationale for priority.")
+    "This dashboard calls your local Azure Function `/api/triage` (or `/api/triage/stream` with partial results on). It uses Azure AI Content Safety for harm categories, Azure AI Language for sentiment, and Azure OpenAI for classification & suggested actions. Policies: block if any category severity ≥ 4; otherwise combine sentiment and GPT rationale for priority.")
@@ -1,16 +1,21 @@
-import json, logging, uuid
+import json, time, logging
 import azure.functions as func
-from azure.ai.contentsafety.models import AnalyzeTextOptions, TextCategory
-from common.clients import (
-    load_settings, make_text_analytics_client, make_content_safety_client,
-    make_openai_client, make_blob_client, write_json, now_iso
-)
-from common.models import TriageInput, SentimentResult, GPTClassification, TriageOutput
-from common.logic import map_safety, combine_priority, routing_hint
+from common.clients import get_pool, warm_up_in_background
+from common.archive import get_archive
+from common.metrics import request_timings
+from common.models import TriageInput
+from common.pipeline import triage, StageTimeout
+from common.ratelimit import Throttled
+from common.resilience import BreakerOpen
+from common.serialization import encode_result
+
+# With WARMUP_ON_LOAD, SDK imports and connection setup start while the host finishes loading
+warm_up_in_background()
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Processing email triage request...")
+    started = time.perf_counter()
 
     try:
         payload = req.get_json()
@@ -18,64 +23,42 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse(json.dumps({"error": "Invalid JSON"}), status_code=400)
 
     ti = TriageInput(**payload)
-    s = load_settings()
-    ta = make_text_analytics_client(s)
-    cs = make_content_safety_client(s)
-    oa = make_openai_client(s)
-    bs = make_blob_client(s)
-
-    # 1️⃣ Content Safety
-    cs_resp = cs.analyze_text(AnalyzeTextOptions(
-        text=ti.body,
-        categories=[TextCategory.HATE, TextCategory.VIOLENCE, TextCategory.SELF_HARM, TextCategory.SEXUAL]
-    ))
-    safety = map_safety(cs_resp)
-
-    # 2️⃣ Sentiment
-    sa = ta.analyze_sentiment([ti.body])[0]
-    sentiment = SentimentResult(
-        sentiment=sa.sentiment,
-        confidence={
-            "positive": sa.confidence_scores.positive,
-            "neutral": sa.confidence_scores.neutral,
-            "negative": sa.confidence_scores.negative
-        }
-    )
-
-    # 3️⃣ GPT classification
-    system = "You are an IT support triage assistant. Classify email priority (high/medium/low) and suggest 1-3 actions."
-    user = f"Subject: {ti.subject}\nBody: {ti.body}\nSender: {ti.sender}\nImportance: {ti.importance}"
-    chat = oa.chat.completions.create(
-        model=s["openai_deployment"],
-        messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-        temperature=0.0,
-        max_tokens=250
-    )
-
-    msg = chat.choices[0].message.content or ""
-    pr = "medium"
-    if "high" in msg.lower(): pr = "high"
-    elif "low" in msg.lower(): pr = "low"
+    pool = get_pool()
+    s = pool.settings
+    tm = request_timings(s)
+    tm.since("init", started)
 
-    gpt = GPTClassification(priority=pr, reason=msg, suggested_actions=msg.split("\n"))
-
-    # Combine and route
-    combined = combine_priority(safety, sentiment, gpt)
-    route = routing_hint(combined)
-
-    out = TriageOutput(
-        safety=safety,
-        sentiment=sentiment,
-        gpt=gpt,
-        combined_priority=combined,
-        routing_hint=route,
-        metadata={
-            "id": str(uuid.uuid4()),
-            "timestamp": now_iso(),
-            "subject": ti.subject,
-            "sender": ti.sender
-        }
-    )
+    # Stages fan out concurrently; GPT is cancelled or dropped when Content Safety blocks (SAFETY_POLICY)
+    try:
+        out = triage(ti, pool, timings=tm)
+    except StageTimeout as ex:
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="timeout", stage=ex.stage)
+        return func.HttpResponse(json.dumps({"error": str(ex), "stage": ex.stage}),
+                                 mimetype="application/json", status_code=504)
+    except Throttled as ex:
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="throttled", stage=ex.lane)
+        return func.HttpResponse(json.dumps({"error": str(ex)}), mimetype="application/json", status_code=503,
+                                 headers={"Retry-After": str(max(int(ex.retry_after + 0.999), 1))})
+    except BreakerOpen as ex:
+        # Safety is required; its endpoints are failing, so fail fast rather than wait on them
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="unavailable", stage=ex.name)
+        return func.HttpResponse(json.dumps({"error": str(ex)}), mimetype="application/json", status_code=503,
+                                 headers={"Retry-After": str(max(int(ex.retry_after + 0.999), 1))})
+    except Exception:
+        tm.count("requests_total", outcome="error", stage="")
+        raise
 
-    write_json(bs, s["blob_container"], f"{out.metadata['id']}.json", json.loads(out.model_dump_json()))
-    return func.HttpResponse(out.model_dump_json(), mimetype="application/json", status_code=200)
+    # Serialization and archive time land in the histograms (the response body is already built).
+    # The result is encoded once; the archive writer reuses the same bytes.
+    t = time.perf_counter()
+    enc = encode_result(out)
+    t = tm.since("serialize", t)
+    # Archived off the request path by the background writer
+    get_archive(s, lambda: get_pool().blob).submit(f"{out.metadata['id']}.json", enc)
+    tm.since("archive", t)
+    tm.since("request", started)
+    tm.count("requests_total", outcome="ok", stage="")
+    return func.HttpResponse(enc.json, mimetype="application/json", status_code=200)
@@ -0,0 +1,43 @@
+import json, logging
+import azure.functions as func
+from common.clients import get_pool
+from common.archive import get_archive
+from common.batch import parse_batch, triage_batch
+from common.serialization import dumps, encode_result
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Batch triage: JSON array or NDJSON of TriageInput in, NDJSON out (one line per item, input order).
+    Each line is {"index": n, "result": TriageOutput} or {"index": n, "error": "..."}.
+    """
+    try:
+        items = parse_batch(req.get_body())
+    except ValueError:
+        return func.HttpResponse(json.dumps({"error": "Invalid JSON or NDJSON"}), status_code=400)
+
+    pool = get_pool()
+    s = pool.settings
+    if len(items) > s["batch_max_items"]:
+        return func.HttpResponse(
+            json.dumps({"error": f"Batch too large ({len(items)} > {s['batch_max_items']})"}), status_code=413
+        )
+
+    logging.info("Processing email triage batch of %d items...", len(items))
+    archive = get_archive(s, lambda: get_pool().blob)
+    lines = []
+    errors = 0
+    for item in triage_batch(items, pool):
+        out = item.get("result")
+        if out is None:
+            errors += 1
+            lines.append(dumps(item))
+            continue
+        enc = encode_result(out)
+        archive.submit(f"{out.metadata['id']}.json", enc)
+        lines.append(b'{"index":%d,"result":%s}' % (item["index"], enc.json))
+
+    logging.info("Batch finished: %d ok, %d errors", len(items) - errors, errors)
+    # The v1 Python worker buffers HTTP responses, so lines are joined here; each line is
+    # final as soon as it is produced, so clients can still parse the body incrementally.
+    return func.HttpResponse(b"\n".join(lines) + b"\n", mimetype="application/x-ndjson", status_code=200)
@@ -0,0 +1,30 @@
+import json, logging
+import azure.functions as func
+from pydantic import ValidationError
+from common.clients import get_pool
+from common.models import TriageInput
+from common.jobs import new_job_message
+
+
+def main(req: func.HttpRequest, msg: func.Out[str]) -> func.HttpResponse:
+    """
+    Accept a TriageInput, enqueue it for triage_worker and return 202 with a job id.
+    """
+    try:
+        payload = req.get_json()
+        ti = TriageInput(**payload)
+    except (ValueError, TypeError, ValidationError):
+        return func.HttpResponse(json.dumps({"error": "Invalid JSON"}), status_code=400)
+
+    s = get_pool().settings
+    job_id, body = new_job_message(ti, s, lambda: get_pool().blob)
+    msg.set(body)
+    logging.info("Enqueued triage job %s", job_id)
+
+    status_url = f"/api/triage/status/{job_id}"
+    return func.HttpResponse(
+        json.dumps({"job_id": job_id, "status": "queued", "status_url": status_url}),
+        mimetype="application/json",
+        status_code=202,
+        headers={"Location": status_url, "Retry-After": "2"},
+    )
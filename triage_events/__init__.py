@@ -0,0 +1,32 @@
+import json
+import azure.functions as func
+from common.clients import get_pool
+from common.jobs import FINAL_EVENTS, is_job_id, read_job_events
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Events of a streamed triage written after byte `?offset=` (default 0): 200 with
+    `{"events": [...], "next_offset": n, "done": bool}`, 202 until the first event is written.
+    """
+    job_id = req.route_params.get("job_id", "")
+    if not is_job_id(job_id):
+        return func.HttpResponse(json.dumps({"error": "Invalid job id"}), status_code=400)
+    try:
+        offset = max(int(req.params.get("offset") or 0), 0)
+    except ValueError:
+        return func.HttpResponse(json.dumps({"error": "Invalid offset"}), status_code=400)
+
+    pool = get_pool()
+    found = read_job_events(pool.blob, pool.settings, job_id, offset)
+    if found is None:
+        return func.HttpResponse(
+            json.dumps({"job_id": job_id, "events": [], "next_offset": 0, "done": False}),
+            mimetype="application/json", status_code=202, headers={"Retry-After": "1"},
+        )
+    events, next_offset = found
+    done = any(e.get("event") in FINAL_EVENTS for e in events)
+    return func.HttpResponse(
+        json.dumps({"job_id": job_id, "events": events, "next_offset": next_offset, "done": done}),
+        mimetype="application/json", status_code=200,
+    )
@@ -0,0 +1,22 @@
+import json
+import azure.functions as func
+from common.clients import get_pool
+from common.jobs import is_job_id, read_job_status
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    200 with the job document when finished (status "done" or "failed"), 202 while still pending.
+    """
+    job_id = req.route_params.get("job_id", "")
+    if not is_job_id(job_id):
+        return func.HttpResponse(json.dumps({"error": "Invalid job id"}), status_code=400)
+
+    pool = get_pool()
+    doc = read_job_status(pool.blob, pool.settings, job_id)
+    if doc is None:
+        return func.HttpResponse(
+            json.dumps({"job_id": job_id, "status": "pending"}),
+            mimetype="application/json", status_code=202, headers={"Retry-After": "2"},
+        )
+    return func.HttpResponse(json.dumps(doc), mimetype="application/json", status_code=200)
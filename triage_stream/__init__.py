@@ -0,0 +1,75 @@
+import json, time, uuid, logging
+import azure.functions as func
+from pydantic import ValidationError
+from common.clients import get_pool, warm_up_in_background
+from common.archive import get_archive
+from common.jobs import JobEvents, is_job_id
+from common.metrics import request_timings
+from common.models import TriageInput
+from common.pipeline import triage, StageTimeout
+from common.ratelimit import Throttled
+from common.resilience import BreakerOpen
+from common.serialization import encode_result
+
+# With WARMUP_ON_LOAD, SDK imports and connection setup start while the host finishes loading
+warm_up_in_background()
+
+NDJSON = "application/x-ndjson"
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Triage one message and report each stage as it finishes, as NDJSON events:
+    `accepted`, `safety`, `sentiment`, `gpt_delta` (streamed reply), `gpt`, then `result`
+    (the TriageOutput) or `error`. The Python worker sends a response only once it is complete,
+    so the same events are appended to `jobs/{id}.events.ndjson` as they happen and clients
+    poll `/api/triage/events/{id}` meanwhile; pass `?id=<uuid>` to know the id up front.
+    """
+    started = time.perf_counter()
+    try:
+        ti = TriageInput(**req.get_json())
+    except (ValueError, TypeError, ValidationError):
+        return func.HttpResponse(json.dumps({"error": "Invalid JSON"}), status_code=400)
+    job_id = req.params.get("id") or str(uuid.uuid4())
+    if not is_job_id(job_id):
+        return func.HttpResponse(json.dumps({"error": "Invalid id"}), status_code=400)
+
+    pool = get_pool()
+    s = pool.settings
+    tm = request_timings(s)
+    tm.since("init", started)
+    events = JobEvents(pool.blob, s, job_id)
+    events.emit({"event": "accepted", "id": job_id})
+
+    status, headers = 200, {"X-Triage-Id": job_id}
+    try:
+        out = triage(ti, pool, {"id": job_id}, timings=tm, on_event=events.emit)
+        result = encode_result(out)
+        events.emit({"event": "result"}, data=result.json)
+        get_archive(s, lambda: get_pool().blob).submit(f"{job_id}.json", result)
+        tm.count("requests_total", outcome="ok", stage="")
+    except StageTimeout as ex:
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="timeout", stage=ex.stage)
+        events.emit({"event": "error", "error": str(ex), "stage": ex.stage})
+        status = 504
+    except Throttled as ex:
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="throttled", stage=ex.lane)
+        events.emit({"event": "error", "error": str(ex)})
+        status = 503
+        headers["Retry-After"] = str(max(int(ex.retry_after + 0.999), 1))
+    except BreakerOpen as ex:
+        logging.warning(str(ex))
+        tm.count("requests_total", outcome="unavailable", stage=ex.name)
+        events.emit({"event": "error", "error": str(ex)})
+        status = 503
+        headers["Retry-After"] = str(max(int(ex.retry_after + 0.999), 1))
+    except Exception as ex:
+        tm.count("requests_total", outcome="error", stage="")
+        events.emit({"event": "error", "error": str(ex)})
+        events.close()
+        raise
+    events.close()
+    tm.since("request", started)
+    return func.HttpResponse(b"".join(events.lines), mimetype=NDJSON, status_code=status, headers=headers)
@@ -0,0 +1,37 @@
+import json, logging
+import azure.functions as func
+from common.clients import get_pool, warm_up_in_background
+from common.archive import get_archive
+from common.jobs import load_job_input, write_job_status
+from common.pipeline import triage
+from common.serialization import encode_result
+
+# With WARMUP_ON_LOAD, SDK imports and connection setup start while the host finishes loading
+warm_up_in_background()
+
+
+def main(msg: func.QueueMessage) -> None:
+    """
+    Drain triage-jobs: run the pipeline, write the job status blob, archive the result.
+    The host fetches messages in batches (host.json `queues.batchSize`) and runs them concurrently.
+    Exceptions are re-raised so the message is retried; the final attempt records the failure.
+    """
+    job = json.loads(msg.get_body().decode("utf-8"))
+    job_id = job["job_id"]
+    pool = get_pool()
+    s = pool.settings
+    bs = pool.blob
+
+    try:
+        ti = load_job_input(job, s, bs)
+        out = triage(ti, pool, {"id": job_id, "enqueued_at": job.get("enqueued_at")})
+    except Exception as ex:
+        logging.warning("Triage job %s failed (attempt %d): %s", job_id, msg.dequeue_count, ex)
+        if msg.dequeue_count >= s["jobs_max_dequeue"]:
+            write_job_status(bs, s, job_id, "failed", error=str(ex))
+        raise
+
+    result = encode_result(out)
+    write_job_status(bs, s, job_id, "done", result=result)
+    get_archive(s, lambda: get_pool().blob).submit(f"{job_id}.json", result)
+    logging.info("Triage job %s done: %s", job_id, out.combined_priority)
@@ -0,0 +1,12 @@
+import logging
+import azure.functions as func
+from common.clients import get_pool
+
+
+def main(warmupContext: func.Context) -> None:
+    """
+    Runs when the platform adds an instance (Premium / Elastic Premium plans), before it takes
+    traffic: build every client and open its connection so the first request pays neither.
+    """
+    spent = get_pool().warm_up()
+    logging.info("Warm-up done: %s", spent)